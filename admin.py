@@ -10,10 +10,17 @@ Usage:
 
 Commands:
     db:init        - Initialize the database tables
+    db:migrate     - Add tables and columns missing from an existing database
+    db:backfill    - Compute digests for static files stored without them
+    db:gc          - Report and remove static blobs no file references
+    storage:status - Show how many blobs each storage backend holds
+    storage:move   - Move every static blob to one storage backend (--to)
     db:seed        - Seed the database with sample data (including static files)
+    static:sync    - Sync new, changed (and with --delete, removed) static files
     db:reset       - Reset the database (WARNING: destroys all data)
-    db:backup      - Backup the database to a file
-    db:restore     - Restore the database from a backup
+    db:backup      - Online backup of the database, with a checksum manifest
+    db:restore     - Verify a backup and copy it into the live database
+    disk:rebuild   - Export static files to the local disk tier, verifying and pruning it
     check:config   - Check and validate configuration
     health:check   - Run application health checks
     cache:clear    - Clear application caches
@@ -26,10 +33,12 @@ import shutil
 import json
 import datetime
 import mimetypes
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from dotenv import load_dotenv
 # In the health_check function
-from sqlalchemy import text, inspect
+from sqlalchemy import text, inspect, update, or_
 
 # Load environment variables first
 load_dotenv()
@@ -41,18 +50,126 @@ sys.path.insert(0, str(project_root))
 
 # Import application components after setting up the path
 from main import create_app, db
-from main.models import Page, Book, Animal, StaticFile
+from main.models import Page, Book, Animal, StaticFile, StaticBlob
+from main import catalog
 from main.config import get_config
+from main.assets import (compress_variants, variant_filename, image_derivatives, derivative_filename,
+                         is_compressible, is_resizable)
+from main.migrations import upgrade_schema
+from main.disk_tier import DiskTier
+from main.sqlite import sqlite_database_path, backup_database, restore_database
 
 
 def db_init():
     """Initialize database tables."""
     app = create_app()
     with app.app_context():
-        db.create_all()
+        upgrade_schema()
         print("✅ Database tables created successfully")
 
 
+def db_migrate():
+    """Bring an existing database schema up to date with the models."""
+    app = create_app()
+    with app.app_context():
+        changes = upgrade_schema()
+        for change in changes:
+            print(change)
+        print(f"✅ Schema up to date ({len(changes)} changes applied)")
+
+
+def db_backfill():
+    """Store digests and sizes for static files uploaded before they were tracked.
+
+    Contents stored inline by older versions are hashed as they are moved
+    into the content-addressed blob table, one BLOB at a time.
+    """
+    app = create_app()
+    with app.app_context():
+        changes = upgrade_schema()
+        for change in changes:
+            print(change)
+
+        missing = StaticFile.query.filter(StaticFile.digest.is_(None)).count()
+        if missing:
+            print(f"⚠️ {missing} static files have no stored contents")
+        else:
+            print("✅ All static files have digests")
+
+
+def db_gc():
+    """Recount static blob references and delete blobs no file uses."""
+    app = create_app()
+    with app.app_context():
+        references = dict(db.session.query(StaticFile.digest, db.func.count(StaticFile.id))
+                          .group_by(StaticFile.digest))
+        fixed = removed = freed = 0
+        for blob in StaticBlob.query.all():
+            count = references.get(blob.digest, 0)
+            if count == 0:
+                freed += blob.size
+                removed += 1
+                db.session.delete(blob)
+            elif blob.ref_count != count:
+                blob.ref_count = count
+                fixed += 1
+        db.session.commit()
+
+        # Objects in other backends whose blob row is gone (deleted files, interrupted uploads)
+        known = {digest for (digest,) in db.session.query(StaticBlob.digest)}
+        pruned = 0
+        for backend in app.extensions['storage'].backends.values():
+            stored = backend.digests()
+            for digest in (stored or set()) - known:
+                backend.remove(None, digest)
+                pruned += 1
+        print(f"✅ Removed {removed} unreferenced blobs ({freed} bytes), fixed {fixed} reference counts, "
+              f"pruned {pruned} orphaned objects from storage backends")
+
+
+def storage_status():
+    """Show how many blobs and bytes each storage backend holds."""
+    app = create_app()
+    with app.app_context():
+        storage = app.extensions['storage']
+        placed = {location: (count, size or 0) for location, count, size in
+                  db.session.query(StaticBlob.location, db.func.count(StaticBlob.id), db.func.sum(StaticBlob.size))
+                  .group_by(StaticBlob.location)}
+        print(f"New blobs go to: {storage.default}")
+        for name in storage.backends:
+            count, size = placed.pop(name, (0, 0))
+            print(f"  {name}: {count} blobs, {size} bytes")
+        for name, (count, size) in placed.items():
+            print(f"  ⚠️ {name} (not configured): {count} blobs, {size} bytes")
+    return 0
+
+
+def storage_move(target):
+    """Move every static blob into one storage backend, e.g. to take the bytes out of SQLite."""
+    app = create_app()
+    with app.app_context():
+        storage = app.extensions['storage']
+        if target not in storage.backends:
+            print(f"❌ Unknown backend {target!r}; configured: {', '.join(storage.backends)}")
+            return 1
+
+        blobs = (db.session.query(StaticBlob.id, StaticBlob.digest, StaticBlob.size, StaticBlob.location)
+                 .filter(StaticBlob.location != target).order_by(StaticBlob.id).all())
+        moved = moved_bytes = 0
+        for blob_id, digest, size, location in blobs:
+            try:
+                if storage.move(blob_id, digest, size, target):
+                    moved += 1
+                    moved_bytes += size
+            except Exception as e:
+                db.session.rollback()
+                print(f"❌ Could not move blob {digest[:12]} from {location}: {e}")
+        print(f"✅ Moved {moved} of {len(blobs)} blobs ({moved_bytes} bytes) to {target}")
+        if moved and target != 'db' and app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+            print("SQLite reuses the freed pages; run VACUUM during a quiet period to shrink the file")
+    return 0 if moved == len(blobs) else 1
+
+
 def get_content_type(file_path):
     """Determine the content type of a file."""
     guessed_type = mimetypes.guess_type(file_path)[0]
@@ -78,113 +195,257 @@ def get_content_type(file_path):
     return content_types.get(ext, 'application/octet-stream')
 
 
-def upload_static_files(app_context):
-    """Upload all static files to the database."""
-    # The base directory for static files
-    static_dir = Path(app_context.root_path) / 'static'
+def hash_file(file_path, chunk_size=1024 * 1024):
+    """Return the SHA-256 digest of a file without reading it into memory at once."""
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def prepare_static_file(file_path, rel_path, derivative_widths):
+    """Read a file and build its compressed variants and image derivatives.
+
+    Runs on the sync thread pool; gzip, brotli and Pillow release the GIL
+    for most of their work, so files are prepared in parallel.
+    """
+    with open(file_path, 'rb') as f:
+        file_data = f.read()
+    content_type = get_content_type(file_path)
+    return {
+        'filename': rel_path,
+        'content_type': content_type,
+        'data': file_data,
+        'encoded': compress_variants(file_data, content_type),
+        'derivatives': image_derivatives(file_data, content_type, derivative_widths),
+    }
+
+
+def attach_variants(static_file, prepared):
+    """Replace a file's variants with the ones prepared for its current contents."""
+    if static_file.variants:
+        # Delete explicitly so blob references are released, and flush before
+        # re-creating variants so their filenames stay unique
+        for variant in static_file.variants:
+            db.session.delete(variant)
+        static_file.variants = []
+        db.session.flush()
+    static_file.variants = [
+        StaticFile(
+            filename=variant_filename(static_file.filename, encoding),
+            content_type=static_file.content_type,
+            encoding=encoding,
+            data=compressed
+        )
+        for encoding, compressed in prepared['encoded'].items()
+    ] + [
+        StaticFile(
+            filename=derivative_filename(static_file.filename, width, extension),
+            content_type=content_type,
+            width=width,
+            data=resized
+        )
+        for width, content_type, extension, resized in prepared['derivatives']
+    ]
 
+
+def scan_static_dir(static_dir):
+    """Map each file's path relative to ``static_dir`` (POSIX style) to its full path."""
+    return {
+        path.relative_to(static_dir).as_posix(): path
+        for path in sorted(static_dir.rglob('*')) if path.is_file()
+    }
+
+
+def diff_static_files(local_files, workers):
+    """Compare files on disk with the database in one query plus parallel hashing.
+
+    Returns ``(added, changed, removed, unchanged)`` lists of relative paths.
+    """
+    stored = dict(db.session.query(StaticFile.filename, StaticFile.digest)
+                  .filter(StaticFile.variant_of_id.is_(None)))
+
+    candidates = [rel_path for rel_path in local_files if rel_path in stored]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        digests = dict(zip(candidates, pool.map(hash_file, (local_files[p] for p in candidates))))
+
+    added = [rel_path for rel_path in local_files if rel_path not in stored]
+    changed = [rel_path for rel_path in candidates if digests[rel_path] != stored[rel_path]]
+    unchanged = [rel_path for rel_path in candidates if digests[rel_path] == stored[rel_path]]
+    removed = sorted(set(stored) - set(local_files))
+    return added, changed, removed, unchanged
+
+
+def files_without_variants(local_files, paths, derivative_widths):
+    """Paths among ``paths`` that could have variants but were never given a chance to.
+
+    These were synced before precompressed variants and image derivatives
+    existed, so a sync backfills them even though their contents are unchanged.
+    Files whose variants were already generated for their current contents
+    are skipped, including those where no variant was worth storing.
+    """
+    settled = {filename for (filename,) in db.session.query(StaticFile.filename).filter(
+        StaticFile.variant_of_id.is_(None),
+        or_(StaticFile.variants_digest == StaticFile.digest, StaticFile.variants.any()))}
+    missing = []
+    for rel_path in paths:
+        if rel_path in settled:
+            continue
+        content_type = get_content_type(local_files[rel_path])
+        if is_compressible(content_type) or (derivative_widths and is_resizable(content_type)):
+            missing.append(rel_path)
+    return missing
+
+
+def sync_static_files(app_context, delete=False, dry_run=False, regenerate=False,
+                      workers=None, batch_size=50):
+    """Incrementally sync the static directory into the database.
+
+    New files are inserted and changed files replaced (with fresh variants).
+    Unchanged files whose variants were never generated get them added. With
+    ``regenerate`` every file's variants are rebuilt. With ``delete`` files
+    no longer on disk are removed too. Writes are
+    committed in batches of ``batch_size`` files.
+    """
+    static_dir = Path(app_context.root_path) / 'static'
     if not static_dir.exists():
         print(f"❌ Static directory {static_dir} does not exist!")
         return False
 
-    print(f"Uploading files from {static_dir}")
-
-    # Count files for progress reporting
-    total_files = sum(1 for _ in static_dir.glob('**/*') if _.is_file())
-    if total_files == 0:
-        print("No static files found to upload")
+    workers = workers or min(8, (os.cpu_count() or 1) + 2)
+    derivative_widths = app_context.config.get('IMAGE_DERIVATIVE_WIDTHS', [])
+    local_files = scan_static_dir(static_dir)
+    print(f"Syncing {len(local_files)} files from {static_dir} using {workers} threads")
+
+    added, changed, removed, unchanged = diff_static_files(local_files, workers)
+    if regenerate:
+        changed, unchanged = changed + unchanged, []
+    backfill = files_without_variants(local_files, unchanged, derivative_widths)
+    unchanged = [rel_path for rel_path in unchanged if rel_path not in backfill]
+
+    for label, paths in (('+', added), ('~', changed), ('*', backfill), ('-' if delete else '!', removed)):
+        for rel_path in paths:
+            print(f"  {label} {rel_path}")
+    print(f"{len(added)} new, {len(changed)} changed, {len(backfill)} missing variants, "
+          f"{len(removed)} missing on disk, {len(unchanged)} unchanged")
+    if removed and not delete:
+        print("Files missing on disk are kept; pass --delete to remove them")
+
+    if dry_run:
+        print("Dry run: no changes written")
         return True
-    
-    processed = 0
-    success_count = 0
 
-    # Walk through all files in the static directory
-    for root, _, files in os.walk(static_dir):
-        for filename in files:
-            file_path = os.path.join(root, filename)
+    to_write = added + changed + backfill
+    existing = {}
+    if changed or backfill:
+        existing = {static_file.filename: static_file for static_file in
+                    StaticFile.query.filter(StaticFile.filename.in_(changed + backfill))}
+
+    backfill_set = set(backfill)
+    written = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for batch_start in range(0, len(to_write), batch_size):
+            batch = to_write[batch_start:batch_start + batch_size]
+            jobs = [pool.submit(prepare_static_file, local_files[rel_path], rel_path, derivative_widths)
+                    for rel_path in batch]
+            for job in jobs:
+                try:
+                    prepared = job.result()
+                except Exception as e:
+                    print(f"❌ Error reading file: {e}")
+                    continue
+
+                static_file = existing.get(prepared['filename'])
+                if prepared['filename'] in backfill_set:
+                    if prepared['encoded'] or prepared['derivatives']:
+                        attach_variants(static_file, prepared)
+                        written += 1
+                    # Same contents: keep updated_at so caches keyed on it stay valid
+                    db.session.execute(update(StaticFile).where(StaticFile.id == static_file.id)
+                                       .values(variants_digest=static_file.digest,
+                                               updated_at=StaticFile.updated_at))
+                    continue
+                if static_file is None:
+                    static_file = StaticFile(filename=prepared['filename'],
+                                             content_type=prepared['content_type'])
+                    db.session.add(static_file)
+                static_file.content_type = prepared['content_type']
+                static_file.data = prepared['data']
+                static_file.variants_digest = static_file.digest
+                attach_variants(static_file, prepared)
+                written += 1
 
-            # Create relative path from static directory
-            rel_path = os.path.relpath(file_path, static_dir)
+            db.session.commit()
+            print(f"Progress: {min(batch_start + batch_size, len(to_write))}/{len(to_write)} files written")
 
-            # Check if file already exists in database
-            existing = StaticFile.query.filter_by(filename=rel_path).first()
+    if delete and removed:
+        for batch_start in range(0, len(removed), batch_size):
+            batch = removed[batch_start:batch_start + batch_size]
+            for static_file in StaticFile.query.filter(StaticFile.filename.in_(batch)):
+                db.session.delete(static_file)
+            db.session.commit()
 
-            if existing:
-                print(f"File {rel_path} already exists in database, skipping...")
-            else:
-                try:
-                    # Read file content
-                    with open(file_path, 'rb') as f:
-                        file_data = f.read()
+    print(f"✅ {written} static files written, {len(removed) if delete else 0} removed")
+    return True
 
-                    # Create database record
-                    static_file = StaticFile(
-                        filename=rel_path,
-                        content_type=get_content_type(file_path),
-                        data=file_data
-                    )
 
-                    db.session.add(static_file)
-                    success_count += 1
-                    print(f"Added file: {rel_path}")
-                except Exception as e:
-                    print(f"❌ Error uploading {rel_path}: {e}")
+def upload_static_files(app_context, **options):
+    """Upload new and changed static files to the database."""
+    return sync_static_files(app_context, **options)
+
 
-            processed += 1
-            if processed % 10 == 0 or processed == total_files:
-                print(f"Progress: {processed}/{total_files} files processed")
+def seed_catalog():
+    """Create the shipped book, or fill in page images and sounds on an older seed."""
+    book = Book.query.order_by(Book.id).first()
+    if book is None:
+        book = Book(**catalog.BOOK)
+        for number, animal_name, image, sound in catalog.PAGES:
+            book.pages.append(Page(number=number, content=catalog.page_content(animal_name),
+                                   animal=Animal(name=animal_name), image=image, sound=sound))
+        db.session.add(book)
+        db.session.commit()
+        print(f"✅ Database seeded with book and {len(catalog.PAGES)} animals/pages")
+        return
 
-    # Commit all changes
+    print("⚠️ Database already contains book data.")
+    pages_by_animal = {page.animal.name: page for page in book.pages}
+    updated = 0
+    for number, animal_name, image, sound in catalog.PAGES:
+        page = pages_by_animal.get(animal_name)
+        if page is not None and (page.image, page.sound) == (None, None):
+            page.image, page.sound = image, sound
+            updated += 1
+    if book.illustrator is None and book.title == catalog.BOOK['title']:
+        book.illustrator = catalog.BOOK['illustrator']
     db.session.commit()
-    print(f"✅ {success_count}/{total_files} static files uploaded to database!")
-    return True
+    if updated:
+        print(f"✅ Added images and sounds to {updated} existing pages")
 
 
-def db_seed():
+def db_seed(assume_yes=False, **sync_options):
     """Seed the database with initial data and static files."""
     app = create_app()
     with app.app_context():
-        # Check if book data already exists
-        if Book.query.count() > 0:
-            print("⚠️ Database already contains book data.")
-        else:
-            # Create the book
-            book = Book(title="Brown Bear, Brown Bear, What Do You See?", author="Eric Carle")
-            db.session.add(book)
-
-            # Create animals and pages
-            animals = [
-                "Brown Bear", "Red Bird", "Yellow Duck", "Blue Horse",
-                "Green Frog", "Purple Cat", "White Dog", "Black Sheep",
-                "Goldfish", "Teacher", "Children"
-            ]
-
-            for i, animal_name in enumerate(animals, 1):
-                animal = Animal(name=animal_name)
-                db.session.add(animal)
-
-                # Create the corresponding page
-                page = Page(
-                    number=i,
-                    content=f"{animal_name}, {animal_name}, what do you see?",
-                    book_id=1,
-                    animal_id=i
-                )
-                db.session.add(page)
-
-            db.session.commit()
-            print(f"✅ Database seeded with book and {len(animals)} animals/pages")
+        seed_catalog()
         
         # Check if static files exist in the database
         static_files_count = StaticFile.query.count()
-        if static_files_count > 0:
+        if static_files_count > 0 and not assume_yes:
             print(f"⚠️ Database already contains {static_files_count} static files.")
-            proceed = input("Do you want to upload additional static files? (yes/no): ")
+            proceed = input("Do you want to sync new and changed static files? (yes/no): ")
             if proceed.lower() != "yes":
                 return
         
         # Upload static files
-        upload_static_files(app)
+        upload_static_files(app, **sync_options)
+
+
+def static_sync(**sync_options):
+    """Sync the static directory into the database without touching book data."""
+    app = create_app()
+    with app.app_context():
+        return 0 if sync_static_files(app, **sync_options) else 1
 
 
 def db_reset():
@@ -201,10 +462,20 @@ def db_reset():
         print("✅ Database reset complete")
 
 
-def db_backup():
-    """Backup SQLite database to a timestamped file."""
-    config = get_config()
-    db_path = config.SQLALCHEMY_DATABASE_URI.replace('sqlite:///', '')
+def _database_path():
+    return sqlite_database_path(get_config().SQLALCHEMY_DATABASE_URI)
+
+
+def db_backup(compress=False, pages_per_step=1024):
+    """Back up the SQLite database with the online backup API.
+
+    Pages are copied in steps so running workers are not blocked, and a
+    checksum manifest is written next to the backup.
+    """
+    db_path = _database_path()
+    if db_path is None or not os.path.exists(db_path):
+        print("❌ Backups need an existing SQLite database file")
+        return 1
 
     # Create backups directory if it doesn't exist
     backup_dir = project_root / 'backups'
@@ -212,59 +483,95 @@ def db_backup():
 
     # Create timestamped backup file
     timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-    backup_path = backup_dir / f"app_db_backup_{timestamp}.db"
+    backup_path = backup_dir / f"app_db_backup_{timestamp}.db{'.gz' if compress else ''}"
+
+    def report(copied, total):
+        print(f"\r  {copied}/{total} pages copied", end='', flush=True)
 
     try:
-        shutil.copy2(db_path, backup_path)
-        print(f"✅ Database backed up to {backup_path}")
+        manifest = backup_database(db_path, backup_path, pages_per_step=pages_per_step,
+                                   compress=compress, progress=report)
     except Exception as e:
-        print(f"❌ Backup failed: {e}")
+        print(f"\n❌ Backup failed: {e}")
+        return 1
+
+    seconds = max(manifest['seconds'], 0.001)
+    print(f"\n✅ Database backed up to {backup_path}")
+    print(f"   {manifest['pages']} pages, {manifest['database_bytes'] / 1e6:.1f} MB in {seconds:.2f}s "
+          f"({manifest['database_bytes'] / 1e6 / seconds:.1f} MB/s), "
+          f"{manifest['size'] / 1e6:.1f} MB on disk, sha256 {manifest['sha256'][:12]}")
+    return 0
 
 
-def db_restore():
-    """Restore database from a backup file."""
+def db_restore(backup_name=None, assume_yes=False):
+    """Verify a backup and copy it into the current database in one transaction."""
     backup_dir = project_root / 'backups'
     if not backup_dir.exists():
         print("❌ No backups directory found")
-        return
+        return 1
 
     # List available backups
-    backups = list(backup_dir.glob('*.db'))
+    backups = sorted(list(backup_dir.glob('*.db')) + list(backup_dir.glob('*.db.gz')))
     if not backups:
         print("❌ No backup files found in backups directory")
-        return
-
-    print("Available backups:")
-    for i, backup in enumerate(backups, 1):
-        print(f"{i}. {backup.name}")
-
-    # Ask user to select a backup
-    try:
-        selection = int(input("Enter the number of the backup to restore: "))
-        selected_backup = backups[selection - 1]
-    except (ValueError, IndexError):
-        print("❌ Invalid selection")
-        return
+        return 1
 
-    # Get database path
-    config = get_config()
-    db_path = config.SQLALCHEMY_DATABASE_URI.replace('sqlite:///', '')
+    if backup_name:
+        selected_backup = backup_dir / Path(backup_name).name
+        if selected_backup not in backups:
+            print(f"❌ No backup named {backup_name}")
+            return 1
+    else:
+        print("Available backups:")
+        for i, backup in enumerate(backups, 1):
+            print(f"{i}. {backup.name}")
+
+        # Ask user to select a backup
+        try:
+            selection = int(input("Enter the number of the backup to restore: "))
+            selected_backup = backups[selection - 1]
+        except (ValueError, IndexError):
+            print("❌ Invalid selection")
+            return 1
+
+    db_path = _database_path()
+    if db_path is None:
+        print("❌ Restores need a SQLite database file")
+        return 1
 
     # Confirm before overwriting
-    confirm = input(f"⚠️ This will overwrite the current database with {selected_backup.name}. Type 'yes' to confirm: ")
-    if confirm.lower() != "yes":
-        print("Operation cancelled.")
-        return
+    if not assume_yes:
+        confirm = input(f"⚠️ This will overwrite the current database with {selected_backup.name}. Type 'yes' to confirm: ")
+        if confirm.lower() != "yes":
+            print("Operation cancelled.")
+            return 1
 
     try:
-        # Stop the app if it's running
-        # In a production environment, you might need more sophisticated handling here
-
-        # Copy the backup over the current database
-        shutil.copy2(selected_backup, db_path)
-        print(f"✅ Database restored from {selected_backup.name}")
+        manifest = restore_database(selected_backup, db_path)
     except Exception as e:
         print(f"❌ Restore failed: {e}")
+        return 1
+
+    if manifest is None:
+        print(f"⚠️ {selected_backup.name} has no manifest; restored without checksum verification")
+    print(f"✅ Database restored from {selected_backup.name}; running workers will drop their caches")
+    return 0
+
+
+def disk_rebuild():
+    """Rebuild the local disk tier from the static_blobs table."""
+    app = create_app()
+    tier = DiskTier(app.config['DISK_TIER_DIR'], app.config.get('STATIC_STREAM_CHUNK_SIZE', 64 * 1024))
+    print(f"Rebuilding disk tier at {tier.root}")
+    with app.app_context():
+        try:
+            stats = tier.sync(verify=True, prune=True)
+        except Exception as e:
+            print(f"❌ Disk tier rebuild failed: {e}")
+            return 1
+    print(f"✅ Disk tier rebuilt: {stats['written']} written, {stats['verified']} verified, "
+          f"{stats['repaired']} repaired, {stats['pruned']} pruned")
+    return 0
 
 
 def check_config():
@@ -382,17 +689,49 @@ def cache_clear():
 def main():
     parser = argparse.ArgumentParser(description='Flask Brown Bear Admin Commands')
     parser.add_argument('command', help='Command to execute')
+    parser.add_argument('--yes', '-y', action='store_true',
+                        help='Answer yes to confirmation prompts (non-interactive)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='static:sync/db:seed: show what would change without writing')
+    parser.add_argument('--delete', action='store_true',
+                        help='static:sync/db:seed: remove files that are no longer on disk')
+    parser.add_argument('--regenerate', action='store_true',
+                        help='static:sync/db:seed: rebuild variants of unchanged files too '
+                             '(variants never generated are always added)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='static:sync/db:seed: threads used to hash and prepare files')
+    parser.add_argument('--compress', action='store_true',
+                        help='db:backup: gzip the backup file')
+    parser.add_argument('--pages-per-step', type=int, default=1024,
+                        help='db:backup: pages copied before the source lock is released')
+    parser.add_argument('--backup', default=None,
+                        help='db:restore: name of the backup to restore (skips the menu)')
+    parser.add_argument('--to', default=None,
+                        help='storage:move: backend to move every blob to (db, fs or s3)')
 
     args = parser.parse_args()
     command = args.command
+    sync_options = {
+        'delete': args.delete,
+        'dry_run': args.dry_run,
+        'regenerate': args.regenerate,
+        'workers': args.workers,
+    }
 
     # Command mapping
     commands = {
         'db:init': db_init,
-        'db:seed': db_seed,
+        'db:migrate': db_migrate,
+        'db:backfill': db_backfill,
+        'db:gc': db_gc,
+        'storage:status': storage_status,
+        'storage:move': lambda: storage_move(args.to),
+        'db:seed': lambda: db_seed(assume_yes=args.yes, **sync_options),
+        'static:sync': lambda: static_sync(**sync_options),
         'db:reset': db_reset,
-        'db:backup': db_backup,
-        'db:restore': db_restore,
+        'db:backup': lambda: db_backup(compress=args.compress, pages_per_step=args.pages_per_step),
+        'db:restore': lambda: db_restore(backup_name=args.backup, assume_yes=args.yes),
+        'disk:rebuild': disk_rebuild,
         'check:config': check_config,
         'health:check': health_check,
         'cache:clear': cache_clear,
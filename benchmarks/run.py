@@ -0,0 +1,545 @@
+#!/usr/bin/env python
+"""
+Load-test / and /static_db/ and report throughput, latency and memory.
+
+A temporary SQLite database is seeded with the real main/static tree plus
+synthetic large blobs, then each driver runs the same scenarios:
+
+    cold         every page and asset once, right after the app starts
+    warm         random pages and assets from concurrent clients
+    conditional  asset revalidations with If-None-Match (expects 304)
+    range        64 KiB Range requests into large files (expects 206)
+    slow_clients / while --slow-clients connections download the largest
+                 file at --slow-rate bytes/s (server drivers only)
+
+Drivers are the Flask test client (in-process) and a locally spawned
+gunicorn, either with gthread workers (gunicorn) or with uvicorn workers
+serving the ASGI app (asgi). Each scenario reports requests, RPS,
+p50/p95/p99 latency, errors and peak RSS as JSON:
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --compare baseline.json           # run, then compare
+    python benchmarks/run.py --compare baseline.json --results results.json
+
+Comparison exits with status 1 when any scenario's RPS drops, or its p95
+latency grows, by more than --threshold (default 10%).
+"""
+import argparse
+import contextlib
+import datetime
+import http.client
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import selectors
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+RANGE_WINDOW = 64 * 1024
+UNITS = {'k': 1024, 'm': 1024 * 1024, 'g': 1024 * 1024 * 1024}
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    if text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] if ordered else 0.0
+
+
+def benchmark_config(db_path):
+    from main.config import TestingConfig
+
+    return type('BenchmarkConfig', (TestingConfig,), {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'LOG_LEVEL': 'ERROR',
+        'METRICS_DIR': None,
+    })
+
+
+def seed_database(db_path, large_sizes):
+    """Fill a fresh database with main/static and synthetic blobs (run in a child process)."""
+    import admin
+    from main import create_app, db
+    from main.models import StaticFile
+
+    app = create_app(benchmark_config(db_path))
+    with app.app_context():
+        db.create_all()
+        with contextlib.redirect_stdout(io.StringIO()):
+            admin.sync_static_files(app)
+        rng = random.Random(0)
+        for size in large_sizes:
+            db.session.add(StaticFile(filename=f'bench/large_{size}.bin', content_type='application/octet-stream',
+                                      data=rng.randbytes(size)))
+        db.session.commit()
+
+
+def list_assets(db_path):
+    """Return ``[(filename, size)]`` of the stored originals."""
+    import sqlite3
+
+    connection = sqlite3.connect(db_path)
+    try:
+        return connection.execute(
+            'SELECT filename, size FROM static_files WHERE variant_of_id IS NULL ORDER BY filename').fetchall()
+    finally:
+        connection.close()
+
+
+class Requester:
+    """Issue GET requests and return ``(status, headers, body_length)``."""
+
+    def get(self, path, headers=None):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class ClientRequester(Requester):
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def get(self, path, headers=None):
+        response = self.client.get(path, headers=headers or {}, buffered=True)
+        return response.status_code, response.headers, len(response.get_data())
+
+
+class HttpRequester(Requester):
+    """One keep-alive connection per thread, reconnecting after errors."""
+
+    def __init__(self, port, timeout=60):
+        self.port = port
+        self.timeout = timeout
+        self.connection = None
+
+    def get(self, path, headers=None):
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=self.timeout)
+        try:
+            self.connection.request('GET', path, headers=headers or {})
+            response = self.connection.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            self.close()
+            raise
+        return response.status, response.headers, len(body)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class Driver:
+    name = None
+
+    def requester(self):
+        raise NotImplementedError
+
+    def peak_rss(self):
+        raise NotImplementedError
+
+    def stop(self):
+        pass
+
+
+class ClientDriver(Driver):
+    name = 'client'
+
+    def __init__(self, db_path):
+        from main import create_app
+        self.app = create_app(benchmark_config(db_path))
+
+    def requester(self):
+        return ClientRequester(self.app)
+
+    def peak_rss(self):
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class GunicornDriver(Driver):
+    name = 'gunicorn'
+    server_mode = 'gthread'
+    app_spec = 'main:create_app()'
+
+    def __init__(self, db_path, workers, threads):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            self.port = probe.getsockname()[1]
+        self.metrics_dir = tempfile.mkdtemp(prefix='bench-metrics-')
+        self.log = tempfile.TemporaryFile()
+        env = dict(os.environ,
+                   DATABASE_URI=f'sqlite:///{db_path}', FLASK_ENV='production', SECRET_KEY='benchmark',
+                   HOST='127.0.0.1', PORT=str(self.port), WEB_CONCURRENCY=str(workers),
+                   THREADS_PER_WORKER=str(threads), LOG_LEVEL='warning', METRICS_DIR=self.metrics_dir,
+                   SERVER_MODE=self.server_mode)
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--access-logfile', '/dev/null',
+             self.app_spec],
+            cwd=PROJECT_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=self.log)
+        self._wait_until_ready()
+
+    def _wait_until_ready(self, timeout=30):
+        """Wait for a worker to answer HTTP, not just for the socket to listen."""
+        deadline = time.monotonic() + timeout
+        requester = self.requester()
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                self.log.seek(0)
+                raise RuntimeError(f'gunicorn exited: {self.log.read().decode()[-2000:]}')
+            try:
+                requester.get('/static_db/__benchmark_ready__')
+                return
+            except (OSError, http.client.HTTPException):
+                time.sleep(0.1)
+            finally:
+                requester.close()
+        raise RuntimeError('gunicorn did not answer in time')
+
+    def requester(self, timeout=60):
+        return HttpRequester(self.port, timeout)
+
+    def peak_rss(self):
+        """Sum of the peak RSS (VmHWM) of the master and its workers, from /proc."""
+        pids = [self.process.pid] + _child_pids(self.process.pid)
+        total = 0
+        for pid in pids:
+            try:
+                with open(f'/proc/{pid}/status') as f:
+                    for line in f:
+                        if line.startswith('VmHWM:'):
+                            total += int(line.split()[1]) * 1024
+            except OSError:
+                return None
+        return total
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+        shutil.rmtree(self.metrics_dir, ignore_errors=True)
+
+
+class AsgiDriver(GunicornDriver):
+    """gunicorn with uvicorn workers serving main.asgi (SERVER_MODE=asgi)."""
+    name = 'asgi'
+    server_mode = 'asgi'
+    app_spec = 'main.asgi:create_asgi_app()'
+
+
+def _child_pids(parent):
+    children = []
+    for entry in Path('/proc').glob('[0-9]*/stat'):
+        try:
+            fields = entry.read_text().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == parent:
+            children.append(int(entry.parent.name))
+    return children
+
+
+def run_requests(driver, make_request, concurrency, duration=None, plan=None, timeout=None):
+    """Run requests on ``concurrency`` threads for ``duration`` seconds, or through ``plan`` once.
+
+    ``make_request(rng)`` (or each item of ``plan``) returns
+    ``(path, headers, expected_status)``. ``timeout`` (server drivers only)
+    counts slower responses as errors.
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    plan = list(plan) if plan is not None else None
+
+    def worker(slot):
+        rng = random.Random(slot)
+        requester = driver.requester() if timeout is None else driver.requester(timeout)
+        local, failed = [], 0
+        deadline = time.monotonic() + duration if duration else None
+        try:
+            while True:
+                if plan is not None:
+                    with lock:
+                        if not plan:
+                            break
+                        path, headers, expected = plan.pop()
+                elif time.monotonic() >= deadline:
+                    break
+                else:
+                    path, headers, expected = make_request(rng)
+                started = time.perf_counter()
+                try:
+                    status, _, _ = requester.get(path, headers)
+                except Exception:
+                    failed += 1
+                    continue
+                if status != expected:
+                    failed += 1
+                    continue
+                local.append(time.perf_counter() - started)
+        finally:
+            requester.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(slot,)) for slot in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'seconds': round(elapsed, 3),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'peak_rss_bytes': driver.peak_rss(),
+    }
+
+
+class SlowDownloads:
+    """Hold ``count`` downloads of ``path`` open, each reading about ``rate`` bytes/s.
+
+    All sockets are driven from one thread, with small receive buffers so
+    the server cannot hand a whole file to the kernel and move on.
+    """
+
+    def __init__(self, port, path, count, rate, tick=0.05):
+        self.port = port
+        self.path = path
+        self.count = count
+        self.per_tick = max(1, int(rate * tick))
+        self.tick = tick
+        self.bytes_read = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='slow-downloads', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _connect(self):
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16 * 1024)
+        sock.connect(('127.0.0.1', self.port))
+        sock.sendall(f'GET {self.path} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n'.encode())
+        sock.setblocking(False)
+        return sock
+
+    def _run(self):
+        selector = selectors.DefaultSelector()
+        try:
+            for _ in range(self.count):
+                selector.register(self._connect(), selectors.EVENT_READ)
+            while not self._stop.is_set() and selector.get_map():
+                for key, _ in selector.select(timeout=self.tick):
+                    try:
+                        data = key.fileobj.recv(self.per_tick)
+                    except BlockingIOError:
+                        continue
+                    except OSError:
+                        data = b''
+                    if not data:
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
+                        continue
+                    self.bytes_read += len(data)
+                time.sleep(self.tick)
+        finally:
+            for key in list(selector.get_map().values()):
+                key.fileobj.close()
+            selector.close()
+
+
+def run_driver(driver, assets, args):
+    urls = ['/'] + [f'/static_db/{filename}' for filename, _ in assets]
+    rangeable = [(f'/static_db/{filename}', size) for filename, size in assets if size >= 4 * RANGE_WINDOW]
+
+    results = {'cold': run_requests(driver, None, 1, plan=[(url, None, 200) for url in reversed(urls)])}
+
+    # Validators for the conditional scenario
+    etags = {}
+    requester = driver.requester()
+    try:
+        for url in urls:
+            status, headers, _ = requester.get(url)
+            if status == 200 and headers.get('ETag'):
+                etags[url] = headers['ETag']
+    finally:
+        requester.close()
+
+    results['warm'] = run_requests(
+        driver, lambda rng: (rng.choice(urls), None, 200), args.concurrency, args.duration)
+
+    revalidations = sorted(etags.items())
+    results['conditional'] = run_requests(
+        driver, lambda rng: (lambda url, etag: (url, {'If-None-Match': etag}, 304))(*rng.choice(revalidations)),
+        args.concurrency, args.duration)
+
+    def range_request(rng):
+        url, size = rng.choice(rangeable)
+        start = rng.randrange(0, size - RANGE_WINDOW)
+        return url, {'Range': f'bytes={start}-{start + RANGE_WINDOW - 1}'}, 206
+
+    results['range'] = run_requests(driver, range_request, args.concurrency, args.duration)
+
+    if isinstance(driver, GunicornDriver) and args.slow_clients:
+        filename, size = max(assets, key=lambda asset: asset[1])
+        with SlowDownloads(driver.port, f'/static_db/{filename}', args.slow_clients,
+                           parse_size(args.slow_rate)) as downloads:
+            time.sleep(1)  # let every download reach the server first
+            result = run_requests(driver, lambda rng: ('/', None, 200), args.concurrency, args.duration,
+                                  timeout=args.duration)
+        result.update(slow_clients=args.slow_clients, slow_file_bytes=size, slow_bytes_read=downloads.bytes_read)
+        results['slow_clients'] = result
+    return results
+
+
+def run_benchmarks(args):
+    large_sizes = [parse_size(size) for size in args.large_sizes.split(',') if size]
+    drivers = {'both': ('client', 'gunicorn'), 'all': ('client', 'gunicorn', 'asgi')}.get(args.driver, (args.driver,))
+    results = {}
+
+    with tempfile.TemporaryDirectory(prefix='bench-') as tmp:
+        db_path = str(Path(tmp) / 'bench.db')
+        print(f'Seeding {db_path} ...', file=sys.stderr)
+        # Seed in a child process so Pillow and the upload do not count towards peak RSS
+        seeder = multiprocessing.get_context('spawn').Process(target=seed_database, args=(db_path, large_sizes))
+        seeder.start()
+        seeder.join()
+        if seeder.exitcode != 0:
+            raise RuntimeError('Seeding the benchmark database failed')
+        assets = list_assets(db_path)
+
+        for name in drivers:
+            print(f'Running {name} driver ...', file=sys.stderr)
+            if name == 'client':
+                driver = ClientDriver(db_path)
+            elif name == 'asgi':
+                driver = AsgiDriver(db_path, args.workers, args.threads)
+            else:
+                driver = GunicornDriver(db_path, args.workers, args.threads)
+            try:
+                results[name] = run_driver(driver, assets, args)
+            finally:
+                driver.stop()
+
+    return {
+        'meta': {
+            'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'duration': args.duration,
+            'concurrency': args.concurrency,
+            'workers': args.workers,
+            'threads': args.threads,
+            'large_sizes': large_sizes,
+            'slow_clients': args.slow_clients,
+            'slow_rate': parse_size(args.slow_rate),
+        },
+        'results': results,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, threshold):
+    """Print per-scenario changes; return the list of regressions."""
+    regressions = []
+    for driver, scenarios in current['results'].items():
+        for scenario, result in scenarios.items():
+            base = baseline['results'].get(driver, {}).get(scenario)
+            if base is None:
+                continue
+            rps_change = (result['rps'] - base['rps']) / base['rps'] if base['rps'] else 0.0
+            p95_change = (result['p95_ms'] - base['p95_ms']) / base['p95_ms'] if base['p95_ms'] else 0.0
+            regressed = rps_change < -threshold or p95_change > threshold
+            marker = 'REGRESSION' if regressed else 'ok'
+            print(f'{driver:>8} {scenario:<12} rps {base["rps"]:>9.1f} -> {result["rps"]:>9.1f} '
+                  f'({rps_change:+.1%})  p95 {base["p95_ms"]:>8.2f} -> {result["p95_ms"]:>8.2f} ms '
+                  f'({p95_change:+.1%})  {marker}')
+            if regressed:
+                regressions.append((driver, scenario))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark / and /static_db/')
+    parser.add_argument('--driver', choices=('client', 'gunicorn', 'asgi', 'both', 'all'), default='both',
+                        help='both = client and gunicorn; all adds asgi')
+    parser.add_argument('--duration', type=float, default=5, help='seconds per timed scenario')
+    parser.add_argument('--concurrency', type=int, default=4, help='client threads')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per worker')
+    parser.add_argument('--large-sizes', default='2m,16m', help='comma-separated synthetic blob sizes')
+    parser.add_argument('--slow-clients', type=int, default=32,
+                        help='slow downloads held open during the slow_clients scenario (0 skips it)')
+    parser.add_argument('--slow-rate', default='32k', help='bytes per second each slow download reads')
+    parser.add_argument('--output', help='write results JSON here (default: stdout)')
+    parser.add_argument('--compare', metavar='BASELINE', help='compare against a previous results file')
+    parser.add_argument('--results', help='with --compare: use this results file instead of running')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='allowed fractional RPS drop / p95 increase before failing')
+    args = parser.parse_args()
+
+    if args.results:
+        current = json.loads(Path(args.results).read_text())
+    else:
+        current = run_benchmarks(args)
+        output = json.dumps(current, indent=2)
+        if args.output:
+            Path(args.output).write_text(output + '\n')
+        else:
+            print(output)
+
+    if args.compare:
+        regressions = compare(json.loads(Path(args.compare).read_text()), current, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} scenario(s) regressed by more than {args.threshold:.0%}', file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
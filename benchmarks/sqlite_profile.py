@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""
+Compare /static_db/ throughput with and without the SQLite profile.
+
+Seeds a temporary file database with synthetic assets, disables the blob
+cache so every request reads from SQLite, and runs reader threads against
+the app (one test client per thread, like gthread workers) while a writer
+thread keeps committing. Run once per profile and prints a JSON summary:
+
+    python benchmarks/sqlite_profile.py --seconds 10 --threads 4
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from main import create_app, db  # noqa: E402
+from main.config import TestingConfig  # noqa: E402
+from main.models import StaticFile  # noqa: E402
+
+PROFILES = {
+    'baseline': {'SQLITE_TUNING': False, 'SQLITE_ASSET_POOL': False},
+    'tuned': {'SQLITE_TUNING': True, 'SQLITE_ASSET_POOL': True},
+}
+
+
+def make_config(db_path, threads, overrides):
+    attributes = {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'STATIC_CACHE_MAX_BYTES': 0,
+        'THREADS_PER_WORKER': threads,
+        'LOG_LEVEL': 'ERROR',
+    }
+    attributes.update(overrides)
+    return type('BenchmarkConfig', (TestingConfig,), attributes)
+
+
+def seed(app, files, min_size, max_size):
+    rng = random.Random(0)
+    with app.app_context():
+        db.create_all()
+        for i in range(files):
+            size = rng.randint(min_size, max_size)
+            db.session.add(StaticFile(filename=f'bench/file_{i:04d}.bin', content_type='application/octet-stream',
+                                      data=os.urandom(size)))
+        db.session.commit()
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] if ordered else 0.0
+
+
+def run_profile(name, db_path, args):
+    app = create_app(make_config(db_path, args.threads, PROFILES[name]))
+    names = [f'bench/file_{i:04d}.bin' for i in range(args.files)]
+    deadline = time.monotonic() + args.seconds
+    latencies = [[] for _ in range(args.threads)]
+    errors = [0] * args.threads
+    transferred = [0] * args.threads
+    writes = [0]
+
+    def reader(slot):
+        client = app.test_client()
+        rng = random.Random(slot)
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                response = client.get(f'/static_db/{rng.choice(names)}')
+                body = response.get_data()
+                if response.status_code != 200:
+                    errors[slot] += 1
+                    continue
+            except Exception:
+                errors[slot] += 1
+                continue
+            latencies[slot].append(time.perf_counter() - started)
+            transferred[slot] += len(body)
+
+    def writer():
+        with app.app_context():
+            while time.monotonic() < deadline:
+                try:
+                    db.session.add(StaticFile(filename=f'bench/write_{writes[0]}.bin',
+                                              content_type='application/octet-stream', data=os.urandom(4096)))
+                    db.session.commit()
+                    writes[0] += 1
+                except Exception:
+                    db.session.rollback()
+                time.sleep(args.write_interval)
+            db.session.remove()
+
+    threads = [threading.Thread(target=reader, args=(slot,)) for slot in range(args.threads)]
+    if args.write_interval > 0:
+        threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with app.app_context():
+        StaticFile.query.filter(StaticFile.filename.like('bench/write_%')).delete(synchronize_session=False)
+        db.session.commit()
+        db.session.remove()
+        db.engine.dispose()
+        asset_engine = app.extensions.get('asset_engine')
+        if asset_engine is not None:
+            asset_engine.dispose()
+
+    samples = [sample for slot in latencies for sample in slot]
+    return {
+        'profile': name,
+        'requests': len(samples),
+        'rps': round(len(samples) / args.seconds, 1),
+        'mb_per_s': round(sum(transferred) / 1e6 / args.seconds, 1),
+        'p50_ms': round(percentile(samples, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(samples, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(samples, 0.99) * 1000, 2),
+        'mean_ms': round(statistics.fmean(samples) * 1000, 2) if samples else 0.0,
+        'errors': sum(errors),
+        'writes': writes[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the SQLite profile on /static_db/')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--files', type=int, default=100)
+    parser.add_argument('--min-size', type=int, default=16 * 1024)
+    parser.add_argument('--max-size', type=int, default=2 * 1024 * 1024)
+    parser.add_argument('--write-interval', type=float, default=0.05,
+                        help='seconds between writer commits (0 disables the writer)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / 'bench.db'
+        seed(create_app(make_config(db_path, args.threads, PROFILES['baseline'])),
+             args.files, args.min_size, args.max_size)
+        # Baseline runs first: the tuned profile leaves the file in WAL mode
+        results = [run_profile(name, db_path, args) for name in PROFILES]
+
+    print(json.dumps({'threads': args.threads, 'seconds': args.seconds, 'files': args.files,
+                      'results': results}, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
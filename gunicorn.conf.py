@@ -1,5 +1,8 @@
 import os
 import multiprocessing
+import shutil
+import signal
+import tempfile
 
 # Worker configuration
 # Use the WEB_CONCURRENCY env var if defined, otherwise calculate based on CPU count
@@ -19,9 +22,20 @@ bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5000')}"
 
 # Worker configuration
 workers = web_concurrency
-worker_class = "gthread"
 threads = int(os.getenv("THREADS_PER_WORKER", "4"))
 
+# SERVER_MODE=gthread: one thread per request, for the whole response body.
+# SERVER_MODE=asgi: uvicorn workers; views run on a thread pool and bodies are
+# streamed from the event loop, so slow downloads do not pin threads.
+# An app given on the command line overrides wsgi_app.
+server_mode = os.getenv("SERVER_MODE", "gthread").lower()
+if server_mode == "asgi":
+    worker_class = "uvicorn.workers.UvicornWorker"
+    wsgi_app = "run:asgi_app"
+else:
+    worker_class = "gthread"
+    wsgi_app = "run:app"
+
 # Timeouts
 timeout = int(os.getenv("TIMEOUT", "120"))
 graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "120"))
@@ -38,3 +52,47 @@ limit_request_fields = 100
 limit_request_field_size = 8190
 
 # Reload in development
+
+# Workers write metric snapshots here so /metrics can sum them; set before the app is imported
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), "brown_bear_metrics"))
+
+
+def on_starting(server):
+    """Reset metrics from a previous run and fill the disk tier and shared cache, before workers fork."""
+    shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
+    os.makedirs(os.environ["METRICS_DIR"], exist_ok=True)
+
+    disk_tier = os.getenv("DISK_TIER_MODE", "off").lower() != "off"
+    shared_cache = os.getenv("STATIC_CACHE_BACKEND", "memory").lower() == "shared"
+    if not (disk_tier or shared_cache):
+        return
+    from main import create_app
+    app = create_app()
+    with app.app_context():
+        if disk_tier:
+            stats = app.extensions["disk_tier"].sync(prune=False)
+            server.log.info(f"Disk tier ready: {stats['written']} files written")
+        if shared_cache:
+            from sqlalchemy.exc import SQLAlchemyError
+            cache = app.extensions["static_cache"]
+            try:
+                cache.rebuild()
+                server.log.info(f"Shared asset cache ready at {cache.path}")
+            except SQLAlchemyError as e:
+                # Not seeded yet: the first worker to see static files builds it
+                server.log.warning(f"Shared asset cache not built: {e}")
+
+
+def post_worker_init(worker):
+    """Set shutdown_event when a gthread worker is told to stop, so /readyz reports it draining."""
+    handle_exit = signal.getsignal(signal.SIGTERM)
+    if not callable(handle_exit):
+        # Uvicorn workers install their own handlers; the ASGI lifespan sets the event there
+        return
+
+    def drain(signum, frame):
+        from main import shutdown_event
+        shutdown_event.set()
+        handle_exit(signum, frame)
+
+    signal.signal(signal.SIGTERM, drain)
@@ -17,6 +17,9 @@ def register_signal_handlers():
     def handle_shutdown(signum, frame):
         print(f"Received shutdown signal: {signum}")
         shutdown_event.set()
+        # Write out log records still queued for the listener thread
+        from .logging import stop_logging
+        stop_logging()
         # Give threads a moment to clean up
         sys.exit(0)
 
@@ -36,7 +39,38 @@ def create_app(config_class=None):
     configure_logging(app)
 
     # Initialize extensions
+    from .sqlite import configure_sqlite_engine, init_sqlite_profile, init_database_watcher
+    configure_sqlite_engine(app)
     db.init_app(app)
+    init_sqlite_profile(app)
+
+    # Reconnect when db:restore swaps the database file
+    init_database_watcher(app)
+
+    # In-process cache for database-served static files
+    from .cache import init_static_cache
+    from .resolver import init_resolution_index
+    init_static_cache(app)
+    init_resolution_index(app)
+
+    # Blob storage backends (database, filesystem, S3) and tiering between them
+    from .storage import init_storage
+    init_storage(app)
+
+    from .disk_tier import init_disk_tier
+    init_disk_tier(app)
+
+    # Rendered book pages, invalidated when the catalog changes
+    from .page_cache import init_page_cache
+    init_page_cache(app)
+
+    # Request, SQL and cache instrumentation served at /metrics
+    from .metrics import init_metrics
+    init_metrics(app)
+
+    # Liveness and readiness probes for containers and load balancers
+    from .health import init_health
+    init_health(app)
 
     # Register CLI, routes
     from .cli import register_cli
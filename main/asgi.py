@@ -0,0 +1,166 @@
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.wsgi import FileWrapper
+
+from main import shutdown_event
+
+# Set in the WSGI environ of requests served through AsgiApp; views use it to
+# avoid holding resources (database connections) for the length of a download
+ASYNC_ENVIRON_KEY = 'main.async'
+
+_END = object()
+
+
+class AsgiApp:
+    """Serve the Flask app over ASGI without a thread per response body.
+
+    Views run on a small thread pool and return as soon as the response is
+    planned; the body is then sent from the event loop. Each chunk is read
+    on the pool and the loop awaits the client between chunks, so a slow
+    download holds a coroutine and one chunk, not a thread. A worker can
+    therefore keep thousands of slow downloads going while ``/`` still gets
+    a free thread.
+
+    On lifespan shutdown, views and chunk reads already running get up to
+    ``shutdown_timeout`` seconds to finish, waited for off the event loop.
+    """
+
+    def __init__(self, wsgi_app, threads=4, chunk_size=256 * 1024, shutdown_timeout=30.0):
+        self.wsgi_app = wsgi_app
+        self.chunk_size = chunk_size
+        self.shutdown_timeout = shutdown_timeout
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        else:
+            raise RuntimeError(f"Unsupported ASGI scope type {scope['type']!r}")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                shutdown_event.set()
+                # Blocking here would stall the downloads still being sent from the loop
+                try:
+                    await asyncio.wait_for(asyncio.to_thread(self.executor.shutdown, wait=True),
+                                           self.shutdown_timeout)
+                except asyncio.TimeoutError:
+                    self.executor.shutdown(wait=False, cancel_futures=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        body = await self._read_body(receive)
+        environ = self._environ(scope, body)
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and started.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = headers
+
+        iterable = await loop.run_in_executor(self.executor, self.wsgi_app, environ, start_response)
+        iterator = iter(iterable)
+        disconnected = asyncio.Event()
+        watcher = asyncio.create_task(self._watch_disconnect(receive, disconnected))
+        try:
+            # WSGI apps may only call start_response once the first chunk is produced
+            chunk = await loop.run_in_executor(self.executor, next, iterator, _END)
+            started['sent'] = True
+            await send({
+                'type': 'http.response.start',
+                'status': started['status'],
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                            for name, value in started['headers']],
+            })
+            while chunk is not _END and not disconnected.is_set():
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await loop.run_in_executor(self.executor, next, iterator, _END)
+            if not disconnected.is_set():
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            watcher.cancel()
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                # Runs call_on_close callbacks (metrics) and releases files and connections
+                await loop.run_in_executor(self.executor, close)
+
+    @staticmethod
+    async def _read_body(receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        return b''.join(chunks)
+
+    @staticmethod
+    async def _watch_disconnect(receive, disconnected):
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                disconnected.set()
+                return
+
+    def _file_wrapper(self, file, block_size=8192):
+        return FileWrapper(file, max(block_size, self.chunk_size))
+
+    def _environ(self, scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+            'wsgi.file_wrapper': self._file_wrapper,
+            ASYNC_ENVIRON_KEY: True,
+        }
+        for name, value in scope.get('headers', ()):
+            name = name.decode('latin-1')
+            value = value.decode('latin-1')
+            if name == 'content-type':
+                environ['CONTENT_TYPE'] = value
+            elif name == 'content-length':
+                environ['CONTENT_LENGTH'] = value
+            else:
+                key = 'HTTP_' + name.upper().replace('-', '_')
+                environ[key] = f'{environ[key]},{value}' if key in environ else value
+        return environ
+
+
+def create_asgi_app(app=None):
+    """Wrap a Flask app (by default a new one from ``create_app``) for ASGI servers."""
+    if app is None:
+        from main import create_app
+        app = create_app()
+    threads = app.config.get('ASGI_THREADS') or app.config.get('THREADS_PER_WORKER', 4)
+    return AsgiApp(app, threads=threads, chunk_size=app.config.get('ASGI_CHUNK_SIZE', 256 * 1024),
+                   shutdown_timeout=app.config.get('ASGI_SHUTDOWN_TIMEOUT', 30))
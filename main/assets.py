@@ -0,0 +1,119 @@
+import gzip
+import hashlib
+import io
+import posixpath
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip variants are still produced
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; images are then stored without derivatives
+    Image = None
+
+# Content types worth storing precompressed variants for
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/javascript',
+    'application/json',
+    'application/xml',
+    'image/svg+xml',
+    'image/x-icon',
+    'image/vnd.microsoft.icon',
+)
+
+# A variant is only kept if it is at least this much smaller than the original
+MIN_COMPRESSION_SAVING = 0.1
+
+
+def content_digest(data):
+    """Return the hex SHA-256 digest used as a static file's strong ETag."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def is_compressible(content_type):
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def _compressors():
+    compressors = {}
+    if brotli is not None:
+        compressors['br'] = lambda data: brotli.compress(data, quality=11)
+    compressors['gzip'] = lambda data: gzip.compress(data, compresslevel=9, mtime=0)
+    return compressors
+
+
+def compress_variants(data, content_type):
+    """Return ``{encoding: compressed_bytes}`` for the encodings worth storing.
+
+    Variants that do not shrink the file by at least MIN_COMPRESSION_SAVING
+    are skipped, as is anything that is not a compressible content type.
+    """
+    if not data or not is_compressible(content_type):
+        return {}
+
+    variants = {}
+    for encoding, compress in _compressors().items():
+        compressed = compress(data)
+        if len(compressed) <= len(data) * (1 - MIN_COMPRESSION_SAVING):
+            variants[encoding] = compressed
+    return variants
+
+
+def variant_filename(filename, encoding):
+    suffix = {'gzip': '.gz', 'br': '.br'}[encoding]
+    return filename + suffix
+
+
+# Image types the derivative pipeline resizes
+RESIZABLE_TYPES = ('image/png', 'image/jpeg', 'image/webp')
+
+# (Pillow format, content type, file extension) of each derivative produced per width
+DERIVATIVE_FORMATS = (
+    ('WEBP', 'image/webp', '.webp'),
+    ('JPEG', 'image/jpeg', '.jpg'),
+)
+
+
+def is_resizable(content_type):
+    return Image is not None and content_type in RESIZABLE_TYPES
+
+
+def image_derivatives(data, content_type, widths):
+    """Return ``[(width, content_type, extension, bytes)]`` resized copies of an image.
+
+    One copy is produced per format in DERIVATIVE_FORMATS for every width
+    narrower than the original. Returns an empty list when Pillow is not
+    installed or the content type is not a resizable image.
+    """
+    if not is_resizable(content_type):
+        return []
+
+    with Image.open(io.BytesIO(data)) as original:
+        original.load()
+        if original.mode in ('RGBA', 'LA', 'P'):
+            # JPEG has no alpha channel, so flatten onto the page's white background
+            flattened = Image.new('RGB', original.size, (255, 255, 255))
+            flattened.paste(original.convert('RGBA'), mask=original.convert('RGBA').getchannel('A'))
+        else:
+            flattened = original.convert('RGB')
+
+    derivatives = []
+    for width in sorted(set(widths)):
+        if width >= flattened.width:
+            continue
+        height = max(1, round(flattened.height * width / flattened.width))
+        resized = flattened.resize((width, height), Image.LANCZOS)
+        for image_format, derivative_type, extension in DERIVATIVE_FORMATS:
+            buffer = io.BytesIO()
+            resized.save(buffer, format=image_format, quality=80, optimize=True)
+            derivatives.append((width, derivative_type, extension, buffer.getvalue()))
+    return derivatives
+
+
+def derivative_filename(filename, width, extension):
+    """``images/Page_02.png`` at 320px WebP becomes ``images/Page_02.w320.webp``."""
+    stem, _ = posixpath.splitext(filename)
+    return f'{stem}.w{width}{extension}'
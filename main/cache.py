@@ -0,0 +1,314 @@
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, inspect
+from flask import current_app, has_app_context
+
+from main.assets import content_digest
+from main.models import StaticFile
+
+
+class CachedFile:
+    """An immutable snapshot of a StaticFile row held in the blob cache."""
+    __slots__ = ('filename', 'content_type', 'data', 'size', 'digest', 'last_modified')
+
+    def __init__(self, filename, content_type, data, digest=None, last_modified=None):
+        self.filename = filename
+        self.content_type = content_type
+        self.data = data
+        self.size = len(data)
+        self.digest = digest or content_digest(data)
+        self.last_modified = last_modified
+
+    @classmethod
+    def from_entry(cls, entry, data):
+        """Pair bytes loaded from the database with their index metadata."""
+        return cls(entry.filename, entry.content_type, data, entry.digest, entry.last_modified)
+
+    def __repr__(self):
+        return f'<CachedFile {self.filename} ({self.size} bytes)>'
+
+
+class BlobCache:
+    """Per-process, byte-bounded LRU cache of static file contents.
+
+    Entries are keyed by the stored filename. Each gunicorn worker holds its
+    own instance, so the byte budget applies per worker. Files larger than
+    ``max_entry_bytes`` are never cached and are streamed instead.
+    """
+
+    def __init__(self, max_bytes, max_entry_bytes=None):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes if max_entry_bytes is None else min(max_entry_bytes, max_bytes)
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self.get_first((key,))
+
+    def get_first(self, keys):
+        """Return the first cached entry among ``keys``, counting one hit or miss."""
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry
+            self.misses += 1
+            return None
+
+    def put(self, key, entry):
+        """Store an entry, evicting least recently used ones to fit the budget."""
+        if not self.accepts(entry.size):
+            return False
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= previous.size
+
+            while self._entries and self.current_bytes + entry.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.size
+                self.evictions += 1
+
+            self._entries[key] = entry
+            self.current_bytes += entry.size
+        return True
+
+    def accepts(self, size):
+        return size <= self.max_entry_bytes
+
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.current_bytes -= entry.size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+
+class LoadTimeout(Exception):
+    """Raised to callers that waited too long for a load started by another request."""
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent loads of the same key within this process.
+
+    The first caller for a key runs the load; callers arriving while it is in
+    flight wait for it and get the same result (the same bytes object, so a
+    burst of misses holds one copy) or the same exception. Waiters give up
+    after ``timeout`` seconds with LoadTimeout instead of starting a load of
+    their own, so a stuck load cannot turn into a stampede. Nothing is
+    remembered once a load finishes; caching is the caller's job.
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.loads = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.errors = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, load):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.loads += 1
+            else:
+                self.coalesced += 1
+
+        if leader:
+            try:
+                flight.result = load()
+            except BaseException as e:
+                flight.error = e
+                with self._lock:
+                    self.errors += 1
+                raise
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+            return flight.result
+
+        if not flight.done.wait(self.timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise LoadTimeout(f'Load of {key!r} still running after {self.timeout:g}s')
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'loads': self.loads,
+                'coalesced': self.coalesced,
+                'timeouts': self.timeouts,
+                'errors': self.errors,
+            }
+
+
+class MissingPaths:
+    """Bounded, per-process record of requested static paths that matched no file.
+
+    Each path counts how often it was asked for, so the most requested
+    missing assets can be reported. A path drops out of the report ``ttl``
+    seconds after its last request, or as soon as a request for it resolves
+    (it was uploaded). Its count then starts again from zero. At most
+    ``max_entries`` paths are kept, and the least recently requested one is
+    dropped first, so a scanner walking random URLs cannot grow the map.
+    """
+
+    def __init__(self, max_entries=1024, ttl=600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.evictions = 0
+        # path -> [requests, expires_at]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, path):
+        """Count a request for ``path`` that matched no file; True if it was already known missing."""
+        if self.max_entries <= 0:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            known = entry is not None and entry[1] > now
+            requests = entry[0] if known else 0
+            self._entries[path] = [requests + 1, now + self.ttl]
+            if known:
+                self.hits += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            return known
+
+    def forget(self, path):
+        """Drop ``path`` now that it resolves to a file."""
+        # Unlocked membership test first, so requests for existing files skip the lock
+        if path not in self._entries:
+            return
+        with self._lock:
+            self._entries.pop(path, None)
+
+    def top(self, limit=None):
+        """Return ``(path, requests)`` pairs of unexpired entries, most requested first."""
+        now = time.monotonic()
+        with self._lock:
+            counts = [(path, entry[0]) for path, entry in self._entries.items() if entry[1] > now]
+        counts.sort(key=lambda item: (-item[1], item[0]))
+        return counts[:limit] if limit is not None else counts
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'evictions': self.evictions,
+            }
+
+
+def init_static_cache(app):
+    """Attach a blob cache sized from STATIC_CACHE_MAX_BYTES to the app.
+
+    STATIC_CACHE_BACKEND=shared uses one segment for every worker on the
+    host instead of a cache per worker.
+    """
+    if app.config.get('STATIC_CACHE_BACKEND', 'memory') == 'shared':
+        from main.shared_cache import SharedAssetCache, default_segment_path
+        path = (app.config.get('STATIC_CACHE_SHARED_PATH')
+                or default_segment_path(app.config['SQLALCHEMY_DATABASE_URI']))
+        cache = SharedAssetCache(path, app.config.get('STATIC_CACHE_MAX_BYTES', 0),
+                                 app.config.get('STATIC_CACHE_MAX_ENTRY_BYTES'),
+                                 app.config.get('STATIC_INDEX_CHECK_INTERVAL', 5))
+    else:
+        cache = BlobCache(app.config.get('STATIC_CACHE_MAX_BYTES', 0),
+                          app.config.get('STATIC_CACHE_MAX_ENTRY_BYTES'))
+    app.extensions['static_cache'] = cache
+    # Concurrent misses for the same file share one read
+    app.extensions['static_loads'] = SingleFlight(app.config.get('STATIC_LOAD_TIMEOUT', 10))
+    app.extensions['static_missing'] = MissingPaths(app.config.get('STATIC_MISSING_MAX_ENTRIES', 1024),
+                                                    app.config.get('STATIC_MISSING_TTL', 600))
+    return cache
+
+
+def get_static_cache():
+    return current_app.extensions.get('static_cache')
+
+
+def get_static_loads():
+    return current_app.extensions.get('static_loads')
+
+
+def get_missing_paths():
+    return current_app.extensions.get('static_missing')
+
+
+def _invalidate_static_file(mapper, connection, target):
+    if not has_app_context():
+        return
+    cache = get_static_cache()
+    if cache is None:
+        return
+
+    cache.invalidate(target.filename)
+    # A rename leaves the old key behind, so drop that one as well
+    for old_name in inspect(target).attrs.filename.history.deleted or ():
+        cache.invalidate(old_name)
+
+
+for _event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(StaticFile, _event_name, _invalidate_static_file)
@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+from sqlalchemy.orm import joinedload
+
+from main import db
+from main.models import Book, Page
+
+# The book shipped with the app: seeded by admin.py and rendered when the
+# database holds no catalog yet
+BOOK = {
+    'title': 'Brown Bear, Brown Bear, What Do You See?',
+    'author': 'Bill Martin Jr.',
+    'illustrator': 'Eric Carle',
+}
+
+# (page number, animal, image, sound)
+PAGES = [
+    (2, 'Brown Bear', 'images/Page_02.png', 'audio/bear.mp3'),
+    (3, 'Red Bird', 'images/Page_03.png', 'audio/bird.mp3'),
+    (4, 'Yellow Duck', 'images/Page_04.png', 'audio/duck.mp3'),
+    (5, 'Blue Horse', 'images/Page_05.png', 'audio/horse.mp3'),
+    (6, 'Green Frog', 'images/Page_06.png', 'audio/frog.mp3'),
+    (7, 'Purple Cat', 'images/Page_07.png', 'audio/cat.mp3'),
+    (8, 'White Dog', 'images/Page_08.png', 'audio/dog.mp3'),
+    (9, 'Black Sheep', 'images/Page_09.png', 'audio/sheep.mp3'),
+    (10, 'Goldfish', 'images/Page_10.png', 'audio/fish.mp3'),
+    (11, 'Teacher', 'images/Page_11.png', 'audio/teach.mp3'),
+]
+
+
+def page_content(animal_name):
+    return f"{animal_name}, {animal_name}, what do you see?"
+
+
+def default_book():
+    """The shipped catalog as plain objects shaped like Book/Page/Animal rows."""
+    pages = [SimpleNamespace(number=number, content=page_content(animal), image=image, sound=sound,
+                             animal=SimpleNamespace(name=animal))
+             for number, animal, image, sound in PAGES]
+    return SimpleNamespace(id=None, pages=pages, **BOOK)
+
+
+def load_book(book_id=None):
+    """Load one book with its pages and animals in a single joined query.
+
+    ``book_id=None`` means the first book. Returns None if there is none.
+    """
+    query = db.session.query(Book).options(joinedload(Book.pages).joinedload(Page.animal))
+    if book_id is not None:
+        query = query.filter(Book.id == book_id)
+    return query.order_by(Book.id).first()
@@ -19,6 +19,12 @@ class Config:
 
     # Logging configuration
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT')
+    LOG_FILE = os.environ.get('LOG_FILE')
+    # One JSON object per line instead of LOG_FORMAT
+    LOG_JSON = os.environ.get('LOG_JSON', 'false').lower() in ('true', '1', 't')
+    # Fraction of DEBUG records kept (e.g. 0.01 keeps one in a hundred)
+    LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 1))
 
     # Application settings
     APP_NAME = os.environ.get('APP_NAME', 'Brown Bear App')
@@ -27,6 +33,102 @@ class Config:
     STATIC_FOLDER = 'static'
     TEMPLATE_FOLDER = 'templates'
 
+    # Per-worker in-memory cache for files served from the database (bytes)
+    STATIC_CACHE_MAX_BYTES = int(os.environ.get('STATIC_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    # Larger files bypass the cache and are streamed from the database
+    STATIC_CACHE_MAX_ENTRY_BYTES = int(os.environ.get('STATIC_CACHE_MAX_ENTRY_BYTES', 1024 * 1024))
+    # 'memory' keeps a cache per worker; 'shared' maps one segment file that every
+    # worker on the host reads, filled by whichever worker takes the writer lock
+    STATIC_CACHE_BACKEND = os.environ.get('STATIC_CACHE_BACKEND', 'memory').lower()
+    # Segment file for the shared backend; defaults to /dev/shm, keyed by database
+    STATIC_CACHE_SHARED_PATH = os.environ.get('STATIC_CACHE_SHARED_PATH')
+    STATIC_STREAM_CHUNK_SIZE = int(os.environ.get('STATIC_STREAM_CHUNK_SIZE', 64 * 1024))
+    # Seconds a request waits for another request's read of the same file before answering 503
+    STATIC_LOAD_TIMEOUT = float(os.environ.get('STATIC_LOAD_TIMEOUT', 10))
+    # Requested paths that matched no file are counted for /metrics/missing until this
+    # many seconds pass without a request for them, or until they resolve
+    STATIC_MISSING_TTL = float(os.environ.get('STATIC_MISSING_TTL', 600))
+    STATIC_MISSING_MAX_ENTRIES = int(os.environ.get('STATIC_MISSING_MAX_ENTRIES', 1024))
+    # Seconds between checks for static file changes made by other processes
+    STATIC_INDEX_CHECK_INTERVAL = float(os.environ.get('STATIC_INDEX_CHECK_INTERVAL', 5))
+
+    # Seconds between checks for book/page/animal changes made by other processes
+    PAGE_CACHE_CHECK_INTERVAL = float(os.environ.get('PAGE_CACHE_CHECK_INTERVAL', 5))
+    # Rendered pages kept per worker
+    PAGE_CACHE_MAX_ENTRIES = int(os.environ.get('PAGE_CACHE_MAX_ENTRIES', 256))
+    # API responses kept per worker, separately from rendered pages
+    API_CACHE_MAX_ENTRIES = int(os.environ.get('API_CACHE_MAX_ENTRIES', 256))
+
+    # Local disk copies of database assets: off, sendfile, x-accel-redirect or x-sendfile
+    DISK_TIER_MODE = os.environ.get('DISK_TIER_MODE', 'off').lower()
+    DISK_TIER_DIR = os.environ.get('DISK_TIER_DIR', str(BASE_DIR / 'instance' / 'asset_tier'))
+    # Internal nginx location that maps onto DISK_TIER_DIR (x-accel-redirect mode)
+    DISK_TIER_ACCEL_PREFIX = os.environ.get('DISK_TIER_ACCEL_PREFIX', '/_asset_tier/')
+    DISK_TIER_EXPORT_ON_START = os.environ.get('DISK_TIER_EXPORT_ON_START', 'false').lower() in ('true', '1', 't')
+
+    # Where static blob bytes live: any of db, fs, s3, fastest first (db is always available)
+    STORAGE_BACKENDS = [name.strip().lower() for name in
+                        os.environ.get('STORAGE_BACKENDS', 'db').split(',') if name.strip()]
+    # Backend new uploads and cold blobs are written to
+    STORAGE_DEFAULT_BACKEND = os.environ.get('STORAGE_DEFAULT_BACKEND', 'db').lower()
+    STORAGE_FS_DIR = os.environ.get('STORAGE_FS_DIR', str(BASE_DIR / 'instance' / 'blob_store'))
+    STORAGE_S3_BUCKET = os.environ.get('STORAGE_S3_BUCKET')
+    STORAGE_S3_PREFIX = os.environ.get('STORAGE_S3_PREFIX', 'static/')
+    # For S3-compatible services (MinIO, R2, ...); credentials come from the usual AWS_* variables
+    STORAGE_S3_ENDPOINT_URL = os.environ.get('STORAGE_S3_ENDPOINT_URL')
+    # Move frequently requested blobs into the fastest backend and cold ones back out
+    STORAGE_TIERING = os.environ.get('STORAGE_TIERING', 'false').lower() in ('true', '1', 't')
+    STORAGE_TIERING_INTERVAL = float(os.environ.get('STORAGE_TIERING_INTERVAL', 300))
+    STORAGE_TIERING_LOCK = os.environ.get('STORAGE_TIERING_LOCK')
+    STORAGE_TIERING_MAX_MOVES = int(os.environ.get('STORAGE_TIERING_MAX_MOVES', 50))
+    # Bytes of the most requested blobs kept in the fast backend, and the requests that make a blob hot
+    STORAGE_HOT_BYTES = int(os.environ.get('STORAGE_HOT_BYTES', 256 * 1024 * 1024))
+    STORAGE_HOT_MIN_REQUESTS = int(os.environ.get('STORAGE_HOT_MIN_REQUESTS', 3))
+
+    # SQLite profile applied to every connection (see main/sqlite.py)
+    SQLITE_TUNING = os.environ.get('SQLITE_TUNING', 'true').lower() in ('true', '1', 't')
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    # Negative values are KiB, positive values are pages (per connection)
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -16384))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+    # Separate read-only connection pool for asset reads
+    SQLITE_ASSET_POOL = os.environ.get('SQLITE_ASSET_POOL', 'true').lower() in ('true', '1', 't')
+    SQLITE_ASSET_IMMUTABLE = os.environ.get('SQLITE_ASSET_IMMUTABLE', 'false').lower() in ('true', '1', 't')
+    # Matches gunicorn's threads setting; sizes the connection pools
+    THREADS_PER_WORKER = int(os.environ.get('THREADS_PER_WORKER', 4))
+    # Threads running views and chunk reads under the ASGI server (SERVER_MODE=asgi); 0 = THREADS_PER_WORKER
+    ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 0))
+    # Bytes read per database round trip when streaming under the ASGI server (held per download)
+    ASGI_CHUNK_SIZE = int(os.environ.get('ASGI_CHUNK_SIZE', 256 * 1024))
+    # Seconds the ASGI lifespan shutdown waits for running views and chunk reads
+    ASGI_SHUTDOWN_TIMEOUT = float(os.environ.get('ASGI_SHUTDOWN_TIMEOUT', 30))
+
+    # Seconds between checks for the SQLite file being replaced (e.g. by db:restore)
+    DATABASE_REPLACE_CHECK_INTERVAL = float(os.environ.get('DATABASE_REPLACE_CHECK_INTERVAL', 2))
+
+    # Widths (px) of the resized copies generated for each page image when seeding
+    IMAGE_DERIVATIVE_WIDTHS = [int(width) for width in
+                               os.environ.get('IMAGE_DERIVATIVE_WIDTHS', '160,320,640').split(',') if width]
+
+    # Book page thumbnails preloaded with Link headers (the first grid row); the rest load lazily
+    ASSET_PRELOAD_IMAGES = int(os.environ.get('ASSET_PRELOAD_IMAGES', 5))
+    # Send 103 Early Hints when the server provides wsgi.early_hints
+    EARLY_HINTS = os.environ.get('EARLY_HINTS', 'true').lower() in ('true', '1', 't')
+
+    # Offline precache: pages register /sw.js, which caches every stored asset
+    SERVICE_WORKER_ENABLED = os.environ.get('SERVICE_WORKER_ENABLED', 'true').lower() in ('true', '1', 't')
+
+    # Prometheus-format /metrics; workers share totals through files in METRICS_DIR
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ('true', '1', 't')
+    METRICS_DIR = os.environ.get('METRICS_DIR') or None
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1))
+
+    # /readyz: seconds to wait for the database ping, and how long a ping result is reused
+    HEALTH_DB_TIMEOUT = float(os.environ.get('HEALTH_DB_TIMEOUT', 2))
+    HEALTH_PING_INTERVAL = float(os.environ.get('HEALTH_PING_INTERVAL', 1))
+
     # Security headers
     STRICT_TRANSPORT_SECURITY = os.environ.get('STRICT_TRANSPORT_SECURITY', 'false').lower() in ('true', '1', 't')
     CONTENT_SECURITY_POLICY = os.environ.get('CONTENT_SECURITY_POLICY')
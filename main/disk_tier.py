@@ -0,0 +1,151 @@
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+from flask import current_app
+
+from main import db
+from main.models import StaticBlob
+
+# How the app hands a materialized file to the server or proxy in front of it
+DISK_TIER_MODES = ('off', 'sendfile', 'x-accel-redirect', 'x-sendfile')
+
+
+class DigestMismatch(Exception):
+    """Raised when bytes written to the disk tier do not hash to their digest."""
+
+
+class FileSource:
+    """Serve byte ranges from a materialized file without reading it whole."""
+
+    def __init__(self, path, chunk_size):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.chunk_size = chunk_size
+
+    def iter_range(self, start, end):
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = f.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+
+class DiskTier:
+    """Content-addressed copies of static blobs on the local filesystem.
+
+    Each blob lives at ``<root>/<first two digest chars>/<digest>``. Files
+    are written to a temporary name in the same directory, checked against
+    their digest and then renamed into place, so readers only ever see
+    complete, verified files. Because paths are derived from the digest, a
+    file on disk can never go stale; changed rows simply map to new paths.
+    """
+
+    def __init__(self, root, chunk_size=64 * 1024):
+        self.root = Path(root)
+        self.chunk_size = chunk_size
+
+    def path_for(self, digest):
+        return self.root / digest[:2] / digest
+
+    def relative_path(self, digest):
+        return f'{digest[:2]}/{digest}'
+
+    def has(self, digest):
+        return self.path_for(digest).is_file()
+
+    def write(self, digest, chunks):
+        """Atomically store ``chunks`` under ``digest``, verifying the hash."""
+        path = self.path_for(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        hasher = hashlib.sha256()
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in chunks:
+                    hasher.update(chunk)
+                    tmp.write(chunk)
+                tmp.flush()
+                os.fsync(tmp.fileno())
+            if hasher.hexdigest() != digest:
+                raise DigestMismatch(f'Contents of blob {digest} hash to {hasher.hexdigest()}')
+            os.replace(tmp_name, path)
+        except BaseException:
+            if os.path.exists(tmp_name):
+                os.unlink(tmp_name)
+            raise
+        return path
+
+    def verify(self, digest):
+        hasher = hashlib.sha256()
+        with open(self.path_for(digest), 'rb') as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest() == digest
+
+    def materialize(self, source, digest):
+        """Copy one blob from its storage backend to disk, streaming it in chunks."""
+        return self.write(digest, source.iter_range(0, source.size))
+
+    def stored_digests(self):
+        if not self.root.exists():
+            return set()
+        return {path.name for path in self.root.glob('??/*') if not path.name.startswith('.tmp-')}
+
+    def sync(self, verify=False, prune=True):
+        """Export every blob in the table and drop files no blob refers to.
+
+        Returns a dict of counts: ``written``, ``verified``, ``repaired`` and
+        ``pruned``. Must be called inside an app context.
+        """
+        from main.storage import get_storage
+        stats = {'written': 0, 'verified': 0, 'repaired': 0, 'pruned': 0}
+        blobs = db.session.query(StaticBlob.id, StaticBlob.digest, StaticBlob.size).all()
+        for blob_id, digest, size in blobs:
+            if self.has(digest):
+                if not verify:
+                    continue
+                if self.verify(digest):
+                    stats['verified'] += 1
+                    continue
+                stats['repaired'] += 1
+            else:
+                stats['written'] += 1
+            self.materialize(get_storage().source(blob_id, digest, size, self.chunk_size), digest)
+
+        if prune:
+            for digest in self.stored_digests() - {digest for _, digest, _ in blobs}:
+                self.path_for(digest).unlink()
+                stats['pruned'] += 1
+        return stats
+
+
+def init_disk_tier(app):
+    """Attach a DiskTier when DISK_TIER_MODE enables one, optionally filling it."""
+    mode = app.config.get('DISK_TIER_MODE', 'off')
+    if mode not in DISK_TIER_MODES:
+        raise ValueError(f"DISK_TIER_MODE must be one of {', '.join(DISK_TIER_MODES)}, not {mode!r}")
+    if mode == 'off':
+        return None
+
+    tier = DiskTier(app.config['DISK_TIER_DIR'], app.config.get('STATIC_STREAM_CHUNK_SIZE', 64 * 1024))
+    app.extensions['disk_tier'] = tier
+    if app.config.get('DISK_TIER_EXPORT_ON_START'):
+        with app.app_context():
+            try:
+                stats = tier.sync(prune=False)
+                app.logger.info(f"Disk tier ready at {tier.root}: {stats['written']} files written")
+            except Exception as e:
+                # Serving falls back to the database for anything not exported
+                app.logger.warning(f"Disk tier export failed: {e}")
+                db.session.rollback()
+    return tier
+
+
+def get_disk_tier():
+    return current_app.extensions.get('disk_tier')
@@ -0,0 +1,141 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from flask import Blueprint, Response, current_app
+from sqlalchemy import text
+
+from main import db, shutdown_event
+
+health_bp = Blueprint('health', __name__)
+
+
+class Readiness:
+    """Whether this worker can take traffic, answered without blocking the probe.
+
+    The database is pinged on a single background thread and the probe waits
+    at most ``db_timeout`` seconds for it. While an earlier ping is still
+    stuck, no new one is queued and the worker reports not ready. Pings are
+    reused for ``ping_interval`` seconds, so frequent probes cost one
+    ``SELECT 1`` per interval. The first probe also starts a one-off
+    warm-up that loads the static file index, maps the static cache and
+    renders the default book. The worker is not ready until the warm-up has
+    finished.
+    """
+
+    def __init__(self, app, db_timeout=2.0, ping_interval=1.0):
+        self.app = app
+        self.db_timeout = db_timeout
+        self.ping_interval = ping_interval
+        self.warm = False
+        self.warm_error = None
+        self._pid = None
+        self._executor = None
+        self._warming = None
+        self._ping = None
+        self._pinged_at = 0.0
+        self._lock = threading.Lock()
+
+    def _start(self):
+        # Threads do not survive a fork, so a forked worker starts its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='readiness')
+            self._ping = None
+            self._warming = None
+            self.warm = False
+            self._pid = os.getpid()
+
+    def _start_warm_up(self):
+        with self._lock:
+            if self.warm or (self._warming is not None and self._warming.is_alive()):
+                return
+            # A failed warm-up is retried by the next probe
+            self._warming = threading.Thread(target=self._warm_up, name='warm-up', daemon=True)
+            self._warming.start()
+
+    def _warm_up(self):
+        app = self.app
+        try:
+            with app.app_context():
+                from main.resolver import get_resolution_index
+                get_resolution_index().current_generation()
+                cache = app.extensions.get('static_cache')
+                if cache is not None:
+                    cache.get_first(())
+                with app.test_request_context('/'):
+                    app.view_functions['main.index']()
+                db.session.remove()
+            self.warm_error = None
+            self.warm = True
+        except Exception as e:
+            self.warm_error = str(e)
+            app.logger.warning(f"Warm-up failed: {e}")
+
+    def _ping_database(self):
+        with self.app.app_context():
+            try:
+                with db.engine.connect() as connection:
+                    connection.execute(text('SELECT 1'))
+            finally:
+                db.session.remove()
+
+    def database(self):
+        """Return None when the database answered in time, else the reason it did not."""
+        with self._lock:
+            ping = self._ping
+            if ping is None or (ping.done() and time.monotonic() - self._pinged_at >= self.ping_interval):
+                ping = self._ping = self._executor.submit(self._ping_database)
+                self._pinged_at = time.monotonic()
+        try:
+            ping.result(timeout=self.db_timeout)
+        except TimeoutError:
+            return f'no answer within {self.db_timeout:g}s'
+        except Exception as e:
+            return str(e)
+        return None
+
+    def check(self):
+        """Return ``(ready, checks)`` for the readiness endpoint."""
+        self._start()
+        if shutdown_event.is_set():
+            return False, {'draining': True}
+        database_error = self.database()
+        self._start_warm_up()
+        checks = {
+            'draining': False,
+            'database': database_error or 'ok',
+            'warm': self.warm,
+        }
+        if self.warm_error:
+            checks['warm_error'] = self.warm_error
+        return database_error is None and self.warm, checks
+
+
+@health_bp.route('/healthz')
+def healthz():
+    """Liveness: the worker is answering requests. Touches nothing else."""
+    return Response('ok\n', mimetype='text/plain')
+
+
+@health_bp.route('/readyz')
+def readyz():
+    """Readiness: 200 once this worker can serve pages, 503 while warming, draining or cut off from the database."""
+    ready, checks = current_app.extensions['readiness'].check()
+    body = json.dumps({'status': 'ready' if ready else 'unavailable', 'checks': checks})
+    response = Response(body + '\n', status=200 if ready else 503, mimetype='application/json')
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+def init_health(app):
+    """Serve ``/healthz`` and ``/readyz``."""
+    app.extensions['readiness'] = Readiness(app, app.config.get('HEALTH_DB_TIMEOUT', 2.0),
+                                            app.config.get('HEALTH_PING_INTERVAL', 1.0))
+    app.register_blueprint(health_bp)
+    return app.extensions['readiness']
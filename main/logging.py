@@ -1,24 +1,129 @@
+import atexit
+import copy
+import itertools
+import json
 import logging
+import queue
 import sys
+from logging.handlers import QueueHandler, QueueListener
+
+DEFAULT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Listeners started by configure_logging and not stopped yet, flushed at exit
+_running = set()
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+class RecordQueueHandler(QueueHandler):
+    """Queue records with their message merged, keeping the traceback separate.
+
+    The stock ``prepare`` folds the traceback into the message, which would
+    leave JSON output without an ``exception`` field.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class DebugSamplingFilter(logging.Filter):
+    """Let through one in every ``1 / rate`` DEBUG records; other levels always pass."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self._counter = itertools.count()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        if not self.every:
+            return False
+        return next(self._counter) % self.every == 0
+
+
+def stop_logging(app=None):
+    """Stop the background listener of ``app``, or of every app, writing out every queued record."""
+    if app is None:
+        listeners = list(_running)
+    else:
+        listeners = [app.extensions.pop('log_listener', None)]
+    for listener in listeners:
+        if listener in _running:
+            _running.discard(listener)
+            listener.stop()
+
 
 def configure_logging(app):
-    """Configure logging for the application."""
+    """Configure logging for the application.
+
+    Request threads only put records on a queue; a background listener
+    thread does the (blocking) writes. Each app owns its listener, so
+    creating another app leaves this one's running. Listeners still running
+    are flushed at exit and when the shutdown signal handler runs.
+    """
     # Clear existing handlers
-    for handler in app.logger.handlers:
+    for handler in list(app.logger.handlers):
         app.logger.removeHandler(handler)
-    
+    stop_logging(app)
+
     # Set log level from config
     log_level_name = app.config.get('LOG_LEVEL', 'INFO')
     log_level = getattr(logging, log_level_name.upper(), logging.INFO)
     app.logger.setLevel(log_level)
-    
+
     # Create formatter
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    
-    # Add console handler
+    if app.config.get('LOG_JSON'):
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(app.config.get('LOG_FORMAT') or DEFAULT_FORMAT)
+
+    # Output handlers run on the listener thread
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(formatter)
-    app.logger.addHandler(console_handler)
-    
+    handlers = [console_handler]
+    if app.config.get('LOG_FILE'):
+        file_handler = logging.FileHandler(app.config['LOG_FILE'])
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = RecordQueueHandler(log_queue)
+    sample_rate = app.config.get('LOG_DEBUG_SAMPLE_RATE', 1.0)
+    if sample_rate < 1.0:
+        queue_handler.addFilter(DebugSamplingFilter(sample_rate))
+    app.logger.addHandler(queue_handler)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _running.add(listener)
+    app.extensions['log_listener'] = listener
+
     # Log successful configuration
     app.logger.info(f"Logging configured with level: {log_level_name}")
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,359 @@
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from pathlib import Path
+
+from flask import Blueprint, Response, current_app, g, has_request_context, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is implicit
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+    'http_requests_total': ('counter', 'Requests handled, by endpoint, method and status.'),
+    'http_request_duration_seconds': ('histogram', 'Time from request start until the body was sent.'),
+    'http_request_handler_seconds': ('histogram', 'Time spent in the view, before the body was sent.'),
+    'http_request_db_seconds': ('histogram', 'Time spent executing SQL per request.'),
+    'http_response_bytes_total': ('counter', 'Response body bytes sent, by endpoint.'),
+    'db_queries_total': ('counter', 'SQL statements executed during requests, by endpoint.'),
+    'static_responses_total': ('counter', 'Database-served static responses, by X-Cache source.'),
+    'static_cache_hits_total': ('counter', 'Blob cache hits.'),
+    'static_cache_misses_total': ('counter', 'Blob cache misses.'),
+    'static_cache_evictions_total': ('counter', 'Blob cache evictions.'),
+    'static_cache_bytes': ('gauge', 'Bytes held in blob caches, summed over workers.'),
+    'static_cache_hit_ratio': ('gauge', 'Blob cache hits over lookups, across workers.'),
+    'static_loads_total': ('counter', 'Static file reads started on a cache miss.'),
+    'static_loads_coalesced_total': ('counter', 'Cache misses that waited for a read already in flight.'),
+    'static_load_timeouts_total': ('counter', 'Coalesced waits that gave up after STATIC_LOAD_TIMEOUT.'),
+    'static_load_errors_total': ('counter', 'Static file reads that raised, including for their waiters.'),
+    'static_missing_hits_total': ('counter', 'Static 404s for paths already recorded as missing.'),
+    'storage_reads_total': ('counter', 'Blob reads from each storage backend.'),
+    'storage_read_seconds_total': ('counter', 'Time to first byte of blob reads, by storage backend.'),
+}
+
+# WSGI environ key of the SQL counters of the request being handled ([queries, seconds]).
+# The environ follows the request to whichever thread runs it or streams its body.
+_DB_STATE_KEY = 'metrics.db'
+
+
+class MetricsRegistry:
+    """Counters, gauges and histograms for one process.
+
+    Keys are ``(name, labels)`` with labels as a sorted tuple of pairs.
+    Histograms hold per-bucket (non-cumulative) counts followed by the
+    sum and the observation count. ``snapshot`` and ``merge`` turn the
+    registry into JSON and back so workers can be aggregated.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, labels=(), value=0):
+        with self._lock:
+            self.gauges[(name, labels)] = value
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(LATENCY_BUCKETS) + 3)
+            histogram[bisect_left(LATENCY_BUCKETS, value)] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'gauges': [[name, list(labels), value] for (name, labels), value in self.gauges.items()],
+                'histograms': [[name, list(labels), list(values)]
+                               for (name, labels), values in self.histograms.items()],
+            }
+
+    def merge(self, snapshot, gauges=True):
+        """Add a snapshot in. Gauges are summed too unless ``gauges`` is false."""
+        with self._lock:
+            for name, labels, value in snapshot.get('counters', ()):
+                key = (name, tuple(tuple(pair) for pair in labels))
+                self.counters[key] = self.counters.get(key, 0) + value
+            for name, labels, value in snapshot.get('gauges', ()) if gauges else ():
+                key = (name, tuple(tuple(pair) for pair in labels))
+                self.gauges[key] = self.gauges.get(key, 0) + value
+            for name, labels, values in snapshot.get('histograms', ()):
+                key = (name, tuple(tuple(pair) for pair in labels))
+                histogram = self.histograms.setdefault(key, [0] * len(values))
+                for i, value in enumerate(values):
+                    histogram[i] += value
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def render(registry):
+    """Render a registry in the Prometheus text exposition format."""
+    lines = []
+    by_name = {}
+    for (name, labels), value in sorted(list(registry.counters.items()) + list(registry.gauges.items())):
+        by_name.setdefault(name, []).append(f'{name}{_format_labels(labels)} {value:g}')
+    for (name, labels), values in sorted(registry.histograms.items()):
+        series = by_name.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), values):
+            cumulative += count
+            le = bound if isinstance(bound, str) else f'{bound:g}'
+            series.append(f'{name}_bucket{_format_labels(labels, [("le", le)])} {cumulative:g}')
+        series.append(f'{name}_sum{_format_labels(labels)} {values[-2]:.6f}')
+        series.append(f'{name}_count{_format_labels(labels)} {values[-1]:g}')
+
+    for name, (kind, help_text) in METRICS.items():
+        if name in by_name:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(by_name[name])
+    return '\n'.join(lines) + '\n'
+
+
+class Metrics:
+    """Request instrumentation for one worker, shared through METRICS_DIR.
+
+    Each worker periodically writes its registry to its own JSON file in
+    ``directory`` (atomically, within ``flush_interval`` seconds of a
+    request and at exit). ``/metrics`` sums every file plus the live registry of the
+    answering worker. Files of exited workers are kept so counters never go
+    backwards, but their gauges are skipped; gunicorn clears the directory
+    when the master starts.
+    Without a directory, only this process is reported.
+    """
+
+    def __init__(self, directory=None, flush_interval=1.0, cache=None, storage=None, loads=None, missing=None):
+        self.registry = MetricsRegistry()
+        self.cache = cache
+        self.storage = storage
+        self.loads = loads
+        self.missing = missing
+        self.directory = Path(directory) if directory else None
+        self.flush_interval = flush_interval
+        self.path = None
+        self._next_flush = 0.0
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+        self._dirty = False
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self.path = self.directory / f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json'
+
+    def cache_snapshot(self):
+        """Cumulative blob cache and storage statistics of this process, as counters."""
+        registry = MetricsRegistry()
+        if self.cache is not None:
+            stats = self.cache.stats()
+            registry.inc('static_cache_hits_total', value=stats['hits'])
+            registry.inc('static_cache_misses_total', value=stats['misses'])
+            registry.inc('static_cache_evictions_total', value=stats['evictions'])
+            registry.set('static_cache_bytes', value=stats['bytes'])
+        if self.loads is not None:
+            stats = self.loads.stats()
+            registry.inc('static_loads_total', value=stats['loads'])
+            registry.inc('static_loads_coalesced_total', value=stats['coalesced'])
+            registry.inc('static_load_timeouts_total', value=stats['timeouts'])
+            registry.inc('static_load_errors_total', value=stats['errors'])
+        if self.missing is not None:
+            registry.inc('static_missing_hits_total', value=self.missing.stats()['hits'])
+            # Not rendered at /metrics (one series per path); summed for /metrics/missing
+            for path, requests in self.missing.top():
+                registry.inc('static_missing_requests', (('path', path),), requests)
+        if self.storage is not None:
+            for backend, stats in self.storage.stats().items():
+                if stats['reads']:
+                    registry.inc('storage_reads_total', (('backend', backend),), stats['reads'])
+                    registry.inc('storage_read_seconds_total', (('backend', backend),), stats['seconds'])
+        return registry.snapshot()
+
+    def snapshot(self):
+        snapshot = self.registry.snapshot()
+        cache = self.cache_snapshot()
+        snapshot['counters'].extend(cache['counters'])
+        snapshot['gauges'].extend(cache['gauges'])
+        snapshot['pid'] = os.getpid()
+        return snapshot
+
+    def maybe_flush(self):
+        """Flush now if due, and make sure a later flush happens once the worker goes idle."""
+        if self.path is None:
+            return
+        self._dirty = True
+        if self._flusher is None or not self._flusher.is_alive():
+            # Started lazily so the thread belongs to the forked worker, not the master
+            self._flusher = threading.Thread(target=self._flush_periodically, name='metrics-flush', daemon=True)
+            self._flusher.start()
+        if time.monotonic() >= self._next_flush:
+            self.flush()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            if self._dirty:
+                self.flush()
+
+    def flush(self):
+        if self.path is None:
+            return
+        with self._flush_lock:
+            self._dirty = False
+            self._next_flush = time.monotonic() + self.flush_interval
+            tmp_path = self.path.with_suffix('.tmp')
+            tmp_path.write_text(json.dumps(self.snapshot()))
+            os.replace(tmp_path, self.path)
+
+    def collect(self):
+        """Merge every worker's snapshot into a new registry."""
+        combined = MetricsRegistry()
+        combined.merge(self.snapshot())
+        if self.directory is not None:
+            for path in self.directory.glob('*.json'):
+                if path == self.path:
+                    continue
+                try:
+                    snapshot = json.loads(path.read_text())
+                except (OSError, ValueError):
+                    # Replaced or removed while reading; it is counted on the next scrape
+                    continue
+                # Counters of exited workers still count; what they held does not
+                combined.merge(snapshot, gauges=_process_alive(snapshot.get('pid')))
+
+        hits = combined.counters.get(('static_cache_hits_total', ()), 0)
+        lookups = hits + combined.counters.get(('static_cache_misses_total', ()), 0)
+        combined.gauges[('static_cache_hit_ratio', ())] = hits / lookups if lookups else 0.0
+        return combined
+
+    def record(self, endpoint, method, status, handler_seconds, total_seconds, db_queries,
+               db_seconds, body_bytes, cache_source):
+        labels = (('endpoint', endpoint),)
+        self.registry.inc('http_requests_total',
+                          (('endpoint', endpoint), ('method', method), ('status', str(status))))
+        self.registry.observe('http_request_duration_seconds', labels, total_seconds)
+        self.registry.observe('http_request_handler_seconds', labels, handler_seconds)
+        self.registry.observe('http_request_db_seconds', labels, db_seconds)
+        if db_queries:
+            self.registry.inc('db_queries_total', labels, db_queries)
+        if body_bytes:
+            self.registry.inc('http_response_bytes_total', labels, body_bytes)
+        if cache_source:
+            self.registry.inc('static_responses_total', (('source', cache_source),))
+        self.maybe_flush()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_started'] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('query_started', None)
+    state = request.environ.get(_DB_STATE_KEY) if has_request_context() else None
+    if started is not None and state is not None:
+        state[0] += 1
+        state[1] += time.perf_counter() - started
+
+
+def _process_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics')
+def metrics_endpoint():
+    metrics = current_app.extensions['metrics']
+    return Response(render(metrics.collect()), mimetype='text/plain; version=0.0.4')
+
+
+@metrics_bp.route('/metrics/missing')
+def missing_paths_endpoint():
+    """The most requested static paths that matched no file, summed over workers."""
+    limit = request.args.get('limit', 20, type=int)
+    combined = current_app.extensions['metrics'].collect()
+    counts = {}
+    for (name, labels), value in combined.counters.items():
+        if name == 'static_missing_requests':
+            path = dict(labels)['path']
+            counts[path] = counts.get(path, 0) + value
+    top = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:limit]
+    return jsonify({'missing': [{'path': path, 'requests': requests} for path, requests in top]})
+
+
+def init_metrics(app):
+    """Instrument requests and SQL, and expose the totals at ``/metrics``."""
+    if not app.config.get('METRICS_ENABLED', True):
+        return None
+
+    metrics = Metrics(app.config.get('METRICS_DIR'), app.config.get('METRICS_FLUSH_INTERVAL', 1.0),
+                      app.extensions.get('static_cache'), app.extensions.get('storage'),
+                      app.extensions.get('static_loads'), app.extensions.get('static_missing'))
+    app.extensions['metrics'] = metrics
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = time.perf_counter()
+        request.environ[_DB_STATE_KEY] = [0, 0.0]
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        handler_seconds = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        method = request.method
+        cache_source = response.headers.get('X-Cache')
+        db_state = request.environ.get(_DB_STATE_KEY) or [0, 0.0]
+
+        def finish():
+            # Runs once the server has sent the body, so streamed bytes count too
+            metrics.record(endpoint, method, response.status_code, handler_seconds,
+                           time.perf_counter() - started, db_state[0], db_state[1],
+                           response.content_length, cache_source)
+
+        response.call_on_close(finish)
+        return response
+
+    if metrics.path is not None:
+        atexit.register(metrics.flush)
+
+    app.register_blueprint(metrics_bp)
+    return metrics
+
+
+def get_metrics():
+    return current_app.extensions.get('metrics')
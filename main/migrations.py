@@ -0,0 +1,70 @@
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+
+from main import db
+from main.assets import content_digest
+
+
+def upgrade_schema():
+    """Create missing tables and bring databases from earlier versions up to date.
+
+    SQLAlchemy's ``create_all`` never alters existing tables, so databases
+    created by an earlier ``db:init`` get any missing model column added,
+    and file contents still stored inline in ``static_files.data`` are moved
+    into the content-addressed ``static_blobs`` table. Returns a list of
+    human-readable descriptions of the changes made.
+    """
+    db.create_all()
+
+    changes = []
+    with db.engine.begin() as connection:
+        changes.extend(_add_missing_columns(connection))
+        changes.extend(_move_inline_blobs(connection))
+    return changes
+
+
+def _add_missing_columns(connection):
+    inspector = inspect(connection)
+    added = []
+    for table in db.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = CreateColumn(column).compile(dialect=connection.dialect)
+            connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {ddl}'))
+            added.append(f'Added column {table.name}.{column.name}')
+    return added
+
+
+def _move_inline_blobs(connection):
+    """Move ``static_files.data`` into ``static_blobs``, one row at a time."""
+    columns = {column['name'] for column in inspect(connection).get_columns('static_files')}
+    if 'data' not in columns:
+        return []
+
+    file_ids = connection.execute(text('SELECT id FROM static_files ORDER BY id')).scalars().all()
+    shared = 0
+    for file_id in file_ids:
+        data = connection.execute(text('SELECT data FROM static_files WHERE id = :id'),
+                                  {'id': file_id}).scalar()
+        digest = content_digest(data)
+        updated = connection.execute(
+            text('UPDATE static_blobs SET ref_count = ref_count + 1 WHERE digest = :digest'),
+            {'digest': digest})
+        if updated.rowcount:
+            shared += 1
+        else:
+            connection.execute(
+                text('INSERT INTO static_blobs (digest, data, size, ref_count, created_at) '
+                     'VALUES (:digest, :data, :size, 1, :created_at)'),
+                {'digest': digest, 'data': data, 'size': len(data), 'created_at': datetime.utcnow()})
+        connection.execute(
+            text('UPDATE static_files SET digest = :digest, size = :size WHERE id = :id'),
+            {'digest': digest, 'size': len(data), 'id': file_id})
+
+    connection.execute(text('ALTER TABLE static_files DROP COLUMN data'))
+    return [f'Moved {len(file_ids)} files into static_blobs '
+            f'({shared} duplicates shared an existing blob)']
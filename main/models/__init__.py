@@ -1,18 +1,159 @@
 from datetime import datetime
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
 from main import db
+from main.assets import content_digest
+
+class StaticBlob(db.Model):
+    """File contents, stored once per distinct SHA-256 digest.
+
+    StaticFile rows point here by digest, so identical bytes uploaded under
+    several names share one BLOB. ``ref_count`` tracks how many files use the
+    blob; it is deleted when the last one goes away.
+    """
+    __tablename__ = 'static_blobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    digest = db.Column(db.String(64), nullable=False, unique=True)
+    # Deferred so loading a blob row for its ref_count never reads the BLOB
+    data = db.deferred(db.Column(db.LargeBinary, nullable=False))
+    size = db.Column(db.Integer, nullable=False)
+    # Storage backend holding the bytes (see main/storage.py); ``data`` is empty unless 'db'
+    location = db.Column(db.String(20), nullable=False, default='db', server_default='db')
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<StaticBlob {self.digest[:12]} refs={self.ref_count}>'
+
 
 class StaticFile(db.Model):
+    """Metadata for a file served from the database; the bytes live in StaticBlob."""
     __tablename__ = 'static_files'
 
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False, unique=True)
     content_type = db.Column(db.String(100), nullable=False)
-    data = db.Column(db.LargeBinary, nullable=False)
+    digest = db.Column(db.String(64), db.ForeignKey('static_blobs.digest'))  # hex SHA-256 of data
+    size = db.Column(db.Integer)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    blob = db.relationship('StaticBlob')
+
+    # Precompressed variants and resized images point back at their original
+    variant_of_id = db.Column(db.Integer, db.ForeignKey('static_files.id'))
+    encoding = db.Column(db.String(20))  # Content-Encoding of data, e.g. 'gzip'
+    width = db.Column(db.Integer)  # pixel width of a resized image derivative
+    # Digest of the contents variants were last generated from, even if none were worth storing
+    variants_digest = db.Column(db.String(64))
+    variants = db.relationship('StaticFile', backref=db.backref('variant_of', remote_side=[id]),
+                               cascade='all, delete-orphan')
+
+    @property
+    def data(self):
+        pending = self.__dict__.get('_pending_data')
+        if pending is not None:
+            return pending
+        if self.blob is None:
+            return None
+        if self.blob.location != 'db':
+            from main.storage import get_storage
+            return get_storage().read(self.blob.id, self.blob.digest)
+        return self.blob.data
+
+    @data.setter
+    def data(self, value):
+        # The blob row itself is created or shared when the session flushes
+        self._pending_data = value
+        self.digest = content_digest(value)
+        self.size = len(value)
+
+    @property
+    def last_modified(self):
+        return self.updated_at or self.created_at
 
     def __repr__(self):
         return f'<StaticFile {self.filename}>'
 
+
+@event.listens_for(Session, 'before_flush')
+def _sync_blob_references(session, flush_context, instances):
+    """Create, share and release StaticBlob rows as StaticFile rows change."""
+    blobs = {}
+
+    def get_blob(digest, data=None):
+        blob = blobs.get(digest)
+        if blob is None:
+            blob = session.query(StaticBlob).filter_by(digest=digest).first()
+            if blob is None and data is not None:
+                from main.storage import get_storage
+                storage = get_storage()
+                location, stored = storage.store_new(digest, data) if storage is not None else ('db', data)
+                blob = StaticBlob(digest=digest, data=stored, size=len(data), location=location, ref_count=0)
+                session.add(blob)
+            blobs[digest] = blob
+        return blob
+
+    def reference(static_file):
+        blob = get_blob(static_file.digest, static_file.__dict__.get('_pending_data'))
+        if blob is not None:
+            blob.ref_count += 1
+            static_file.blob = blob
+        static_file.__dict__.pop('_pending_data', None)
+
+    def release(digest):
+        blob = get_blob(digest)
+        if blob is not None:
+            blob.ref_count -= 1
+
+    for obj in session.new:
+        if isinstance(obj, StaticFile) and obj.digest is not None:
+            reference(obj)
+
+    for obj in session.dirty:
+        if not isinstance(obj, StaticFile):
+            continue
+        history = inspect(obj).attrs.digest.history
+        if history.has_changes():
+            for old_digest in history.deleted:
+                if old_digest is not None:
+                    release(old_digest)
+            reference(obj)
+
+    for obj in session.deleted:
+        if isinstance(obj, StaticFile):
+            history = inspect(obj).attrs.digest.history
+            digest = history.deleted[0] if history.deleted else obj.digest
+            if digest is not None:
+                release(digest)
+
+    for blob in blobs.values():
+        if blob is not None and blob.ref_count <= 0:
+            if blob.location != 'db':
+                # Bytes kept by another backend are removed once the deletion is committed
+                session.info.setdefault('released_blobs', []).append((blob.location, blob.digest))
+            if blob in session.new:
+                session.expunge(blob)
+            else:
+                session.delete(blob)
+
+
+@event.listens_for(Session, 'after_commit')
+def _remove_released_blobs(session):
+    released = session.info.pop('released_blobs', None)
+    if not released:
+        return
+    from main.storage import get_storage
+    storage = get_storage()
+    if storage is not None:
+        storage.remove_released(released)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _keep_released_blobs(session):
+    # The blob rows are back, so their bytes are still needed
+    session.info.pop('released_blobs', None)
+
 # Add these missing models
 class Book(db.Model):
     __tablename__ = 'books'
@@ -20,6 +161,11 @@ class Book(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
     author = db.Column(db.String(255), nullable=False)
+    illustrator = db.Column(db.String(255))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    pages = db.relationship('Page', backref='book', order_by='Page.number',
+                            cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<Book {self.title}>'
@@ -29,6 +175,9 @@ class Animal(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    pages = db.relationship('Page', backref='animal')
     
     def __repr__(self):
         return f'<Animal {self.name}>'
@@ -41,6 +190,10 @@ class Page(db.Model):
     content = db.Column(db.Text, nullable=False)
     book_id = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False)
     animal_id = db.Column(db.Integer, db.ForeignKey('animals.id'), nullable=False)
+    # Stored static file names, e.g. images/Page_02.png and audio/bear.mp3
+    image = db.Column(db.String(255))
+    sound = db.Column(db.String(255))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     def __repr__(self):
         return f'<Page {self.number}>'
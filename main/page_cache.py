@@ -0,0 +1,152 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, current_app, has_app_context, request
+from sqlalchemy import event, func, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from main import db
+from main.models import Animal, Book, Page
+from main.resolver import get_resolution_index
+
+
+class RenderedPage:
+    """Fully rendered HTML for one book, with its strong ETag and extra headers."""
+    __slots__ = ('body', 'etag', 'static_generation', 'headers')
+
+    def __init__(self, body, static_generation, headers=()):
+        self.body = body
+        self.headers = headers
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.static_generation = static_generation
+
+    def __repr__(self):
+        return f'<RenderedPage {self.etag}>'
+
+
+class PageCache:
+    """Per-process cache of rendered responses built from the catalog.
+
+    Book pages are keyed by book id. At most ``max_entries`` are kept; the
+    oldest are dropped first. API responses live in a cache of their own,
+    so a client paging through cursors cannot push book pages out.
+
+    Entries are dropped when Book, Page or Animal rows change, through
+    mapper events for writes in this process and a cheap count/max-id/
+    max-updated_at fingerprint query, run at most every ``check_interval``
+    seconds, for writes by other processes. Each entry also records the
+    resolution index generation it was rendered against, since the HTML
+    embeds fingerprinted asset URLs.
+    """
+
+    def __init__(self, check_interval=5.0, max_entries=256):
+        self.check_interval = check_interval
+        self.max_entries = max_entries
+        self.generation = 0
+        self._pages = OrderedDict()
+        self._fingerprint = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, key, static_generation):
+        self._refresh_if_needed()
+        page = self._pages.get(key)
+        if page is not None and page.static_generation == static_generation:
+            return page
+        return None
+
+    def put(self, key, body, static_generation, generation, headers=()):
+        """Store a rendering unless the catalog changed since ``generation`` was read."""
+        page = RenderedPage(body, static_generation, headers)
+        with self._lock:
+            if generation == self.generation:
+                self._pages[key] = page
+                while len(self._pages) > self.max_entries:
+                    self._pages.popitem(last=False)
+        return page
+
+    def invalidate(self):
+        with self._lock:
+            self._pages.clear()
+            self.generation += 1
+
+    def __len__(self):
+        return len(self._pages)
+
+    def _refresh_if_needed(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        try:
+            fingerprint = db.session.execute(select(*(
+                aggregate for model in (Book, Page, Animal)
+                for aggregate in (select(func.count(model.id)).scalar_subquery(),
+                                  select(func.max(model.id)).scalar_subquery(),
+                                  select(func.max(model.updated_at)).scalar_subquery())
+            ))).one()
+        except SQLAlchemyError:
+            # Tables not created yet; pages render from the built-in catalog
+            db.session.rollback()
+            fingerprint = None
+        if fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            self.invalidate()
+
+
+def cached_response(key, build, mimetype, cache=None):
+    """Answer from the cache (or with a 304), calling ``build()`` for the body on a miss.
+
+    ``build`` returns bytes, or ``(bytes, headers)`` for headers cached along
+    with the body, and may abort; failed builds are not cached. ``cache``
+    defaults to the page cache.
+    """
+    pages = cache if cache is not None else get_page_cache()
+    static_generation = get_resolution_index().current_generation()
+    rendered = pages.get(key, static_generation)
+    if rendered is None:
+        generation = pages.generation
+        result = build()
+        body, headers = result if isinstance(result, tuple) else (result, ())
+        rendered = pages.put(key, body, static_generation, generation, headers)
+
+    if rendered.etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(rendered.body, mimetype=mimetype)
+        response.headers.extend(rendered.headers)
+    response.set_etag(rendered.etag)
+    # Always revalidate: the ETag changes as soon as the catalog or an asset does
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def init_page_cache(app):
+    cache = PageCache(app.config.get('PAGE_CACHE_CHECK_INTERVAL', 5.0),
+                      app.config.get('PAGE_CACHE_MAX_ENTRIES', 256))
+    app.extensions['page_cache'] = cache
+    app.extensions['api_cache'] = PageCache(app.config.get('PAGE_CACHE_CHECK_INTERVAL', 5.0),
+                                            app.config.get('API_CACHE_MAX_ENTRIES', 256))
+    return cache
+
+
+def get_page_cache():
+    return current_app.extensions.get('page_cache')
+
+
+def get_api_cache():
+    return current_app.extensions.get('api_cache')
+
+
+def _invalidate_pages(mapper, connection, target):
+    if has_app_context():
+        for cache in (get_page_cache(), get_api_cache()):
+            if cache is not None:
+                cache.invalidate()
+
+
+for _model in (Book, Page, Animal):
+    for _event_name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _event_name, _invalidate_pages)
@@ -0,0 +1,228 @@
+import hashlib
+import posixpath
+import re
+import threading
+import time
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, func
+from sqlalchemy.exc import SQLAlchemyError
+
+from main import db
+from main.models import StaticBlob, StaticFile
+
+# Directory prefixes a request may omit, in the order they win ambiguous lookups
+STATIC_SUBDIRS = ('images', 'js', 'audio')
+
+# Hex characters of the content hash embedded in fingerprinted URLs
+FINGERPRINT_LENGTH = 12
+FINGERPRINTED_NAME = re.compile(r'^(?P<stem>.+)\.(?P<fingerprint>[0-9a-f]{%d})(?P<ext>\.[^./]+)?$'
+                                % FINGERPRINT_LENGTH)
+
+
+class IndexEntry:
+    """Metadata for one stored file, as held by the resolution index."""
+    __slots__ = ('id', 'filename', 'content_type', 'size', 'digest', 'last_modified',
+                 'encoding', 'width', 'variant_of_id', 'blob_id', 'variants', 'fingerprint')
+
+    def __init__(self, id, filename, content_type, size, digest, last_modified,
+                 encoding, width, variant_of_id, blob_id):
+        self.id = id
+        self.filename = filename
+        self.content_type = content_type
+        self.size = size
+        self.digest = digest
+        self.last_modified = last_modified
+        self.encoding = encoding
+        self.width = width
+        self.variant_of_id = variant_of_id
+        self.blob_id = blob_id
+        self.variants = ()
+        self.fingerprint = None
+
+    def fingerprinted_name(self):
+        """``images/Page_02.png`` becomes ``images/Page_02.<fingerprint>.png``."""
+        stem, ext = posixpath.splitext(self.filename)
+        return f'{stem}.{self.fingerprint}{ext}'
+
+    def __repr__(self):
+        return f'<IndexEntry {self.filename}>'
+
+
+def _aliases(filename):
+    """Return the shorter names a stored path can be requested by, best first."""
+    aliases = []
+    head, _, rest = filename.partition('/')
+    if head in STATIC_SUBDIRS and rest:
+        aliases.append(rest)
+    basename = posixpath.basename(filename)
+    if basename != filename and basename not in aliases:
+        aliases.append(basename)
+    return aliases
+
+
+def _alias_rank(filename):
+    head = filename.partition('/')[0]
+    return STATIC_SUBDIRS.index(head) if head in STATIC_SUBDIRS else len(STATIC_SUBDIRS)
+
+
+class ResolutionIndex:
+    """In-memory map from every requestable name to the stored file's metadata.
+
+    Built from a single column-only query over ``static_files``, so resolving
+    a request never touches the database or loads a BLOB. Stored paths always
+    win; shorter aliases (``Page_02.png`` for ``images/Page_02.png``) are
+    added when they do not collide, and collisions are logged at build time.
+
+    The index is rebuilt lazily after local writes (via mapper events) and
+    when a cheap fingerprint query, run at most every ``check_interval``
+    seconds, shows another process changed the table.
+    """
+
+    def __init__(self, check_interval=5.0):
+        self.check_interval = check_interval
+        self.ambiguous = {}
+        self._paths = {}
+        self._fingerprint = None
+        self._dirty = True
+        self._next_check = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def resolve(self, filename):
+        self._refresh_if_needed()
+        return self._paths.get(filename)
+
+    def resolve_fingerprinted(self, filename):
+        """Resolve a ``name.<fingerprint>.ext`` path.
+
+        Returns ``(entry, current)`` where ``current`` says whether the
+        fingerprint in the URL still matches the stored contents, or
+        ``(None, False)`` if the path is not fingerprinted or unknown.
+        """
+        match = FINGERPRINTED_NAME.match(filename)
+        if match is None:
+            return None, False
+        entry = self.resolve(match.group('stem') + (match.group('ext') or ''))
+        if entry is None:
+            return None, False
+        return entry, entry.fingerprint == match.group('fingerprint')
+
+    def manifest(self):
+        """Map every stored original to its fingerprinted filename."""
+        return {entry.filename: entry.fingerprinted_name()
+                for entry in self.entries() if entry.variant_of_id is None}
+
+    def entries(self):
+        """Return the stored (non-alias) entries."""
+        self._refresh_if_needed()
+        return [entry for name, entry in self._paths.items() if name == entry.filename]
+
+    def __len__(self):
+        return len(self.entries())
+
+    def current_generation(self):
+        """Return a counter bumped on every rebuild, i.e. whenever fingerprints may have changed."""
+        self._refresh_if_needed()
+        return self._generation
+
+    def invalidate(self):
+        self._dirty = True
+
+    def _refresh_if_needed(self):
+        now = time.monotonic()
+        if not self._dirty and now < self._next_check:
+            return
+
+        with self._lock:
+            if not self._dirty and now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+            try:
+                fingerprint = self._current_fingerprint()
+                if self._dirty or fingerprint != self._fingerprint:
+                    self._build(fingerprint)
+            except SQLAlchemyError as e:
+                # Most likely the table does not exist yet; retry after the interval
+                current_app.logger.warning(f"Static file index unavailable: {e}")
+                db.session.rollback()
+                self._paths = {}
+                self._fingerprint = None
+                self._dirty = False
+                self._generation += 1
+
+    @staticmethod
+    def _current_fingerprint():
+        return db.session.query(
+            func.count(StaticFile.id), func.max(StaticFile.id), func.max(StaticFile.updated_at)
+        ).one()
+
+    def _build(self, fingerprint):
+        rows = db.session.query(
+            StaticFile.id, StaticFile.filename, StaticFile.content_type, StaticFile.size,
+            StaticFile.digest, func.coalesce(StaticFile.updated_at, StaticFile.created_at),
+            StaticFile.encoding, StaticFile.width, StaticFile.variant_of_id, StaticBlob.id,
+        ).join(StaticBlob, StaticBlob.digest == StaticFile.digest).all()
+        entries = [IndexEntry(*row) for row in rows]
+
+        by_id = {entry.id: entry for entry in entries}
+        variants = {}
+        for entry in entries:
+            if entry.variant_of_id in by_id:
+                variants.setdefault(entry.variant_of_id, []).append(entry)
+        for original_id, found in variants.items():
+            by_id[original_id].variants = tuple(found)
+
+        # A fingerprint covers the variants too, so re-generated derivatives bust caches
+        for entry in entries:
+            digests = [entry.digest or ''] + sorted(variant.digest or '' for variant in entry.variants)
+            entry.fingerprint = hashlib.sha256('|'.join(digests).encode()).hexdigest()[:FINGERPRINT_LENGTH]
+
+        paths = {entry.filename: entry for entry in entries}
+        claimed = {}
+        for entry in sorted(entries, key=lambda entry: (_alias_rank(entry.filename), entry.filename)):
+            if entry.variant_of_id is not None:
+                continue
+            for alias in _aliases(entry.filename):
+                if alias in paths and paths[alias].filename == alias:
+                    continue
+                if alias in claimed:
+                    claimed[alias].append(entry.filename)
+                    continue
+                claimed[alias] = [entry.filename]
+                paths[alias] = entry
+
+        self.ambiguous = {alias: names for alias, names in claimed.items() if len(names) > 1}
+        for alias, names in self.ambiguous.items():
+            current_app.logger.warning(
+                f"Ambiguous static file name '{alias}' matches {', '.join(names)}; serving {names[0]}")
+
+        self._paths = paths
+        self._fingerprint = fingerprint
+        self._dirty = False
+        self._generation += 1
+        current_app.logger.info(f"Static file index built with {len(entries)} files")
+
+
+def init_resolution_index(app):
+    """Attach a resolution index to the app and build it if the table exists."""
+    index = ResolutionIndex(app.config.get('STATIC_INDEX_CHECK_INTERVAL', 5.0))
+    app.extensions['static_index'] = index
+    with app.app_context():
+        index.resolve('')
+    return index
+
+
+def get_resolution_index():
+    return current_app.extensions.get('static_index')
+
+
+def _invalidate_index(mapper, connection, target):
+    if has_app_context():
+        index = get_resolution_index()
+        if index is not None:
+            index.invalidate()
+
+
+for _event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(StaticFile, _event_name, _invalidate_index)
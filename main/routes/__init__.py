@@ -1,44 +1,345 @@
 # main/routes/__init__.py
-from flask import Blueprint, render_template, Response, abort
-from main.models import StaticFile
+from flask import Blueprint, render_template, Response, abort, request, current_app, url_for, send_file
+from werkzeug.http import http_date, is_resource_modified
+from sqlalchemy.exc import SQLAlchemyError
+from main.cache import CachedFile, LoadTimeout, get_missing_paths, get_static_cache, get_static_loads
+from main.resolver import get_resolution_index
+from main.disk_tier import FileSource, get_disk_tier
+from main.asgi import ASYNC_ENVIRON_KEY
+from main.catalog import default_book, load_book
+from main.page_cache import cached_response
+from main.storage import BlobNotFound, get_storage
+from main.streaming import (MemorySource, RangeNotSatisfiable,
+                            full_response, range_response, resolve_ranges,
+                            unsatisfiable_response)
 from main import db
 
 main_bp = Blueprint('main', __name__)
 
+STATIC_CACHE_CONTROL = 'public, max-age=86400'
+# Fingerprinted URLs change whenever the contents do, so they can be cached forever
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Path every database-served file lives under
+ASSET_PREFIX = '/static_db/'
+
+# Remote stylesheet index.html loads, and the origins it pulls the font from
+FONT_STYLESHEET = 'https://fonts.googleapis.com/css2?family=Comic+Neue&display=swap'
+FONT_ORIGINS = ('https://fonts.googleapis.com', 'https://fonts.gstatic.com')
+# Stored files every book page needs before first paint, with their preload destination
+CRITICAL_ASSETS = (('js/script.js', 'script'), ('images/see.gif', 'image'))
+# Width of the grid thumbnails (the img src) and their sizes attribute
+THUMBNAIL_WIDTH = 320
+THUMBNAIL_SIZES = '20vw'
+
 @main_bp.route('/')
-def index():
-    return render_template('index.html')
+@main_bp.route('/books/<int:book_id>')
+def index(book_id=None):
+    """Serve a book's page from the rendered-page cache, rendering it on a miss."""
+    if not request.if_none_match:
+        send_early_hints(critical_hints())
+    return cached_response(book_id, lambda: _render_book(book_id), 'text/html')
 
-@main_bp.route('/static_db/<path:filename>')
-def serve_static_from_db(filename):
-    print(f"Attempting to serve: {filename}")
-
-    # Try the exact filename first
-    file = StaticFile.query.filter_by(filename=filename).first()
-    if file:
-        print(f"Found file at {filename}")
-        response = Response(file.data, mimetype=file.content_type)
-        response.headers['Cache-Control'] = 'public, max-age=86400'
-        return response
-
-    # If not found, try with common subdirectories
-    for subdir in ['images', 'js', 'audio']:
-        path = f"{subdir}/{filename}"
-        print(f"Trying path: {path}")
-        file = StaticFile.query.filter_by(filename=path).first()
-        if file:
-            print(f"Found file at {path}")
-            response = Response(file.data, mimetype=file.content_type)
-            response.headers['Cache-Control'] = 'public, max-age=86400'
-            return response
-
-    print(f"File {filename} not found in database")
-    abort(404)
-    
-    print(f"Serving {filename} ({len(file.data)} bytes)")
-    response = Response(file.data, mimetype=file.content_type)
-    response.headers['Cache-Control'] = 'public, max-age=86400'
+def _render_book(book_id):
+    try:
+        book = load_book(book_id)
+    except SQLAlchemyError as e:
+        current_app.logger.warning(f"Catalog unavailable, rendering the built-in book: {e}")
+        db.session.rollback()
+        book = None
+    if book is None and book_id is not None:
+        abort(404)
+    if book is None or not any(page.image for page in book.pages):
+        # Nothing seeded yet (or seeded before pages had images)
+        book = default_book()
+    pages = [page for page in book.pages if page.image]
+    preload_images = current_app.config.get('ASSET_PRELOAD_IMAGES', 5)
+    html = render_template('index.html', book=book, pages=pages, eager_images=preload_images,
+                           thumbnail_width=THUMBNAIL_WIDTH, thumbnail_sizes=THUMBNAIL_SIZES)
+    return html.encode(), [('Link', ', '.join(asset_plan(pages[:preload_images])))]
+
+def asset_url(filename, **params):
+    """URL for a database-served file, fingerprinted with its content hash.
+
+    Falls back to the plain URL for files that are not stored (yet).
+    """
+    entry = get_resolution_index().resolve(filename)
+    if entry is not None:
+        filename = entry.fingerprinted_name()
+    return url_for('main.serve_static_from_db', filename=filename, **params)
+
+def asset_srcset(filename):
+    """Build a srcset listing the configured derivative widths of an image."""
+    return ', '.join(
+        f"{asset_url(filename, w=width)} {width}w"
+        for width in sorted(current_app.config.get('IMAGE_DERIVATIVE_WIDTHS', []))
+    )
+
+def _link(url, rel, attributes=()):
+    parts = [f'<{url}>', f'rel={rel}']
+    parts.extend(name if value is None else f'{name}="{value}"' for name, value in attributes)
+    return '; '.join(parts)
+
+def critical_hints():
+    """Link values for what every book page needs before first paint.
+
+    Only files present in the static file index are preloaded, so a hint
+    never points at a 404.
+    """
+    hints = [
+        _link(FONT_ORIGINS[0], 'preconnect'),
+        _link(FONT_ORIGINS[1], 'preconnect', [('crossorigin', None)]),
+        _link(FONT_STYLESHEET, 'preload', [('as', 'style')]),
+    ]
+    index = get_resolution_index()
+    for filename, destination in CRITICAL_ASSETS:
+        if index.resolve(filename) is not None:
+            hints.append(_link(asset_url(filename), 'preload', [('as', destination)]))
+    return hints
+
+def asset_plan(pages):
+    """Link values for a book page: the critical assets plus the thumbnails of ``pages``.
+
+    Image hints carry the same URL, srcset and sizes as the ``<img>`` tags,
+    so the browser reuses the preloaded response. Audio is never preloaded.
+    """
+    hints = critical_hints()
+    index = get_resolution_index()
+    for page in pages:
+        if index.resolve(page.image) is None:
+            continue
+        attributes = [('as', 'image')]
+        srcset = asset_srcset(page.image)
+        if srcset:
+            attributes += [('imagesrcset', srcset), ('imagesizes', THUMBNAIL_SIZES)]
+        hints.append(_link(asset_url(page.image, w=THUMBNAIL_WIDTH), 'preload', attributes))
+    return hints
+
+def send_early_hints(links):
+    """Send a 103 Early Hints response carrying ``links``, if the server supports it.
+
+    Servers that can (gunicorn 22+) expose a ``wsgi.early_hints`` callable;
+    elsewhere the hints only go out as the final response's Link header.
+    """
+    early_hints = request.environ.get('wsgi.early_hints')
+    if early_hints is None or not links or not current_app.config.get('EARLY_HINTS', True):
+        return False
+    early_hints([('Link', link) for link in links])
+    return True
+
+@main_bp.app_context_processor
+def asset_helpers():
+    return {'asset_url': asset_url, 'asset_srcset': asset_srcset}
+
+def _open_source(entry, cache):
+    """Return ``(source, cached)`` for the bytes of an indexed file.
+
+    Cached bytes are reused when their digest still matches the index; files
+    too large for the cache are streamed from their storage backend; anything
+    else is read whole (one query for blobs held in the database), which then
+    populates the cache.
+    """
+    chunk_size = current_app.config.get('STATIC_STREAM_CHUNK_SIZE', 64 * 1024)
+    cached_file = cache.get(entry.filename) if cache is not None else None
+    if cached_file is not None and entry.digest in (None, cached_file.digest):
+        return MemorySource(cached_file.data, chunk_size), True
+
+    storage = get_storage()
+    try:
+        if entry.digest is not None and entry.size is not None and (cache is None or not cache.accepts(entry.size)):
+            # Too large to cache: stream it so memory stays bounded by the chunk size
+            if request.environ.get(ASYNC_ENVIRON_KEY):
+                # Sent from the event loop: reopen the BLOB per (larger) chunk instead of
+                # pinning a pooled connection for as long as the client takes
+                return storage.source(entry.blob_id, entry.digest, entry.size,
+                                      current_app.config.get('ASGI_CHUNK_SIZE', 256 * 1024),
+                                      hold_connection=False), False
+            return storage.source(entry.blob_id, entry.digest, entry.size, chunk_size), False
+
+        def load():
+            data = storage.read(entry.blob_id, entry.digest)
+            if data is not None and cache is not None:
+                cache.put(entry.filename, CachedFile.from_entry(entry, data))
+            return data
+
+        # Requests arriving while this file is being read wait for that read
+        data = get_static_loads().do((entry.filename, entry.digest), load)
+    except BlobNotFound:
+        current_app.logger.error(f"Blob for {entry.filename} is missing from its storage backend")
+        abort(404)
+    except LoadTimeout as e:
+        current_app.logger.warning(str(e))
+        abort(Response('Asset load timed out\n', status=503, mimetype='text/plain', headers={'Retry-After': '1'}))
+    if data is None:
+        # Deleted by another process since the index was built
+        abort(404)
+    return MemorySource(data, chunk_size), False
+
+def _disk_tier_response(tier, entry):
+    """Serve ``entry`` from the local disk tier, materializing it on first use.
+
+    Returns None when the file cannot be put on disk, so the caller falls back
+    to serving from the database.
+    """
+    path = tier.path_for(entry.digest)
+    if not path.is_file():
+        def materialize():
+            # Another request may have finished writing it while this one waited
+            if not path.is_file():
+                tier.materialize(get_storage().source(entry.blob_id, entry.digest, entry.size, tier.chunk_size),
+                                 entry.digest)
+
+        try:
+            get_static_loads().do(('disk', entry.digest), materialize)
+        except Exception as e:
+            current_app.logger.warning(f"Could not materialize {entry.filename} to disk tier: {e}")
+            return None
+
+    mode = current_app.config.get('DISK_TIER_MODE')
+    if mode == 'sendfile':
+        return _body_response(entry, FileSource(path, tier.chunk_size))
+
+    # Let the fronting proxy send the file (and handle Range) itself
+    response = Response(mimetype=entry.content_type)
+    if mode == 'x-accel-redirect':
+        prefix = current_app.config.get('DISK_TIER_ACCEL_PREFIX', '/_asset_tier/').rstrip('/')
+        response.headers['X-Accel-Redirect'] = f'{prefix}/{tier.relative_path(entry.digest)}'
+    else:
+        response.headers['X-Sendfile'] = str(path)
+    if entry.encoding:
+        response.headers['Content-Encoding'] = entry.encoding
     return response
 
+def _negotiate_encoding(entry):
+    """Pick the stored precompressed variant the client accepts best, if any."""
+    encoded = sorted((variant for variant in entry.variants if variant.encoding),
+                     key=lambda variant: variant.size)
+    if not encoded:
+        return None
+    best = request.accept_encodings.best_match([variant.encoding for variant in encoded])
+    return next((variant for variant in encoded if variant.encoding == best), None)
+
+def _pick_derivative(entry, requested_width, accept=None):
+    """Pick the narrowest stored resize at least ``requested_width`` wide.
+
+    Returns None when the original is the best fit. Among derivatives of the
+    chosen width the format is negotiated from ``accept`` (the request's
+    Accept header by default).
+    """
+    widths = sorted({variant.width for variant in entry.variants
+                     if variant.width and variant.width >= requested_width})
+    if not widths:
+        return None
+    candidates = [variant for variant in entry.variants if variant.width == widths[0]]
+    # Order by size descending so a wildcard Accept falls back to the widely supported format
+    candidates.sort(key=lambda variant: variant.size or 0, reverse=True)
+    if accept is None:
+        accept = request.accept_mimetypes
+    best = accept.best_match([variant.content_type for variant in candidates])
+    return next((variant for variant in candidates if variant.content_type == best), candidates[0])
+
+def _is_not_modified(digest, last_modified):
+    return digest is not None and not is_resource_modified(
+        request.environ, etag=digest, last_modified=last_modified)
+
+def _if_range_matches(digest, last_modified):
+    """Honour a Range header only if If-Range (when sent) still matches."""
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == digest
+    if if_range.date is not None:
+        return last_modified is not None and http_date(last_modified) == http_date(if_range.date)
+    return True
+
+def _set_headers(response, entry, vary, immutable=False):
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if immutable else STATIC_CACHE_CONTROL
+    if entry.digest is not None:
+        response.set_etag(entry.digest)
+    if entry.last_modified is not None:
+        response.last_modified = entry.last_modified
+    for header in vary:
+        response.vary.add(header)
+    return response
+
+def _body_response(entry, source):
+    """Build a full, partial or 416 response for the file behind ``source``."""
+    ranges = None
+    if request.range is not None and _if_range_matches(entry.digest, entry.last_modified):
+        try:
+            ranges = resolve_ranges(request.range, source.size)
+        except RangeNotSatisfiable:
+            return unsatisfiable_response(source.size)
+
+    if ranges:
+        response = range_response(source, entry.content_type, ranges)
+    elif isinstance(source, MemorySource) and isinstance(source.data, bytes):
+        response = Response(source.data, mimetype=entry.content_type)
+    elif isinstance(source, FileSource):
+        # Zero-copy through wsgi.file_wrapper (sendfile under gunicorn)
+        response = send_file(source.path, mimetype=entry.content_type, conditional=False, etag=False)
+    else:
+        response = full_response(source, entry.content_type)
+
+    if entry.encoding:
+        response.headers['Content-Encoding'] = entry.encoding
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+@main_bp.route(ASSET_PREFIX + '<path:filename>')
+def serve_static_from_db(filename):
+    logger = current_app.logger
+    # %-style arguments: nothing is formatted unless DEBUG is enabled
+    logger.debug('Attempting to serve: %s', filename)
+
+    index = get_resolution_index()
+    entry = index.resolve(filename)
+    immutable = False
+    if entry is None:
+        # name.<fingerprint>.ext; a stale fingerprint still gets today's contents
+        entry, immutable = index.resolve_fingerprinted(filename)
+    missing = get_missing_paths()
+    if entry is None:
+        logger.debug('File %s not found in database', filename)
+        if missing is not None:
+            missing.record(filename)
+        abort(404)
+    if missing is not None:
+        missing.forget(filename)
+
+    # Swap in a resized image or precompressed variant when one fits the request
+    vary = []
+    variant = None
+    requested_width = request.args.get('w', type=int)
+    if requested_width and any(variant.width for variant in entry.variants):
+        vary.append('Accept')
+        variant = _pick_derivative(entry, requested_width)
+    elif any(variant.encoding for variant in entry.variants):
+        vary.append('Accept-Encoding')
+        variant = _negotiate_encoding(entry)
+    if variant is not None:
+        entry = variant
+
+    # Answer revalidations from the metadata alone, before touching the BLOB
+    if _is_not_modified(entry.digest, entry.last_modified):
+        return _set_headers(Response(status=304), entry, vary, immutable)
+
+    get_storage().record_request(entry.digest)
+    tier = get_disk_tier()
+    if tier is not None and entry.digest is not None:
+        response = _disk_tier_response(tier, entry)
+        if response is not None:
+            response.headers['X-Cache'] = 'DISK'
+            return _set_headers(response, entry, vary, immutable)
+
+    cache = get_static_cache()
+    source, cached = _open_source(entry, cache)
+    response = _body_response(entry, source)
+    response.headers['X-Cache'] = 'HIT' if cached else 'MISS'
+    return _set_headers(response, entry, vary, immutable)
+
 def register_routes(app):
+    from main.routes.api import api_bp
+    from main.routes.offline import offline_bp
     app.register_blueprint(main_bp)
+    app.register_blueprint(api_bp)
+    app.register_blueprint(offline_bp)
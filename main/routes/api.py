@@ -0,0 +1,230 @@
+# main/routes/api.py
+import base64
+import json
+
+from flask import Blueprint, jsonify, request, url_for
+from sqlalchemy import tuple_
+from sqlalchemy.orm import joinedload, selectinload
+from werkzeug.exceptions import BadRequest, HTTPException, NotFound
+
+from main import db
+from main.models import Animal, Book, Page
+from main.page_cache import cached_response, get_api_cache
+from main.resolver import get_resolution_index
+from main.routes import asset_url
+
+api_bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Fields each resource type can be trimmed to with ?fields[type]=a,b
+FIELDS = {
+    'books': ('id', 'title', 'author', 'illustrator', 'page_count', 'pages'),
+    'pages': ('id', 'book_id', 'number', 'content', 'animal', 'image', 'sound'),
+    'animals': ('id', 'name'),
+    'assets': ('filename', 'url', 'content_type', 'size', 'digest', 'variants'),
+}
+
+
+def _requested_fields(resource):
+    """Return the fields asked for with ``fields[resource]``, or all of them."""
+    raw = request.args.get(f'fields[{resource}]')
+    if raw is None:
+        return FIELDS[resource]
+    fields = tuple(field for field in raw.split(',') if field)
+    unknown = set(fields) - set(FIELDS[resource])
+    if unknown:
+        raise BadRequest(f"Unknown {resource} field(s): {', '.join(sorted(unknown))}")
+    return fields
+
+
+def _encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise BadRequest('Malformed cursor')
+
+
+def _page_args():
+    """Return the validated ``(limit, after)`` of a collection request."""
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise BadRequest(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+
+    cursor = request.args.get('after')
+    if not cursor:
+        return limit, None
+    values = _decode_cursor(cursor)
+    if not isinstance(values, list) or any(type(value) not in (int, str) for value in values):
+        raise BadRequest('Malformed cursor')
+    return limit, tuple(values)
+
+
+def _paginate(query, order_columns):
+    """Apply keyset pagination over ``order_columns`` (which must end in a unique column).
+
+    Returns ``(rows, next_cursor)``. The cursor holds the sort key of the
+    last row, so pages stay stable while rows are inserted or deleted.
+    """
+    limit, values = _page_args()
+    if values is not None:
+        if (len(values) != len(order_columns)
+                or any(type(value) is not column.type.python_type
+                       for value, column in zip(values, order_columns))):
+            raise BadRequest('Malformed cursor')
+        query = query.filter(tuple_(*order_columns) > tuple_(*values))
+
+    rows = query.order_by(*order_columns).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, _encode_cursor([getattr(last, column.key) for column in order_columns])
+
+
+def _collection(items, next_cursor):
+    next_url = None
+    if next_cursor:
+        args = request.args.to_dict()
+        args['after'] = next_cursor
+        next_url = url_for(request.endpoint, **request.view_args, **args)
+    return {'data': items, 'links': {'next': next_url}}
+
+
+def _asset(filename, fields, include_variants=True):
+    """Describe a stored file from the resolution index (no database query)."""
+    if filename is None:
+        return None
+    entry = get_resolution_index().resolve(filename)
+    if entry is None:
+        # Referenced by the catalog but not uploaded (yet)
+        return {field: None for field in fields if field != 'variants'} | {'filename': filename}
+    asset = {
+        'filename': entry.filename,
+        'url': asset_url(entry.filename),
+        'content_type': entry.content_type,
+        'size': entry.size,
+        'digest': entry.digest,
+    }
+    if include_variants:
+        asset['variants'] = [
+            dict(_asset(variant.filename, fields, include_variants=False),
+                 width=variant.width, encoding=variant.encoding)
+            for variant in entry.variants
+        ]
+    return {field: value for field, value in asset.items() if field in fields}
+
+
+def _animal(animal, fields):
+    return {field: getattr(animal, field) for field in fields}
+
+
+def _page(page, fields):
+    asset_fields = _requested_fields('assets')
+    result = {}
+    for field in fields:
+        if field == 'animal':
+            result['animal'] = _animal(page.animal, _requested_fields('animals'))
+        elif field in ('image', 'sound'):
+            result[field] = _asset(getattr(page, field), asset_fields)
+        else:
+            result[field] = getattr(page, field)
+    return result
+
+
+def _book(book, fields, page_counts=None):
+    """Serialize a book; ``page_counts`` replaces loading ``book.pages`` in listings."""
+    result = {}
+    for field in fields:
+        if field == 'pages':
+            page_fields = _requested_fields('pages')
+            result['pages'] = [_page(page, page_fields) for page in book.pages]
+        elif field == 'page_count':
+            result['page_count'] = len(book.pages) if page_counts is None else page_counts.get(book.id, 0)
+        else:
+            result[field] = getattr(book, field)
+    return result
+
+
+def _json(build, paginated=False):
+    """Serve ``build()``'s result as JSON through the API response cache.
+
+    The key holds only the validated parameters, so unknown or reordered
+    query arguments share one entry instead of each adding their own.
+    """
+    key = (request.path, tuple(_requested_fields(resource) for resource in FIELDS))
+    if paginated:
+        key += _page_args()
+    return cached_response(key, lambda: json.dumps(build(), separators=(',', ':')).encode(),
+                           'application/json', get_api_cache())
+
+
+@api_bp.route('/books')
+def list_books():
+    def build():
+        fields = tuple(field for field in _requested_fields('books') if field != 'pages')
+        books, next_cursor = _paginate(db.session.query(Book), [Book.id])
+        page_counts = {}
+        if 'page_count' in fields and books:
+            page_counts = dict(db.session.query(Page.book_id, db.func.count(Page.id))
+                               .filter(Page.book_id.in_([book.id for book in books]))
+                               .group_by(Page.book_id).all())
+        return _collection([_book(book, fields, page_counts) for book in books], next_cursor)
+    return _json(build, paginated=True)
+
+
+@api_bp.route('/books/<int:book_id>')
+def get_book(book_id):
+    def build():
+        fields = _requested_fields('books')
+        query = db.session.query(Book)
+        if 'pages' in fields or 'page_count' in fields:
+            query = query.options(selectinload(Book.pages).joinedload(Page.animal))
+        book = query.filter(Book.id == book_id).one_or_none()
+        if book is None:
+            raise NotFound(f'No book with id {book_id}')
+        return {'data': _book(book, fields)}
+    return _json(build)
+
+
+@api_bp.route('/books/<int:book_id>/pages')
+def list_book_pages(book_id):
+    def build():
+        if db.session.get(Book, book_id) is None:
+            raise NotFound(f'No book with id {book_id}')
+        query = db.session.query(Page).options(joinedload(Page.animal)).filter(Page.book_id == book_id)
+        pages, next_cursor = _paginate(query, [Page.number, Page.id])
+        fields = _requested_fields('pages')
+        return _collection([_page(page, fields) for page in pages], next_cursor)
+    return _json(build, paginated=True)
+
+
+@api_bp.route('/pages')
+def list_pages():
+    def build():
+        query = db.session.query(Page).options(joinedload(Page.animal))
+        pages, next_cursor = _paginate(query, [Page.id])
+        fields = _requested_fields('pages')
+        return _collection([_page(page, fields) for page in pages], next_cursor)
+    return _json(build, paginated=True)
+
+
+@api_bp.route('/animals')
+def list_animals():
+    def build():
+        animals, next_cursor = _paginate(db.session.query(Animal), [Animal.id])
+        fields = _requested_fields('animals')
+        return _collection([_animal(animal, fields) for animal in animals], next_cursor)
+    return _json(build, paginated=True)
+
+
+@api_bp.errorhandler(HTTPException)
+def api_error(error):
+    response = jsonify({'error': error.name, 'message': error.description})
+    response.status_code = error.code
+    return response
@@ -0,0 +1,68 @@
+# main/routes/offline.py
+import hashlib
+import json
+
+from flask import Blueprint, current_app, render_template, url_for
+from werkzeug.datastructures import MIMEAccept
+
+from main.assets import RESIZABLE_TYPES
+from main.page_cache import cached_response
+from main.resolver import get_resolution_index
+from main.routes import ASSET_PREFIX, _pick_derivative, asset_url
+
+offline_bp = Blueprint('offline', __name__)
+
+# Accept header the service worker precaches images with; every browser
+# that runs service workers decodes WebP
+PRECACHE_ACCEPT = 'image/webp,*/*;q=0.8'
+
+
+def _manifest_asset(url, entry):
+    return {'url': url, 'digest': entry.digest, 'size': entry.size, 'content_type': entry.content_type}
+
+
+def build_manifest():
+    """List every stored file under the URLs pages request it by.
+
+    Originals are listed under their fingerprinted URL. Resizable images are
+    also listed at every derivative width, as ``srcset`` requests them. Each
+    digest is that of the response the service worker receives for the URL,
+    so a re-seeded file or derivative shows up as a changed digest. The
+    version changes whenever any URL or digest does.
+    """
+    accept = MIMEAccept([('image/webp', 1), ('*/*', 0.8)])
+    widths = sorted(current_app.config.get('IMAGE_DERIVATIVE_WIDTHS', []))
+    assets = []
+    for entry in sorted(get_resolution_index().entries(), key=lambda entry: entry.filename):
+        if entry.variant_of_id is not None or entry.digest is None:
+            continue
+        assets.append(_manifest_asset(asset_url(entry.filename), entry))
+        if entry.content_type in RESIZABLE_TYPES:
+            for width in widths:
+                served = _pick_derivative(entry, width, accept) or entry
+                assets.append(_manifest_asset(asset_url(entry.filename, w=width), served))
+
+    listing = json.dumps([[asset['url'], asset['digest']] for asset in assets])
+    return {
+        'version': hashlib.sha256(listing.encode()).hexdigest()[:16],
+        'widths': widths,
+        'assets': assets,
+    }
+
+
+@offline_bp.route('/precache-manifest.json')
+def precache_manifest():
+    """The precache manifest, rebuilt only when the static file index changes."""
+    return cached_response(('offline', 'manifest'),
+                           lambda: json.dumps(build_manifest(), separators=(',', ':')).encode(),
+                           'application/json')
+
+
+@offline_bp.route('/sw.js')
+def service_worker():
+    """The service worker script, served from the root so it controls every page."""
+    def build():
+        return render_template('sw.js', enabled=current_app.config.get('SERVICE_WORKER_ENABLED', True),
+                               manifest_url=url_for('offline.precache_manifest'),
+                               asset_prefix=ASSET_PREFIX, precache_accept=PRECACHE_ACCEPT).encode()
+    return cached_response(('offline', 'sw.js'), build, 'text/javascript')
@@ -0,0 +1,270 @@
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+
+from main import db
+from main.cache import CachedFile
+from main.models import StaticBlob, StaticFile
+from main.storage import get_storage
+
+# Segment layout: header | blobs (each ALIGNMENT-aligned) | JSON index.
+# The header holds the magic, the offset and length of the index, and the
+# static_files fingerprint the segment was built from (its generation).
+MAGIC = b'BBASSET1'
+HEADER = struct.Struct('<8sQQ32s')
+ALIGNMENT = 64
+
+
+def default_segment_path(database_uri):
+    """A per-database segment path, in /dev/shm when the host has it."""
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    tag = hashlib.sha256(database_uri.encode()).hexdigest()[:12]
+    return os.path.join(directory, f'brown_bear_assets-{tag}.seg')
+
+
+def table_generation():
+    """Digest of the count/max-id/max-updated_at of static_files; changes on any write."""
+    fingerprint = db.session.query(
+        func.count(StaticFile.id), func.max(StaticFile.id), func.max(StaticFile.updated_at)
+    ).one()
+    return hashlib.sha256(repr(tuple(fingerprint)).encode()).digest()
+
+
+class Segment:
+    """A mapped, read-only segment: entries are memoryviews into the mapping."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.identity = os.fstat(f.fileno()).st_ino
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_offset, index_length, self.generation = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not an asset cache segment')
+        index = json.loads(self.map[index_offset:index_offset + index_length])
+        view = memoryview(self.map)
+        self.data_bytes = index['data_bytes']
+        self.files = {
+            filename: CachedFile(filename, None, view[offset:offset + size], digest)
+            for filename, (offset, size, digest) in index['files'].items()
+        }
+
+
+class SharedAssetCache:
+    """Static file contents shared by every worker on the host through one mmap'd file.
+
+    A single writer (whichever process wins a ``flock`` on the lock file)
+    copies blobs from the database into a new segment file and renames it
+    over ``path``. Readers map the file read-only and hand out memoryviews
+    into it, so the contents live once in the page cache however many
+    workers there are. Each segment records the ``static_files`` generation
+    it was built from. Every ``check_interval`` seconds a reader compares
+    it with the table. When the table has moved on, the reader starts a
+    rebuild in the background, and it remaps once the file has been
+    replaced. Until then stale entries are skipped, because callers check
+    each digest against the resolution index.
+
+    Implements the lookup side of the BlobCache interface; ``put`` is a
+    no-op because only the writer fills the segment.
+    """
+
+    def __init__(self, path, max_bytes, max_entry_bytes=None, check_interval=2.0):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + '.lock')
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes if max_entry_bytes is None else min(max_entry_bytes, max_bytes)
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self._segment = None
+        self._next_check = 0.0
+        self._rebuild_thread = None
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self.get_first((key,))
+
+    def get_first(self, keys):
+        self._refresh_if_needed()
+        segment = self._segment
+        if segment is not None:
+            for key in keys:
+                entry = segment.files.get(key)
+                if entry is not None:
+                    self.hits += 1
+                    return entry
+        self.misses += 1
+        return None
+
+    def put(self, key, entry):
+        return False
+
+    def accepts(self, size):
+        return size <= self.max_entry_bytes
+
+    def invalidate(self, key):
+        # A local write: compare generations on the next lookup
+        self._next_check = 0.0
+
+    def clear(self):
+        self._segment = None
+        self._next_check = 0.0
+
+    def __contains__(self, key):
+        segment = self._segment
+        return segment is not None and key in segment.files
+
+    def __len__(self):
+        segment = self._segment
+        return len(segment.files) if segment is not None else 0
+
+    def stats(self):
+        segment = self._segment
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(segment.files) if segment is not None else 0,
+            # Nothing is held privately; the segment is reported separately so
+            # summing over workers does not count it once per worker
+            'bytes': 0,
+            'shared_bytes': segment.data_bytes if segment is not None else 0,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': 0,
+            'rebuilds': self.rebuilds,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+    def _refresh_if_needed(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        with self._lock:
+            if now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+            self._remap_if_replaced()
+            try:
+                current = table_generation()
+            except SQLAlchemyError:
+                db.session.rollback()
+                return
+            if self._segment is None or self._segment.generation != current:
+                self._start_rebuild()
+
+    def _remap_if_replaced(self):
+        try:
+            identity = self.path.stat().st_ino
+        except FileNotFoundError:
+            self._segment = None
+            return
+        if self._segment is not None and self._segment.identity == identity:
+            return
+        try:
+            # The old mapping stays valid for responses still using it
+            self._segment = Segment(self.path)
+        except (OSError, ValueError) as e:
+            current_app.logger.warning(f"Could not map asset cache segment {self.path}: {e}")
+            self._segment = None
+
+    def _start_rebuild(self):
+        if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+            return
+        app = current_app._get_current_object()
+
+        def run():
+            with app.app_context():
+                try:
+                    if self.rebuild():
+                        self._next_check = 0.0
+                except Exception as e:
+                    app.logger.warning(f"Asset cache segment rebuild failed: {e}")
+                finally:
+                    db.session.remove()
+
+        self._rebuild_thread = threading.Thread(target=run, name='asset-segment-writer', daemon=True)
+        self._rebuild_thread.start()
+
+    def rebuild(self, force=False):
+        """Write a segment for the current table and swap it in, if this process gets the writer lock.
+
+        Returns True if a new segment was written. Must be called inside an
+        app context.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another worker is writing; its segment is picked up on a later check
+                return False
+
+            generation = table_generation()
+            if not force:
+                try:
+                    with open(self.path, 'rb') as f:
+                        if HEADER.unpack(f.read(HEADER.size))[3] == generation:
+                            return False
+                except (OSError, struct.error):
+                    pass
+
+            self._write_segment(generation)
+            self.rebuilds += 1
+            return True
+
+    def _write_segment(self, generation):
+        rows = (db.session.query(StaticFile.filename, StaticBlob.id, StaticBlob.digest, StaticBlob.size)
+                .join(StaticBlob, StaticBlob.digest == StaticFile.digest)
+                .filter(StaticBlob.size <= self.max_entry_bytes)
+                .order_by(StaticFile.id).all())
+
+        # Lay out each distinct blob once, in table order, until the budget is used up
+        offsets = {}
+        blobs = []
+        position = HEADER.size
+        data_bytes = 0
+        for _, blob_id, digest, size in rows:
+            if digest in offsets or data_bytes + size > self.max_bytes:
+                continue
+            position += -position % ALIGNMENT
+            offsets[digest] = position
+            blobs.append((blob_id, digest, size, position))
+            position += size
+            data_bytes += size
+        files = {filename: [offsets[digest], size, digest]
+                 for filename, _, digest, size in rows if digest in offsets}
+        index = json.dumps({'data_bytes': data_bytes, 'files': files}).encode()
+        total = position + len(index)
+
+        fd, tmp_name = tempfile.mkstemp(dir=self.path.parent, prefix=self.path.name + '.tmp-')
+        try:
+            os.ftruncate(fd, total)
+            with mmap.mmap(fd, total) as segment:
+                for blob_id, digest, size, offset in blobs:
+                    source = get_storage().source(blob_id, digest, size, 1024 * 1024)
+                    for chunk in source.iter_range(0, size):
+                        segment[offset:offset + len(chunk)] = chunk
+                        offset += len(chunk)
+                segment[position:total] = index
+                HEADER.pack_into(segment, 0, MAGIC, position, len(index), generation)
+            os.close(fd)
+            fd = None
+            os.replace(tmp_name, self.path)
+        except BaseException:
+            if fd is not None:
+                os.close(fd)
+            if os.path.exists(tmp_name):
+                os.unlink(tmp_name)
+            raise
+        current_app.logger.info(f"Asset cache segment written: {len(files)} files, {data_bytes} bytes")
@@ -0,0 +1,332 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from urllib.parse import quote
+
+from flask import current_app
+from sqlalchemy import create_engine, event
+
+from main import db
+
+
+class BackupError(Exception):
+    """Raised when a backup fails verification and must not be restored."""
+
+
+def sqlite_database_path(uri):
+    """Return the file path of a ``sqlite:///`` URI, or None for other databases."""
+    if not uri.startswith('sqlite:///'):
+        return None
+    path = uri[len('sqlite:///'):].split('?', 1)[0]
+    if path in ('', ':memory:') or path.startswith('file::memory:'):
+        return None
+    return path
+
+
+def sqlite_pragmas(config, readonly=False):
+    """Return the ``PRAGMA`` statements of the configured SQLite profile, in order."""
+    pragmas = []
+    if readonly:
+        pragmas.append(('query_only', 'ON'))
+    else:
+        pragmas.append(('journal_mode', config['SQLITE_JOURNAL_MODE']))
+        pragmas.append(('synchronous', config['SQLITE_SYNCHRONOUS']))
+    pragmas.append(('cache_size', config['SQLITE_CACHE_SIZE']))
+    pragmas.append(('mmap_size', config['SQLITE_MMAP_SIZE']))
+    pragmas.append(('busy_timeout', config['SQLITE_BUSY_TIMEOUT']))
+    return [f'PRAGMA {name}={value}' for name, value in pragmas]
+
+
+def _apply_pragmas(engine, statements):
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+
+
+def configure_sqlite_engine(app):
+    """Size the main engine's pool from THREADS_PER_WORKER for file databases.
+
+    Must run before ``db.init_app`` so Flask-SQLAlchemy picks the options up.
+    """
+    if sqlite_database_path(app.config['SQLALCHEMY_DATABASE_URI']) is None:
+        return
+    threads = app.config.get('THREADS_PER_WORKER', 4)
+    options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    options.setdefault('pool_size', threads)
+    options.setdefault('max_overflow', threads)
+
+
+def init_sqlite_profile(app):
+    """Apply the SQLite pragma profile and create the read-only asset engine.
+
+    Every connection of the main engine gets WAL, ``synchronous``, page
+    cache, ``mmap_size`` and ``busy_timeout`` settings. Asset reads go
+    through a second pool opened with ``mode=ro`` (and ``immutable=1`` when
+    SQLITE_ASSET_IMMUTABLE is set), so BLOB reads never take write locks.
+    In-memory databases keep the defaults and share the main engine.
+    """
+    with app.app_context():
+        engine = db.engine
+    path = engine.url.database
+    if engine.url.get_backend_name() != 'sqlite' or path in (None, '', ':memory:'):
+        return None
+    if engine.url.query.get('uri'):
+        path = path[len('file:'):]
+
+    if app.config.get('SQLITE_TUNING', True):
+        _apply_pragmas(engine, sqlite_pragmas(app.config))
+    if not app.config.get('SQLITE_ASSET_POOL', True):
+        return None
+
+    # immutable=1 skips locking and change detection entirely: only safe for
+    # databases nothing writes to while the app runs (e.g. baked into an image)
+    params = 'mode=ro&immutable=1' if app.config.get('SQLITE_ASSET_IMMUTABLE') else 'mode=ro'
+    threads = app.config.get('THREADS_PER_WORKER', 4)
+    asset_engine = create_engine(f'sqlite:///file:{quote(path)}?{params}&uri=true',
+                                 pool_size=threads, max_overflow=2)
+    if app.config.get('SQLITE_TUNING', True):
+        _apply_pragmas(asset_engine, sqlite_pragmas(app.config, readonly=True))
+    app.extensions['asset_engine'] = asset_engine
+    return asset_engine
+
+
+def get_asset_engine():
+    """Return the engine asset reads should use: the read-only pool if configured."""
+    return current_app.extensions.get('asset_engine') or db.engine
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def backup_database(db_path, backup_path, pages_per_step=1024, sleep=0.005,
+                    compress=False, progress=None):
+    """Copy a live SQLite database with the online backup API.
+
+    Pages are copied ``pages_per_step`` at a time and the source lock is
+    released between steps, so workers keep reading and writing while the
+    backup runs; pages changed mid-backup are re-copied by SQLite. The copy
+    is written next to ``backup_path`` and renamed into place once complete,
+    gzip-compressed when ``compress`` is set. ``progress(copied, total)``
+    is called after each step.
+
+    Returns the manifest dict (also written to ``<backup_path>.json``).
+    """
+    backup_path = str(backup_path)
+    started = time.monotonic()
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(backup_path) or '.', prefix='.tmp-')
+    os.close(fd)
+    pages = 0
+
+    def step(status, remaining, total):
+        nonlocal pages
+        pages = total
+        if progress is not None:
+            progress(total - remaining, total)
+
+    try:
+        source = sqlite3.connect(Path(os.path.abspath(db_path)).as_uri() + '?mode=ro', uri=True)
+        target = sqlite3.connect(tmp_name)
+        try:
+            source.backup(target, pages=pages_per_step, progress=step, sleep=sleep)
+            page_size = target.execute('PRAGMA page_size').fetchone()[0]
+        finally:
+            target.close()
+            source.close()
+
+        database_bytes = os.path.getsize(tmp_name)
+        if compress:
+            with open(tmp_name, 'rb') as raw, gzip.open(backup_path, 'wb') as packed:
+                shutil.copyfileobj(raw, packed, 1024 * 1024)
+            os.unlink(tmp_name)
+        else:
+            os.replace(tmp_name, backup_path)
+    except BaseException:
+        for name in (tmp_name, backup_path if compress else None):
+            if name and os.path.exists(name):
+                os.unlink(name)
+        raise
+
+    manifest = {
+        'file': os.path.basename(backup_path),
+        'source': str(db_path),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'compressed': compress,
+        'sha256': file_sha256(backup_path),
+        'size': os.path.getsize(backup_path),
+        'database_bytes': database_bytes,
+        'pages': pages,
+        'page_size': page_size,
+        'seconds': round(time.monotonic() - started, 3),
+    }
+    with open(backup_path + '.json', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def read_manifest(backup_path):
+    """Return the manifest written alongside a backup, or None if it has none."""
+    try:
+        with open(str(backup_path) + '.json') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def restore_marker_path(db_path):
+    """Return the file touched after every restore into ``db_path``."""
+    return str(db_path) + '.restored'
+
+
+def _copy_into_live_database(source_path, db_path, timeout):
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(db_path, timeout=timeout)
+    try:
+        page_size = target.execute('PRAGMA page_size').fetchone()[0]
+        if source.execute('PRAGMA page_size').fetchone()[0] != page_size:
+            # A WAL database cannot change its page size, so the copy has to match it
+            source.execute('PRAGMA journal_mode=DELETE')
+            source.execute(f'PRAGMA page_size={int(page_size)}')
+            source.execute('VACUUM')
+        # One step: every page is written under a single write transaction
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def restore_database(backup_path, db_path, timeout=30.0):
+    """Replace the contents of the database at ``db_path`` with a verified backup.
+
+    The backup is checked against its manifest, expanded into a temporary
+    file in the database's directory and integrity-checked there. It is then
+    copied into the live database with SQLite's backup API as one write
+    transaction, waiting up to ``timeout`` seconds for other writers. The
+    file is not swapped, so connections that workers already hold see either
+    the old or the restored contents, and their later writes land in the
+    restored database. The WAL and shared-memory files stay consistent. When
+    the copy is done, ``<db_path>.restored`` is touched. The watcher installed
+    by ``init_database_watcher`` sees this and drops the static file caches.
+    """
+    backup_path = str(backup_path)
+    manifest = read_manifest(backup_path)
+    if manifest is not None and file_sha256(backup_path) != manifest['sha256']:
+        raise BackupError(f'{backup_path} does not match the checksum in its manifest')
+
+    db_dir = os.path.dirname(os.path.abspath(db_path))
+    fd, tmp_name = tempfile.mkstemp(dir=db_dir, prefix='.restore-')
+    try:
+        opener = gzip.open if backup_path.endswith('.gz') else open
+        with opener(backup_path, 'rb') as source, os.fdopen(fd, 'wb') as target:
+            shutil.copyfileobj(source, target, 1024 * 1024)
+
+        connection = sqlite3.connect(tmp_name)
+        try:
+            result = connection.execute('PRAGMA integrity_check').fetchone()[0]
+        finally:
+            connection.close()
+        if result != 'ok':
+            raise BackupError(f'{backup_path} failed the integrity check: {result}')
+
+        if os.path.exists(db_path):
+            _copy_into_live_database(tmp_name, db_path, timeout)
+        else:
+            # Nothing can have it open yet
+            os.replace(tmp_name, db_path)
+    finally:
+        for suffix in ('', '-journal', '-wal', '-shm'):
+            if os.path.exists(tmp_name + suffix):
+                os.unlink(tmp_name + suffix)
+
+    Path(restore_marker_path(db_path)).touch()
+    return manifest
+
+
+def _file_identity(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    try:
+        restored = os.stat(restore_marker_path(path)).st_mtime_ns
+    except FileNotFoundError:
+        restored = None
+    return stat.st_dev, stat.st_ino, restored
+
+
+class DatabaseFileWatcher:
+    """Notice when the SQLite file is restored (``db:restore``) or swapped out.
+
+    After a restore the static file caches may hold bytes the database no
+    longer has. Connections opened before the file was renamed away keep
+    reading the old inode. So when the file identity or the restore marker
+    changes, the pool is disposed and the static file caches are reset.
+    Checked at most every ``interval`` seconds.
+    """
+
+    def __init__(self, path, interval=2.0):
+        self.path = path
+        self.interval = interval
+        self._identity = _file_identity(path)
+        self._next_check = time.monotonic() + interval
+        self._lock = threading.Lock()
+
+    def check(self, app):
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+
+        with self._lock:
+            if now < self._next_check:
+                return False
+            self._next_check = now + self.interval
+            identity = _file_identity(self.path)
+            if identity == self._identity:
+                return False
+            self._identity = identity
+
+        app.logger.warning(f"Database file {self.path} was replaced or restored; reopening connections")
+        db.session.remove()
+        db.engine.dispose()
+        asset_engine = app.extensions.get('asset_engine')
+        if asset_engine is not None:
+            asset_engine.dispose()
+        cache = app.extensions.get('static_cache')
+        if cache is not None:
+            cache.clear()
+        index = app.extensions.get('static_index')
+        if index is not None:
+            index.invalidate()
+        return True
+
+
+def init_database_watcher(app):
+    """Reopen database connections in this process when the SQLite file is replaced."""
+    path = sqlite_database_path(app.config['SQLALCHEMY_DATABASE_URI'])
+    if path is None:
+        return None
+
+    watcher = DatabaseFileWatcher(path, app.config.get('DATABASE_REPLACE_CHECK_INTERVAL', 2.0))
+    app.extensions['database_watcher'] = watcher
+
+    @app.before_request
+    def reopen_replaced_database():
+        watcher.check(app)
+
+    return watcher
@@ -3,7 +3,9 @@ function toggleFullscreen(imageURL) {
     fullscreenElement.classList.add("fullscreen");
 
     var imgElement = document.createElement("img");
-    imgElement.src = imageURL; // Use the URL passed from HTML
+    // Ask the server for the stored size closest to the screen width
+    var width = Math.round(window.innerWidth * (window.devicePixelRatio || 1));
+    imgElement.src = imageURL + (imageURL.indexOf("?") === -1 ? "?" : "&") + "w=" + width;
 
     fullscreenElement.appendChild(imgElement);
     document.body.appendChild(fullscreenElement);
@@ -17,3 +19,39 @@ function playSound(soundId) {
     var audio = document.getElementById(soundId);
     audio.play();
 }
+
+// Sounds are served with preload="none"; start fetching one as soon as the
+// pointer or keyboard focus reaches its button, so the tap plays without delay
+function primeSound(soundId) {
+    var audio = document.getElementById(soundId);
+    if (audio && audio.preload === "none") {
+        audio.preload = "auto";
+        audio.load();
+    }
+}
+
+document.addEventListener("DOMContentLoaded", function() {
+    var buttons = document.querySelectorAll("button[data-sound]");
+    Array.prototype.forEach.call(buttons, function(button) {
+        var prime = function() { primeSound(button.dataset.sound); };
+        ["pointerenter", "touchstart", "focus"].forEach(function(type) {
+            button.addEventListener(type, prime, { once: true, passive: true });
+        });
+    });
+});
+
+// Register the offline service worker once the page has loaded, or remove a
+// previously registered one when the server has turned it off
+window.addEventListener("load", function() {
+    if (!("serviceWorker" in navigator)) {
+        return;
+    }
+    var meta = document.querySelector('meta[name="service-worker"]');
+    if (meta) {
+        navigator.serviceWorker.register(meta.content);
+    } else {
+        navigator.serviceWorker.getRegistrations().then(function(registrations) {
+            registrations.forEach(function(registration) { registration.unregister(); });
+        });
+    }
+});
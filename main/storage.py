@@ -0,0 +1,531 @@
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from flask import current_app, has_app_context
+from sqlalchemy import select, update
+
+from main import db, shutdown_event
+from main.disk_tier import DigestMismatch, DiskTier, FileSource
+from main.models import StaticBlob
+from main.sqlite import get_asset_engine
+from main.streaming import BlobNotFound, DatabaseSource
+
+try:
+    import boto3
+except ImportError:  # boto3 is optional; only the s3 backend needs it
+    boto3 = None
+
+STORAGE_BACKENDS = ('db', 'fs', 's3')
+
+# Weight of the newest sample in a backend's moving latency average
+LATENCY_SMOOTHING = 0.2
+# Reads a backend needs before its measured latency replaces its configured rank
+MIN_LATENCY_SAMPLES = 5
+# Chunk size of whole-blob reads, so they are timed like streamed ones
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class DatabaseBackend:
+    """Blob bytes in ``static_blobs.data``. Blobs stored elsewhere keep an empty value there."""
+    name = 'db'
+
+    def source(self, blob_id, digest, size, chunk_size, hold_connection=True):
+        return DatabaseSource(get_asset_engine(), blob_id, size, chunk_size, hold_connection=hold_connection)
+
+    def read(self, blob_id, digest):
+        with get_asset_engine().connect() as connection:
+            data = connection.execute(select(StaticBlob.data).where(StaticBlob.id == blob_id)).scalar()
+        if data is None:
+            raise BlobNotFound(digest)
+        return data
+
+    def write(self, blob_id, digest, chunks):
+        db.session.execute(update(StaticBlob).where(StaticBlob.id == blob_id)
+                           .values(data=_verified(digest, chunks)))
+
+    def remove(self, blob_id, digest):
+        db.session.execute(update(StaticBlob).where(StaticBlob.id == blob_id).values(data=b''))
+
+    def digests(self):
+        return None
+
+
+class FilesystemBackend:
+    """Blob bytes as content-addressed files, laid out like the disk tier."""
+    name = 'fs'
+
+    def __init__(self, root, chunk_size=64 * 1024):
+        self.files = DiskTier(root, chunk_size)
+
+    def source(self, blob_id, digest, size, chunk_size, hold_connection=True):
+        try:
+            return FileSource(self.files.path_for(digest), chunk_size)
+        except FileNotFoundError:
+            raise BlobNotFound(digest)
+
+    def read(self, blob_id, digest):
+        try:
+            return self.files.path_for(digest).read_bytes()
+        except FileNotFoundError:
+            raise BlobNotFound(digest)
+
+    def write(self, blob_id, digest, chunks):
+        self.files.write(digest, chunks)
+
+    def remove(self, blob_id, digest):
+        self.files.path_for(digest).unlink(missing_ok=True)
+
+    def digests(self):
+        return self.files.stored_digests()
+
+
+class S3Source:
+    """Serve byte ranges of an object with one ranged GET per chunk."""
+
+    def __init__(self, backend, digest, size, chunk_size):
+        self.backend = backend
+        self.digest = digest
+        self.size = size
+        self.chunk_size = chunk_size
+
+    def iter_range(self, start, end):
+        for offset in range(start, end, self.chunk_size):
+            yield self.backend.get(self.digest, f'bytes={offset}-{min(offset + self.chunk_size, end) - 1}')
+
+
+class S3Backend:
+    """Blob bytes as objects named by digest in an S3-compatible bucket.
+
+    ``client`` is anything with boto3's ``get_object``, ``put_object``,
+    ``delete_object`` and ``list_objects_v2`` (MinIO, R2 and the like work
+    through ``endpoint_url``).
+    """
+    name = 's3'
+
+    def __init__(self, client, bucket, prefix=''):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def key(self, digest):
+        return f'{self.prefix}{digest[:2]}/{digest}'
+
+    def get(self, digest, byte_range=None):
+        options = {'Range': byte_range} if byte_range else {}
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.key(digest), **options)
+        except Exception as e:
+            if _s3_error_code(e) in ('NoSuchKey', '404', 'NotFound'):
+                raise BlobNotFound(digest)
+            raise
+        return response['Body'].read()
+
+    def source(self, blob_id, digest, size, chunk_size, hold_connection=True):
+        return S3Source(self, digest, size, chunk_size)
+
+    def read(self, blob_id, digest):
+        return self.get(digest)
+
+    def write(self, blob_id, digest, chunks):
+        self.client.put_object(Bucket=self.bucket, Key=self.key(digest), Body=_verified(digest, chunks))
+
+    def remove(self, blob_id, digest):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(digest))
+
+    def digests(self):
+        found = set()
+        options = {'Bucket': self.bucket, 'Prefix': self.prefix}
+        while True:
+            page = self.client.list_objects_v2(**options)
+            found.update(item['Key'].rsplit('/', 1)[-1] for item in page.get('Contents', ()))
+            if not page.get('IsTruncated'):
+                return found
+            options['ContinuationToken'] = page['NextContinuationToken']
+
+
+def _s3_error_code(error):
+    return str(getattr(error, 'response', {}).get('Error', {}).get('Code', ''))
+
+
+def _verified(digest, chunks):
+    data = b''.join(chunks)
+    actual = hashlib.sha256(data).hexdigest()
+    if actual != digest:
+        raise DigestMismatch(f'Contents of blob {digest} hash to {actual}')
+    return data
+
+
+class LatencyStats:
+    """Reads and a moving average of time to first byte for one backend."""
+
+    def __init__(self):
+        self.reads = 0
+        self.seconds = 0.0
+        self.average = None
+
+    def observe(self, seconds):
+        self.reads += 1
+        self.seconds += seconds
+        if self.average is None:
+            self.average = seconds
+        else:
+            self.average += LATENCY_SMOOTHING * (seconds - self.average)
+
+
+class TimedSource:
+    """Wrap a source so the time from starting a read to its first chunk is recorded for its backend."""
+
+    def __init__(self, source, stats):
+        self.source = source
+        self.size = source.size
+        self.stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self.source, name)
+
+    def iter_range(self, start, end):
+        started = time.perf_counter()
+        chunks = self.source.iter_range(start, end)
+        for chunk in chunks:
+            if started is not None:
+                self.stats.observe(time.perf_counter() - started)
+                started = None
+            yield chunk
+
+
+class ResumingSource:
+    """Wrap a source so a blob moved away mid-read is finished from its new location.
+
+    A tiering pass drops the old copy right after pointing the row at the new
+    one. A read already under way then hits BlobNotFound (an emptied
+    database row, a deleted object). The read looks the blob up again and
+    continues from the byte it had reached, once.
+    """
+
+    def __init__(self, storage, source, blob_id, digest, chunk_size, hold_connection):
+        self.storage = storage
+        self.source = source
+        self.size = source.size
+        self.blob_id = blob_id
+        self.digest = digest
+        self.chunk_size = chunk_size
+        self.hold_connection = hold_connection
+
+    def __getattr__(self, name):
+        return getattr(self.source, name)
+
+    def iter_range(self, start, end):
+        offset = start
+        try:
+            for chunk in self.source.iter_range(start, end):
+                offset += len(chunk)
+                yield chunk
+            return
+        except BlobNotFound:
+            pass
+        source = self.storage._open(self.blob_id, self.digest, self.size, self.chunk_size, self.hold_connection)
+        yield from source.iter_range(offset, end)
+
+
+class Storage:
+    """The configured blob backends, and where each blob currently lives.
+
+    ``backends`` is ordered fastest first; that order ranks the backends
+    until each has served enough reads for its measured latency to be used
+    instead. New blobs are written to ``default``. With a single backend no
+    location lookups are made.
+    """
+
+    def __init__(self, backends, default='db'):
+        self.backends = {backend.name: backend for backend in backends}
+        if default not in self.backends:
+            raise ValueError(f'STORAGE_DEFAULT_BACKEND {default!r} is not one of STORAGE_BACKENDS')
+        self.default = default
+        self.latency = {name: LatencyStats() for name in self.backends}
+        self.requests = Counter()
+        self.tiering = None
+
+    def add(self, backend):
+        self.backends[backend.name] = backend
+        self.latency.setdefault(backend.name, LatencyStats())
+
+    def locate(self, blob_id):
+        if len(self.backends) == 1:
+            return self.default
+        with get_asset_engine().connect() as connection:
+            return connection.execute(select(StaticBlob.location).where(StaticBlob.id == blob_id)).scalar()
+
+    def source(self, blob_id, digest, size, chunk_size, hold_connection=True):
+        """Return a source streaming the blob from wherever it lives."""
+        source = self._open(blob_id, digest, size, chunk_size, hold_connection)
+        if isinstance(source, FileSource):
+            # Left unwrapped so it can still be sent with sendfile; an open file survives its removal
+            return source
+        return ResumingSource(self, source, blob_id, digest, chunk_size, hold_connection)
+
+    def _open(self, blob_id, digest, size, chunk_size, hold_connection=True):
+        for attempt in range(2):
+            location = self.locate(blob_id)
+            started = time.perf_counter()
+            try:
+                source = self.backends[location].source(blob_id, digest, size, chunk_size, hold_connection)
+            except BlobNotFound:
+                # Moved by the tiering pass between the lookup and the open
+                if attempt:
+                    raise
+                continue
+            if isinstance(source, FileSource):
+                # Sent with sendfile, its bytes never pass through a TimedSource, so read the
+                # first chunk here: every backend is timed from open to first chunk
+                first = source.iter_range(0, min(chunk_size, source.size))
+                next(first, None)
+                first.close()
+                self.latency[location].observe(time.perf_counter() - started)
+                return source
+            return TimedSource(source, self.latency[location])
+
+    def read(self, blob_id, digest):
+        """Return the blob's bytes, or None when the blob row is gone.
+
+        Reads go through ``source`` so they are timed like streamed ones.
+        """
+        with get_asset_engine().connect() as connection:
+            size = connection.execute(select(StaticBlob.size).where(StaticBlob.id == blob_id)).scalar()
+        if size is None:
+            return None
+        try:
+            source = self.source(blob_id, digest, size, READ_CHUNK_SIZE)
+            return b''.join(source.iter_range(0, size))
+        except BlobNotFound:
+            return None
+
+    def store_new(self, digest, data):
+        """Write bytes for a blob row about to be created; returns ``(location, column_value)``."""
+        if self.default == 'db':
+            return 'db', data
+        self.backends[self.default].write(None, digest, [data])
+        return self.default, b''
+
+    def move(self, blob_id, digest, size, target):
+        """Copy a blob to ``target``, point its row there and drop the old copy."""
+        location = db.session.execute(select(StaticBlob.location).where(StaticBlob.id == blob_id)).scalar()
+        if location is None or location == target:
+            return False
+        source = self.backends[location].source(blob_id, digest, size, 1024 * 1024)
+        self.backends[target].write(blob_id, digest, source.iter_range(0, size))
+        db.session.execute(update(StaticBlob).where(StaticBlob.id == blob_id).values(location=target))
+        db.session.commit()
+        # Readers that looked up the old location just before the commit retry once
+        self.backends[location].remove(blob_id, digest)
+        db.session.commit()
+        return True
+
+    def remove_released(self, released):
+        """Delete the backend bytes of ``(location, digest)`` blobs whose rows were deleted.
+
+        A digest that has a blob row again (the same contents uploaded since)
+        is kept. Failures are logged; ``db:gc`` prunes whatever is left.
+        """
+        digests = {digest for _, digest in released}
+        with get_asset_engine().connect() as connection:
+            live = set(connection.execute(select(StaticBlob.digest)
+                                          .where(StaticBlob.digest.in_(digests))).scalars())
+        for location, digest in released:
+            if digest in live or location not in self.backends:
+                continue
+            try:
+                self.backends[location].remove(None, digest)
+            except Exception as e:
+                current_app.logger.warning(f"Could not remove blob {digest} from {location}: {e}")
+
+    def ranked(self):
+        """Backend names, fastest first: by measured latency once every backend has enough reads."""
+        names = list(self.backends)
+        if all(self.latency[name].reads >= MIN_LATENCY_SAMPLES for name in names):
+            names.sort(key=lambda name: self.latency[name].average)
+        return names
+
+    def record_request(self, digest):
+        if self.tiering is None or digest is None:
+            return
+        self.requests[digest] += 1
+        self.tiering.maybe_start()
+
+    def stats(self):
+        return {name: {'reads': stats.reads, 'seconds': stats.seconds, 'average': stats.average}
+                for name, stats in self.latency.items()}
+
+
+def plan_placement(blobs, requests, fast, cold, hot_bytes, min_requests, max_moves):
+    """Return ``(blob_id, digest, size, target)`` moves that put hot blobs in ``fast``.
+
+    Blobs requested at least ``min_requests`` times are hot, most requested
+    first, until ``hot_bytes`` is used up. Hot blobs elsewhere move to the
+    fast backend and anything else found there moves to ``cold``.
+    Promotions come first; at most ``max_moves`` are returned.
+    """
+    hot = set()
+    budget = hot_bytes
+    for blob_id, digest, size, _ in sorted(blobs, key=lambda blob: requests.get(blob[1], 0), reverse=True):
+        if requests.get(digest, 0) < min_requests:
+            break
+        if size <= budget:
+            hot.add(blob_id)
+            budget -= size
+
+    promote = [(blob_id, digest, size, fast) for blob_id, digest, size, location in blobs
+               if blob_id in hot and location != fast]
+    # When the default backend is also the fastest, cold blobs already sit where they belong
+    demote = [(blob_id, digest, size, cold) for blob_id, digest, size, location in blobs
+              if blob_id not in hot and location == fast and fast != cold]
+    return (promote + demote)[:max_moves]
+
+
+class TieringPolicy:
+    """Periodically move blobs between backends based on request counts and latency.
+
+    Counts are kept per worker. Every ``interval`` seconds each worker writes
+    its counts to its own file next to the lock file and then halves them,
+    so placement follows recent traffic. The worker that gets the lock file
+    plans from the sum of every worker's latest counts, and moves up to
+    ``max_moves`` blobs. Files not rewritten for two intervals belong to
+    workers that have exited, and are dropped.
+    """
+
+    def __init__(self, app, storage, lock_path, interval, hot_bytes, min_requests, max_moves):
+        self.app = app
+        self.storage = storage
+        self.lock_path = Path(lock_path)
+        self.counts_dir = self.lock_path.with_suffix('.counts')
+        self.interval = interval
+        self.hot_bytes = hot_bytes
+        self.min_requests = min_requests
+        self.max_moves = max_moves
+        self.moves = 0
+        self._thread = None
+
+    def maybe_start(self):
+        if self._thread is None or not self._thread.is_alive():
+            # Started lazily so the thread belongs to the forked worker, not the master
+            self._thread = threading.Thread(target=self._run_periodically, name='storage-tiering', daemon=True)
+            self._thread.start()
+
+    def _run_periodically(self):
+        # Stops once the worker is told to shut down, so no move starts while it drains
+        while not shutdown_event.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    self.run()
+                except Exception as e:
+                    self.app.logger.warning(f"Storage tiering pass failed: {e}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+    def _publish(self, requests):
+        self.counts_dir.mkdir(parents=True, exist_ok=True)
+        path = self.counts_dir / f'{os.getpid()}.json'
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(requests))
+        os.replace(tmp_path, path)
+
+    def _other_workers_requests(self):
+        merged = Counter()
+        own = f'{os.getpid()}.json'
+        for path in self.counts_dir.glob('*.json'):
+            if path.name == own:
+                continue
+            try:
+                if time.time() - path.stat().st_mtime > 2 * self.interval:
+                    path.unlink(missing_ok=True)
+                    continue
+                merged.update(json.loads(path.read_text()))
+            except (OSError, ValueError):
+                # Replaced or removed while reading
+                continue
+        return merged
+
+    def run(self):
+        """One tiering pass; returns the number of blobs moved. Must be called inside an app context."""
+        storage = self.storage
+        requests = Counter(storage.requests)
+        self._publish(requests)
+        for digest, count in requests.items():
+            if count > 1:
+                storage.requests[digest] = count // 2
+            else:
+                del storage.requests[digest]
+
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+
+            # Plan from what every worker sees, or each pass undoes the previous worker's
+            requests.update(self._other_workers_requests())
+            blobs = db.session.query(StaticBlob.id, StaticBlob.digest, StaticBlob.size, StaticBlob.location).all()
+            fast = storage.ranked()[0]
+            moved = 0
+            for blob_id, digest, size, target in plan_placement(
+                    blobs, requests, fast, storage.default, self.hot_bytes, self.min_requests, self.max_moves):
+                if shutdown_event.is_set():
+                    break
+                if storage.move(blob_id, digest, size, target):
+                    moved += 1
+            self.moves += moved
+            if moved:
+                current_app.logger.info(f"Storage tiering moved {moved} blobs (fast tier: {fast})")
+            return moved
+
+
+def default_lock_path(database_uri):
+    tag = hashlib.sha256(database_uri.encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f'brown_bear_tiering-{tag}.lock')
+
+
+def create_backend(name, config):
+    if name == 'db':
+        return DatabaseBackend()
+    if name == 'fs':
+        return FilesystemBackend(config['STORAGE_FS_DIR'], config.get('STATIC_STREAM_CHUNK_SIZE', 64 * 1024))
+    if name == 's3':
+        if boto3 is None:
+            raise RuntimeError('The s3 storage backend needs boto3 (pip install boto3)')
+        client = boto3.client('s3', endpoint_url=config.get('STORAGE_S3_ENDPOINT_URL'))
+        return S3Backend(client, config['STORAGE_S3_BUCKET'], config.get('STORAGE_S3_PREFIX', ''))
+    raise ValueError(f"STORAGE_BACKENDS entries must be among {', '.join(STORAGE_BACKENDS)}, not {name!r}")
+
+
+def init_storage(app):
+    """Attach the configured blob backends and, with STORAGE_TIERING, the tiering policy."""
+    names = list(app.config.get('STORAGE_BACKENDS') or ['db'])
+    if 'db' not in names:
+        # Blobs written before another backend was configured stay readable
+        names.append('db')
+    storage = Storage([create_backend(name, app.config) for name in names],
+                      app.config.get('STORAGE_DEFAULT_BACKEND', 'db'))
+    if app.config.get('STORAGE_TIERING') and len(names) > 1:
+        storage.tiering = TieringPolicy(
+            app, storage,
+            app.config.get('STORAGE_TIERING_LOCK') or default_lock_path(app.config['SQLALCHEMY_DATABASE_URI']),
+            app.config.get('STORAGE_TIERING_INTERVAL', 300),
+            app.config.get('STORAGE_HOT_BYTES', 256 * 1024 * 1024),
+            app.config.get('STORAGE_HOT_MIN_REQUESTS', 3),
+            app.config.get('STORAGE_TIERING_MAX_MOVES', 50))
+    app.extensions['storage'] = storage
+    return storage
+
+
+def get_storage():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('storage')
@@ -0,0 +1,203 @@
+import sqlite3
+import uuid
+
+from flask import Response
+from sqlalchemy import select, func
+
+from main.models import StaticBlob
+
+# Requests asking for more ranges than this are answered with the full body
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised when none of the requested byte ranges overlap the file."""
+
+
+class BlobNotFound(Exception):
+    """Raised when a storage backend does not hold the bytes of a blob it was asked for."""
+
+
+class MemorySource:
+    """Serve byte ranges from bytes already held in memory (e.g. the blob cache)."""
+
+    def __init__(self, data, chunk_size):
+        self.data = data
+        self.view = memoryview(data)
+        self.size = len(data)
+        self.chunk_size = chunk_size
+
+    def iter_range(self, start, end):
+        for offset in range(start, end, self.chunk_size):
+            yield bytes(self.view[offset:min(offset + self.chunk_size, end)])
+
+
+class DatabaseSource:
+    """Serve byte ranges by reading a StaticBlob incrementally.
+
+    On SQLite with Python 3.11+ the BLOB is read through an incremental blob
+    handle, so only the requested pages are touched. Other drivers fall back
+    to one ``substr`` query per chunk. Either way no more than ``chunk_size``
+    bytes of the file are held by this request at a time.
+
+    With ``hold_connection=False`` a connection is checked out per chunk
+    instead of for the whole download, so slow clients served from an event
+    loop do not exhaust the pool.
+
+    A blob moved to another storage backend keeps an empty value in its row,
+    so a read that finds fewer than ``size`` bytes raises BlobNotFound rather
+    than ending the body early.
+    """
+
+    def __init__(self, engine, blob_id, size, chunk_size, hold_connection=True):
+        self.engine = engine
+        self.blob_id = blob_id
+        self.size = size
+        self.chunk_size = chunk_size
+        self.hold_connection = hold_connection
+
+    def iter_range(self, start, end):
+        if not self.hold_connection:
+            for offset in range(start, end, self.chunk_size):
+                yield self._read_chunk(offset, min(self.chunk_size, end - offset))
+            return
+
+        if self.engine.dialect.name == 'sqlite':
+            connection = self.engine.raw_connection()
+            try:
+                driver_connection = connection.driver_connection
+                if hasattr(driver_connection, 'blobopen'):
+                    yield from self._iter_blob(driver_connection, start, end)
+                    return
+            finally:
+                connection.close()
+
+        yield from self._iter_substr(start, end)
+
+    def _read_chunk(self, offset, length):
+        if self.engine.dialect.name == 'sqlite':
+            connection = self.engine.raw_connection()
+            try:
+                driver_connection = connection.driver_connection
+                if hasattr(driver_connection, 'blobopen'):
+                    with driver_connection.blobopen(StaticBlob.__tablename__, 'data', self.blob_id,
+                                                    readonly=True) as blob:
+                        self._check_length(len(blob))
+                        blob.seek(offset)
+                        return blob.read(length)
+            finally:
+                connection.close()
+
+        with self.engine.connect() as connection:
+            chunk = connection.execute(select(func.substr(StaticBlob.data, offset + 1, length))
+                                       .where(StaticBlob.id == self.blob_id)).scalar()
+        return self._checked(chunk, length)
+
+    def _check_length(self, length):
+        if length != self.size:
+            raise BlobNotFound(f'Blob {self.blob_id} holds {length} bytes, expected {self.size}')
+
+    def _checked(self, chunk, length):
+        if chunk is None or len(chunk) != length:
+            raise BlobNotFound(f'Blob {self.blob_id} is shorter than {self.size} bytes')
+        return chunk
+
+    def _iter_blob(self, driver_connection, start, end):
+        with driver_connection.blobopen(StaticBlob.__tablename__, 'data', self.blob_id,
+                                        readonly=True) as blob:
+            self._check_length(len(blob))
+            blob.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                length = min(self.chunk_size, remaining)
+                try:
+                    chunk = self._checked(blob.read(length), length)
+                except sqlite3.OperationalError as e:
+                    # The row was rewritten under the open handle (SQLITE_ABORT)
+                    if getattr(e, 'sqlite_errorcode', None) != sqlite3.SQLITE_ABORT:
+                        raise
+                    raise BlobNotFound(f'Blob {self.blob_id} changed while being read') from e
+                remaining -= len(chunk)
+                yield chunk
+
+    def _iter_substr(self, start, end):
+        with self.engine.connect() as connection:
+            for offset in range(start, end, self.chunk_size):
+                length = min(self.chunk_size, end - offset)
+                # SQL substr() is 1-indexed
+                query = (select(func.substr(StaticBlob.data, offset + 1, length))
+                         .where(StaticBlob.id == self.blob_id))
+                yield self._checked(connection.execute(query).scalar(), length)
+
+
+def resolve_ranges(range_header, size):
+    """Turn a parsed ``Range`` header into absolute ``(start, end)`` pairs.
+
+    ``end`` is exclusive. Returns ``None`` when the header should be ignored
+    and a full response sent instead; raises RangeNotSatisfiable when no
+    range overlaps the file.
+    """
+    if range_header is None or range_header.units != 'bytes':
+        return None
+    if len(range_header.ranges) > MAX_RANGES:
+        return None
+
+    resolved = []
+    for start, stop in range_header.ranges:
+        if start < 0:
+            # Suffix range: the last -start bytes
+            start, stop = max(size + start, 0), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            resolved.append((start, stop))
+
+    if not resolved:
+        raise RangeNotSatisfiable()
+    return resolved
+
+
+def full_response(source, content_type):
+    response = Response(source.iter_range(0, source.size), mimetype=content_type,
+                        direct_passthrough=True)
+    response.content_length = source.size
+    return response
+
+
+def range_response(source, content_type, ranges):
+    """Build a 206 response for one range or a multipart/byteranges body."""
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response = Response(source.iter_range(start, end), status=206,
+                            mimetype=content_type, direct_passthrough=True)
+        response.content_length = end - start
+        response.headers['Content-Range'] = f'bytes {start}-{end - 1}/{source.size}'
+        return response
+
+    boundary = uuid.uuid4().hex
+    part_headers = [
+        (f'\r\n--{boundary}\r\n'
+         f'Content-Type: {content_type}\r\n'
+         f'Content-Range: bytes {start}-{end - 1}/{source.size}\r\n\r\n').encode('latin-1')
+        for start, end in ranges
+    ]
+    closing = f'\r\n--{boundary}--\r\n'.encode('latin-1')
+
+    def generate():
+        for header, (start, end) in zip(part_headers, ranges):
+            yield header
+            yield from source.iter_range(start, end)
+        yield closing
+
+    response = Response(generate(), status=206, direct_passthrough=True,
+                        content_type=f'multipart/byteranges; boundary={boundary}')
+    response.content_length = (sum(len(header) for header in part_headers)
+                               + sum(end - start for start, end in ranges)
+                               + len(closing))
+    return response
+
+
+def unsatisfiable_response(size):
+    response = Response(status=416)
+    response.headers['Content-Range'] = f'bytes */{size}'
+    return response
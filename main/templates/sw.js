@@ -0,0 +1,204 @@
+// Offline service worker. Every stored asset listed in the precache manifest
+// is downloaded once and served cache-first, so repeat visits make no asset
+// requests. A new manifest version only downloads the URLs whose digest changed.
+const MANIFEST_URL = {{ manifest_url | tojson }};
+const ASSET_PREFIX = {{ asset_prefix | tojson }};
+const PRECACHE_ACCEPT = {{ precache_accept | tojson }};
+const FONT_ORIGINS = ["https://fonts.googleapis.com", "https://fonts.gstatic.com"];
+
+const CACHE_PREFIX = "brown-bear-";
+const PRECACHE = CACHE_PREFIX + "precache";
+const PAGES = CACHE_PREFIX + "pages";
+const FONTS = CACHE_PREFIX + "fonts";
+// The manifest the precache currently holds, stored alongside the assets
+const APPLIED_MANIFEST = new URL("__applied-manifest__", self.registration.scope).href;
+
+{% if enabled %}
+function absolute(url) {
+    return new URL(url, self.location.origin).href;
+}
+
+async function appliedManifest(cache) {
+    const response = await cache.match(APPLIED_MANIFEST);
+    return response ? response.json() : {version: null, widths: [], assets: []};
+}
+
+async function applyLatestManifest() {
+    const response = await fetch(MANIFEST_URL, {cache: "no-cache"});
+    if (!response.ok) {
+        return;
+    }
+    const manifest = await response.json();
+    const cache = await caches.open(PRECACHE);
+    const applied = await appliedManifest(cache);
+    if (applied.version === manifest.version) {
+        return;
+    }
+
+    const present = new Set((await cache.keys()).map((request) => request.url));
+    const held = new Map(applied.assets
+        .filter((asset) => present.has(absolute(asset.url)))
+        .map((asset) => [absolute(asset.url), asset.digest]));
+    // Cached bodies by digest: a file whose URL changed (its fingerprint also
+    // covers its variants) but whose contents did not is copied, not downloaded
+    const byDigest = new Map([...held].map(([url, digest]) => [digest, url]));
+    const changed = manifest.assets.filter((asset) => held.get(absolute(asset.url)) !== asset.digest);
+
+    const failed = new Set();
+    await Promise.all(changed.map(async (asset) => {
+        try {
+            const copy = byDigest.has(asset.digest) && await cache.match(byDigest.get(asset.digest));
+            if (copy) {
+                await cache.put(absolute(asset.url), copy);
+                return;
+            }
+            const fetched = await fetch(asset.url, {headers: {Accept: PRECACHE_ACCEPT}});
+            if (!fetched.ok) {
+                throw new Error(fetched.status);
+            }
+            await cache.put(absolute(asset.url), fetched);
+        } catch (error) {
+            failed.add(asset.url);
+        }
+    }));
+
+    const wanted = new Set(manifest.assets.map((asset) => absolute(asset.url)));
+    await Promise.all([...present]
+        .filter((url) => url !== APPLIED_MANIFEST && !wanted.has(url))
+        .map((url) => cache.delete(url)));
+
+    // Failed downloads are left out, so the next sync retries them
+    const stored = {
+        version: failed.size ? null : manifest.version,
+        widths: manifest.widths,
+        assets: manifest.assets.filter((asset) => !failed.has(asset.url)),
+    };
+    await cache.put(APPLIED_MANIFEST, new Response(JSON.stringify(stored),
+        {headers: {"Content-Type": "application/json"}}));
+}
+
+// One sync at a time, however many pages navigate at once
+let syncing = null;
+
+function syncPrecache() {
+    if (!syncing) {
+        syncing = applyLatestManifest().finally(() => {
+            syncing = null;
+        });
+    }
+    return syncing;
+}
+
+function rangeResponse(request, response) {
+    // Media elements ask for byte ranges; answer them from the cached body
+    const match = /^bytes=(\d*)-(\d*)$/.exec(request.headers.get("Range") || "");
+    if (!match || (!match[1] && !match[2])) {
+        return response;
+    }
+    return response.blob().then((blob) => {
+        let start = match[1] ? Number(match[1]) : Math.max(blob.size - Number(match[2]), 0);
+        let end = match[1] && match[2] ? Math.min(Number(match[2]), blob.size - 1) : blob.size - 1;
+        if (start > end) {
+            return new Response(null, {status: 416, headers: {"Content-Range": `bytes */${blob.size}`}});
+        }
+        return new Response(blob.slice(start, end + 1), {
+            status: 206,
+            headers: {
+                "Content-Type": response.headers.get("Content-Type") || "",
+                "Content-Range": `bytes ${start}-${end}/${blob.size}`,
+                "Content-Length": String(end - start + 1),
+            },
+        });
+    });
+}
+
+async function closestWidth(cache, url) {
+    // Any other ?w= (e.g. the fullscreen view) gets the narrowest precached size that covers it
+    const {widths} = await appliedManifest(cache);
+    const requested = Number(url.searchParams.get("w"));
+    const width = widths.find((candidate) => candidate >= requested);
+    const fallback = new URL(url.pathname, url.origin);
+    if (width) {
+        fallback.searchParams.set("w", width);
+    }
+    return cache.match(fallback.href);
+}
+
+async function fromPrecache(request, url) {
+    const cache = await caches.open(PRECACHE);
+    let cached = await cache.match(url.href);
+    if (!cached && url.searchParams.has("w")) {
+        cached = await closestWidth(cache, url);
+    }
+    return cached ? rangeResponse(request, cached) : fetch(request);
+}
+
+async function networkFirst(cacheName, request) {
+    const cache = await caches.open(cacheName);
+    try {
+        const response = await fetch(request);
+        if (response.ok) {
+            await cache.put(request, response.clone());
+        }
+        return response;
+    } catch (error) {
+        return (await cache.match(request)) || Response.error();
+    }
+}
+
+async function cacheFirst(cacheName, request) {
+    const cache = await caches.open(cacheName);
+    const cached = await cache.match(request);
+    if (cached) {
+        return cached;
+    }
+    const response = await fetch(request);
+    if (response.ok || response.type === "opaque") {
+        await cache.put(request, response.clone());
+    }
+    return response;
+}
+
+self.addEventListener("install", (event) => {
+    event.waitUntil(syncPrecache().catch(() => {}).then(() => self.skipWaiting()));
+});
+
+self.addEventListener("activate", (event) => {
+    const current = [PRECACHE, PAGES, FONTS];
+    event.waitUntil(caches.keys()
+        .then((names) => Promise.all(names
+            .filter((name) => name.startsWith(CACHE_PREFIX) && !current.includes(name))
+            .map((name) => caches.delete(name))))
+        .then(() => self.clients.claim()));
+});
+
+self.addEventListener("fetch", (event) => {
+    const request = event.request;
+    if (request.method !== "GET") {
+        return;
+    }
+    const url = new URL(request.url);
+    if (request.mode === "navigate") {
+        // Pages revalidate with the server (a 304 when unchanged), which is also
+        // when a new manifest version is picked up
+        event.respondWith(networkFirst(PAGES, request));
+        event.waitUntil(syncPrecache().catch(() => {}));
+    } else if (url.origin === self.location.origin && url.pathname.startsWith(ASSET_PREFIX)) {
+        event.respondWith(fromPrecache(request, url));
+    } else if (FONT_ORIGINS.includes(url.origin)) {
+        event.respondWith(cacheFirst(FONTS, request));
+    }
+});
+{% else %}
+// The offline cache is turned off (SERVICE_WORKER_ENABLED=false): drop the
+// caches and unregister, so every request goes to the server again
+self.addEventListener("install", () => self.skipWaiting());
+
+self.addEventListener("activate", (event) => {
+    event.waitUntil(caches.keys()
+        .then((names) => Promise.all(names
+            .filter((name) => name.startsWith(CACHE_PREFIX))
+            .map((name) => caches.delete(name))))
+        .then(() => self.registration.unregister()));
+});
+{% endif %}
@@ -1,8 +1,11 @@
 import os
 from dotenv import load_dotenv; load_dotenv()
 from main import create_app, register_signal_handlers
+from main.asgi import create_asgi_app
 
 app = create_app()
+# Served by gunicorn's uvicorn workers when SERVER_MODE=asgi
+asgi_app = create_asgi_app(app)
 
 if __name__ == '__main__':
     register_signal_handlers()
@@ -0,0 +1,155 @@
+import pytest
+from main import create_app, db
+from main.config import TestingConfig
+from main.models import StaticBlob, StaticFile
+import admin
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app(TestingConfig)
+    app.root_path = str(tmp_path)
+    (tmp_path / 'static' / 'js').mkdir(parents=True)
+    (tmp_path / 'static' / 'js' / 'app.js').write_text('console.log("bear");\n' * 20)
+    (tmp_path / 'static' / 'notes.txt').write_text('brown bear')
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def test_sync_inserts_updates_and_deletes(app, tmp_path):
+    assert admin.sync_static_files(app, workers=2)
+    assert StaticFile.query.filter_by(filename='js/app.js').one().variants
+
+    (tmp_path / 'static' / 'notes.txt').write_text('red bird')
+    (tmp_path / 'static' / 'js' / 'app.js').unlink()
+    admin.sync_static_files(app, delete=True, workers=2)
+
+    assert StaticFile.query.filter_by(filename='notes.txt').one().data == b'red bird'
+    assert StaticFile.query.filter(StaticFile.filename.like('js/%')).count() == 0
+    assert [blob.ref_count for blob in StaticBlob.query] == [1]
+
+
+def test_sync_backfills_variants_of_unchanged_files(app):
+    admin.sync_static_files(app, workers=2)
+    original = StaticFile.query.filter_by(filename='js/app.js').one()
+    # As if synced before variants existed
+    original.variants_digest = None
+    for variant in original.variants:
+        db.session.delete(variant)
+    db.session.commit()
+    original = StaticFile.query.filter_by(filename='js/app.js').one()
+    assert not original.variants
+    updated_at = original.updated_at
+
+    admin.sync_static_files(app, workers=2)
+    original = StaticFile.query.filter_by(filename='js/app.js').one()
+    assert original.variants
+    assert original.updated_at == updated_at
+
+
+def test_sync_tries_variants_once_per_contents(app, capsys):
+    admin.sync_static_files(app, workers=2)
+    notes = StaticFile.query.filter_by(filename='notes.txt').one()
+    assert not notes.variants
+    notes.variants_digest = None
+    db.session.commit()
+    capsys.readouterr()
+
+    admin.sync_static_files(app, workers=2)
+    assert '* notes.txt' in capsys.readouterr().out
+    # Too small to compress, but not picked again for the same contents
+    admin.sync_static_files(app, workers=2)
+    assert '0 missing variants' in capsys.readouterr().out
+    admin.sync_static_files(app, regenerate=True, workers=2)
+    assert '~ notes.txt' in capsys.readouterr().out
+
+
+def test_sync_dry_run_writes_nothing(app, capsys):
+    admin.sync_static_files(app, dry_run=True)
+    assert StaticFile.query.count() == 0
+    assert '+ js/app.js' in capsys.readouterr().out
+
+
+def test_backup_and_restore_round_trip(tmp_path):
+    import sqlite3
+    from main.sqlite import backup_database, restore_database, BackupError
+
+    db_path = str(tmp_path / 'live.db')
+    connection = sqlite3.connect(db_path)
+    connection.execute('CREATE TABLE bears (name TEXT)')
+    connection.execute("INSERT INTO bears VALUES ('brown')")
+    connection.commit()
+
+    backup_path = tmp_path / 'backup.db.gz'
+    manifest = backup_database(db_path, backup_path, pages_per_step=1, compress=True)
+    assert manifest['compressed'] and manifest['pages'] >= 2
+
+    connection.execute("INSERT INTO bears VALUES ('polar')")
+    connection.commit()
+    connection.close()
+
+    restore_database(backup_path, db_path)
+    connection = sqlite3.connect(db_path)
+    assert connection.execute('SELECT name FROM bears').fetchall() == [('brown',)]
+    connection.close()
+
+    backup_path.write_bytes(backup_path.read_bytes() + b'torn')
+    with pytest.raises(BackupError):
+        restore_database(backup_path, db_path)
+
+
+def test_workers_reconnect_after_database_is_replaced(tmp_path):
+    from main.sqlite import DatabaseFileWatcher
+
+    db_path = tmp_path / 'live.db'
+    db_path.write_bytes(b'')
+    app = create_app(TestingConfig)
+    watcher = DatabaseFileWatcher(str(db_path), interval=0)
+
+    with app.app_context():
+        assert not watcher.check(app)
+        (tmp_path / 'new.db').write_bytes(b'')
+        (tmp_path / 'new.db').replace(db_path)
+        assert watcher.check(app)
+        assert not watcher.check(app)
+
+        (tmp_path / 'live.db.restored').touch()
+        assert watcher.check(app)
+        assert not watcher.check(app)
+
+
+def test_restore_keeps_open_connections_consistent(tmp_path):
+    import sqlite3
+    from main.sqlite import backup_database, restore_database
+
+    # Characters that mean something in a file: URI
+    db_path = str(tmp_path / 'bears?#%.db')
+    connection = sqlite3.connect(db_path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('CREATE TABLE bears (name TEXT)')
+    connection.execute("INSERT INTO bears VALUES ('brown')")
+    connection.commit()
+    backup_path = tmp_path / 'backup.db'
+    backup_database(db_path, backup_path)
+
+    connection.execute("INSERT INTO bears VALUES ('polar')")
+    connection.commit()
+    reader = sqlite3.connect(db_path)
+    assert reader.execute('SELECT count(*) FROM bears').fetchone() == (2,)
+
+    restore_database(backup_path, db_path)
+    assert reader.execute('SELECT name FROM bears').fetchall() == [('brown',)]
+
+    # A connection opened before the restore writes into the restored database
+    connection.execute("INSERT INTO bears VALUES ('black')")
+    connection.commit()
+    fresh = sqlite3.connect(db_path)
+    assert fresh.execute('SELECT name FROM bears ORDER BY rowid').fetchall() == [('brown',), ('black',)]
+    assert fresh.execute('PRAGMA integrity_check').fetchone() == ('ok',)
+    for handle in (connection, reader, fresh):
+        handle.close()
+    assert (tmp_path / 'bears?#%.db.restored').exists()
+    assert [path.name for path in tmp_path.glob('.restore-*')] == []
@@ -0,0 +1,129 @@
+import base64
+import json
+
+import pytest
+from sqlalchemy import event
+
+from main import create_app, db
+from main.config import TestingConfig
+from main.models import Animal, Book, Page, StaticFile
+
+
+@pytest.fixture
+def app():
+    app = create_app(TestingConfig)
+    with app.app_context():
+        db.create_all()
+        for title in ('Brown Bear', 'Polar Bear', 'Panda Bear'):
+            book = Book(title=title, author='Bill Martin Jr.')
+            for number in range(2, 7):
+                book.pages.append(Page(number=number, content=f'{title} {number}',
+                                       animal=Animal(name=f'Animal {number}'),
+                                       image=f'images/{title[0]}{number}.png', sound='audio/bear.mp3'))
+            db.session.add(book)
+        db.session.add(StaticFile(filename='images/B2.png', content_type='image/png', data=b'png', variants=[
+            StaticFile(filename='images/B2.w160.webp', content_type='image/webp', width=160, data=b'webp'),
+        ]))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def queries(app):
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count)
+        yield statements
+        event.remove(db.engine, 'before_cursor_execute', count)
+
+
+def test_keyset_pagination_walks_every_page(client):
+    seen, url = [], '/api/v1/pages?limit=4&fields[pages]=id'
+    while url:
+        body = client.get(url).get_json()
+        seen.extend(page['id'] for page in body['data'])
+        url = body['links']['next']
+    assert seen == list(range(1, 16))
+
+
+def test_book_pages_are_ordered_by_number(client):
+    body = client.get('/api/v1/books/2/pages?limit=3&fields[pages]=number').get_json()
+    assert body['data'] == [{'number': 2}, {'number': 3}, {'number': 4}]
+    body = client.get(body['links']['next']).get_json()
+    assert body['data'] == [{'number': 5}, {'number': 6}]
+    assert body['links']['next'] is None
+
+
+def test_sparse_fields_and_asset_metadata(client):
+    body = client.get('/api/v1/books/1?fields[books]=title,pages&fields[pages]=number,image'
+                      '&fields[assets]=url,size,digest,variants').get_json()
+    book = body['data']
+    assert set(book) == {'title', 'pages'}
+    image = book['pages'][0]['image']
+    assert image['size'] == 3 and len(image['digest']) == 64
+    assert image['url'].startswith('/static_db/images/B2.')
+    assert image['variants'][0]['width'] == 160
+    assert set(book['pages'][0]) == {'number', 'image'}
+
+
+def test_unknown_fields_and_bad_cursors_are_rejected(client):
+    response = client.get('/api/v1/books?fields[books]=secret')
+    assert response.status_code == 400
+    assert 'secret' in response.get_json()['message']
+    assert client.get('/api/v1/books?after=!!!').status_code == 400
+    for values in ([{'a': 1}], [[1]], ['1'], [True], [1.5], [None], [2, 1]):
+        cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+        response = client.get(f'/api/v1/books?after={cursor}')
+        assert response.status_code == 400
+        assert response.get_json()['message'] == 'Malformed cursor'
+    cursor = base64.urlsafe_b64encode(json.dumps([2, 'x']).encode()).decode()
+    assert client.get(f'/api/v1/books/2/pages?after={cursor}').status_code == 400
+    assert client.get('/api/v1/books/99').status_code == 404
+
+
+def test_queries_are_bounded_and_responses_cached(client, queries):
+    client.get('/api/v1/animals')  # builds the static file index
+    queries.clear()
+    response = client.get('/api/v1/books/1')
+    assert response.status_code == 200
+    # Change check, the book and its pages with their animals
+    assert len(queries) <= 3
+
+    queries.clear()
+    client.get('/api/v1/pages?limit=15')
+    assert len(queries) <= 2
+
+    queries.clear()
+    cached = client.get('/api/v1/books/1', headers={'If-None-Match': response.headers['ETag']})
+    assert cached.status_code == 304
+    assert not [statement for statement in queries if 'pages' in statement]
+
+
+def test_catalog_changes_refresh_cached_responses(client, app):
+    etag = client.get('/api/v1/animals?limit=1').headers['ETag']
+    with app.app_context():
+        db.session.get(Animal, 1).name = 'Brown Bear'
+        db.session.commit()
+    response = client.get('/api/v1/animals?limit=1', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['data'] == [{'id': 1, 'name': 'Brown Bear'}]
+
+
+def test_api_cache_keys_ignore_unknown_arguments(client, app):
+    for junk in range(5):
+        assert client.get(f'/api/v1/animals?limit=1&junk={junk}').status_code == 200
+    client.get('/api/v1/animals?junk=x&limit=1&fields[animals]=id,name')
+    assert len(app.extensions['api_cache']) == 1
+    # API responses never take rendered pages' slots
+    assert len(app.extensions['page_cache']) == 0
@@ -0,0 +1,150 @@
+import asyncio
+import time
+
+import pytest
+
+from main import create_app, db, shutdown_event
+from main.asgi import create_asgi_app
+from main.config import TestingConfig
+from main.models import StaticFile
+from main.sqlite import get_asset_engine
+
+LARGE = bytes(range(256)) * 4096  # 1 MiB, over the cache's entry limit below
+
+
+@pytest.fixture
+def app(tmp_path):
+    config = type('AsgiConfig', (TestingConfig,), {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "asgi.db"}',
+        'STATIC_CACHE_MAX_ENTRY_BYTES': 1024,
+        'ASGI_THREADS': 2,
+        'ASGI_CHUNK_SIZE': 64 * 1024,
+        'METRICS_ENABLED': False,
+    })
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        db.session.add(StaticFile(filename='audio/long.mp3', content_type='audio/mpeg', data=LARGE))
+        db.session.commit()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+async def request(asgi, path, send_gate=None, disconnect_after=None):
+    """Run one GET through ``asgi``; returns ``(status, headers, body_messages)``."""
+    messages = []
+    disconnect = asyncio.Event()
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await disconnect.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        messages.append(message)
+        if message['type'] == 'http.response.body' and send_gate is not None:
+            await send_gate.wait()
+        bodies = [m for m in messages if m['type'] == 'http.response.body']
+        if disconnect_after is not None and len(bodies) >= disconnect_after:
+            disconnect.set()
+
+    path, _, query = path.partition('?')
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query.encode(),
+             'headers': [(b'host', b'testserver')], 'http_version': '1.1', 'scheme': 'http',
+             'server': ('testserver', 80), 'client': ('127.0.0.1', 1234), 'root_path': ''}
+    await asgi(scope, receive, send)
+    start = messages[0]
+    return start['status'], dict(start['headers']), [m for m in messages[1:] if m['body']]
+
+
+def test_pages_are_served_through_the_bridge(app):
+    status, headers, bodies = asyncio.run(request(create_asgi_app(app), '/'))
+    assert status == 200
+    assert headers[b'content-type'].startswith(b'text/html')
+    assert b'BROWN BEAR' in b''.join(message['body'] for message in bodies)
+
+
+def test_large_assets_stream_without_holding_a_connection(app):
+    asgi = create_asgi_app(app)
+
+    async def download():
+        gate = asyncio.Event()
+        task = asyncio.create_task(request(asgi, '/static_db/audio/long.mp3', send_gate=gate))
+        await asyncio.sleep(0.2)
+        # Blocked on a slow client between chunks: no pooled connection is checked out
+        checked_out = get_asset_engine().pool.checkedout()
+        gate.set()
+        return checked_out, await task
+
+    with app.app_context():
+        checked_out, (status, headers, bodies) = asyncio.run(download())
+    assert checked_out == 0
+    assert status == 200
+    assert len(bodies) == len(LARGE) // (64 * 1024)
+    assert b''.join(message['body'] for message in bodies) == LARGE
+
+
+def test_slow_downloads_do_not_starve_pages(app):
+    asgi = create_asgi_app(app)
+
+    async def scenario():
+        gate = asyncio.Event()
+        downloads = [asyncio.create_task(request(asgi, '/static_db/audio/long.mp3', send_gate=gate))
+                     for _ in range(8)]
+        await asyncio.sleep(0.2)
+        # Eight stalled downloads, two threads: the page still gets served
+        page = await asyncio.wait_for(request(asgi, '/'), timeout=5)
+        gate.set()
+        await asyncio.gather(*downloads)
+        return page
+
+    status, _, _ = asyncio.run(scenario())
+    assert status == 200
+
+
+def test_client_disconnect_stops_the_download(app):
+    status, _, bodies = asyncio.run(request(create_asgi_app(app), '/static_db/audio/long.mp3',
+                                            disconnect_after=2))
+    assert status == 200
+    assert len(bodies) < len(LARGE) // (64 * 1024)
+
+
+def test_lifespan_shutdown_keeps_the_loop_running(app):
+    asgi = create_asgi_app(app)
+    asgi.shutdown_timeout = 0.3
+    asgi.executor.submit(time.sleep, 1.5)
+
+    async def scenario():
+        messages = iter([{'type': 'lifespan.shutdown'}])
+        sent = []
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        async def send(message):
+            sent.append(message)
+
+        ticker = asyncio.create_task(tick())
+        started = time.monotonic()
+        await asgi({'type': 'lifespan'}, lambda: asyncio.sleep(0, next(messages)), send)
+        ticker.cancel()
+        return sent, time.monotonic() - started, ticks
+
+    try:
+        sent, elapsed, ticks = asyncio.run(scenario())
+    finally:
+        shutdown_event.clear()
+    assert sent == [{'type': 'lifespan.shutdown.complete'}]
+    # Gave up on the stuck view after the timeout, ticking all along
+    assert 0.3 <= elapsed < 1
+    assert ticks >= 10
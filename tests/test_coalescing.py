@@ -0,0 +1,132 @@
+import threading
+import time
+
+import pytest
+from main import create_app, db
+from main.cache import LoadTimeout, SingleFlight
+from main.config import TestingConfig
+from main.models import StaticFile
+
+
+def _run_concurrently(count, target):
+    results = [None] * count
+    errors = [None] * count
+
+    def run(i):
+        try:
+            results[i] = target()
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results, errors
+
+
+def _slow(release, value):
+    def load():
+        release.wait(5)
+        return value
+    return load
+
+
+def test_concurrent_callers_share_one_load():
+    flight = SingleFlight(timeout=5)
+    release = threading.Event()
+    calls = []
+
+    def load():
+        calls.append(1)
+        release.wait(5)
+        return b'bear'
+
+    threading.Timer(0.1, release.set).start()
+    results, errors = _run_concurrently(8, lambda: flight.do('bear.png', load))
+    assert errors == [None] * 8
+    assert all(result is results[0] for result in results)
+    assert len(calls) == 1
+    assert flight.stats() == {'in_flight': 0, 'loads': 1, 'coalesced': 7, 'timeouts': 0, 'errors': 0}
+
+
+def test_errors_reach_every_waiter_and_are_not_remembered():
+    flight = SingleFlight(timeout=5)
+    release = threading.Event()
+
+    def load():
+        release.wait(5)
+        raise ValueError('database gone')
+
+    threading.Timer(0.1, release.set).start()
+    _, errors = _run_concurrently(4, lambda: flight.do('bear.png', load))
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert flight.stats()['errors'] == 1
+
+    assert flight.do('bear.png', lambda: b'back') == b'back'
+
+
+def test_waiters_time_out_without_starting_a_load():
+    flight = SingleFlight(timeout=0.05)
+    release = threading.Event()
+    leader = threading.Thread(target=flight.do, args=('bear.png', _slow(release, b'bear')))
+    leader.start()
+    time.sleep(0.02)
+
+    with pytest.raises(LoadTimeout):
+        flight.do('bear.png', lambda: pytest.fail('waiter must not load'))
+    release.set()
+    leader.join()
+    assert flight.stats()['timeouts'] == 1
+
+
+@pytest.fixture
+def app(tmp_path):
+    config = type('CoalescingConfig', (TestingConfig,), {
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'app.db'}",
+        'STATIC_LOAD_TIMEOUT': 0.5,
+    })
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        db.session.add(StaticFile(filename='images/bear.png', content_type='image/png', data=b'bear' * 100))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def _slow_storage_reads(app, delay):
+    storage = app.extensions['storage']
+    reads = []
+    original = storage.read
+
+    def read(blob_id, digest):
+        reads.append(digest)
+        time.sleep(delay)
+        return original(blob_id, digest)
+
+    storage.read = read
+    return reads
+
+
+def test_concurrent_misses_read_the_blob_once(app):
+    app.test_client().get('/static_db/missing.png')  # builds the index
+    reads = _slow_storage_reads(app, 0.2)
+
+    responses, errors = _run_concurrently(6, lambda: app.test_client().get('/static_db/images/bear.png'))
+    assert errors == [None] * 6
+    assert [response.data for response in responses] == [b'bear' * 100] * 6
+    assert len(reads) == 1
+    assert app.extensions['static_loads'].stats()['coalesced'] == 5
+
+
+def test_slow_load_answers_waiters_with_503(app):
+    app.test_client().get('/static_db/missing.png')
+    _slow_storage_reads(app, 1.0)
+
+    responses, _ = _run_concurrently(3, lambda: app.test_client().get('/static_db/images/bear.png'))
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses == [200, 503, 503]
+    assert all(response.headers['Retry-After'] == '1' for response in responses if response.status_code == 503)
@@ -0,0 +1,88 @@
+import time
+
+import pytest
+from sqlalchemy import event
+from main import create_app, db, shutdown_event
+from main.config import TestingConfig
+
+
+@pytest.fixture
+def app(tmp_path):
+    config = type('HealthConfig', (TestingConfig,), {
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'app.db'}",
+        'HEALTH_DB_TIMEOUT': 0.5,
+        'HEALTH_PING_INTERVAL': 60,
+    })
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+    shutdown_event.clear()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def _wait_until_ready(client, timeout=5):
+    deadline = time.monotonic() + timeout
+    while True:
+        response = client.get('/readyz')
+        if response.status_code == 200 or time.monotonic() > deadline:
+            return response
+        time.sleep(0.02)
+
+
+def test_healthz_runs_no_queries(client, app):
+    statements = []
+    event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    response = client.get('/healthz')
+    assert response.status_code == 200
+    assert response.data == b'ok\n'
+    assert statements == []
+
+
+def test_readyz_waits_for_warm_up(client, app):
+    first = client.get('/readyz')
+    if first.status_code == 503:
+        assert first.json['checks']['warm'] is False
+
+    response = _wait_until_ready(client)
+    assert response.status_code == 200
+    assert response.json == {'status': 'ready', 'checks': {'draining': False, 'database': 'ok', 'warm': True}}
+    assert response.headers['Cache-Control'] == 'no-store'
+
+
+def test_readyz_reuses_database_ping(client, app):
+    _wait_until_ready(client)
+    pings = []
+    event.listen(db.engine, 'before_cursor_execute',
+                 lambda *args: pings.append(args[2]) if args[2] == 'SELECT 1' else None)
+    for _ in range(5):
+        assert client.get('/readyz').status_code == 200
+    assert pings == []
+
+
+def test_readyz_fails_when_database_does_not_answer(client, app):
+    _wait_until_ready(client)
+    readiness = app.extensions['readiness']
+    readiness._ping = None
+    readiness._ping_database = lambda: time.sleep(2)
+
+    started = time.monotonic()
+    response = client.get('/readyz')
+    assert response.status_code == 503
+    assert response.json['checks']['database'] == 'no answer within 0.5s'
+    assert time.monotonic() - started < 1.5
+
+
+def test_readyz_fails_while_draining(client):
+    _wait_until_ready(client)
+    shutdown_event.set()
+    response = client.get('/readyz')
+    assert response.status_code == 503
+    assert response.json == {'status': 'unavailable', 'checks': {'draining': True}}
+    assert client.get('/healthz').status_code == 200
@@ -0,0 +1,45 @@
+import json
+import logging
+
+from main import create_app
+from main.config import TestingConfig
+from main.logging import DebugSamplingFilter, stop_logging
+
+
+def test_json_records_are_written_by_the_listener(capsys):
+    class JsonConfig(TestingConfig):
+        LOG_JSON = True
+        LOG_LEVEL = 'DEBUG'
+
+    app = create_app(JsonConfig)
+    try:
+        raise ValueError('no bears')
+    except ValueError:
+        app.logger.exception('Lookup of %s failed', 'bear.png')
+    stop_logging(app)
+
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    failure = next(record for record in records if record['level'] == 'ERROR')
+    assert failure['message'] == 'Lookup of bear.png failed'
+    assert 'ValueError: no bears' in failure['exception']
+
+
+def test_creating_an_app_leaves_other_apps_logging():
+    first = create_app(TestingConfig)
+    listener = first.extensions['log_listener']
+    second = create_app(TestingConfig)
+    assert listener._thread is not None
+
+    stop_logging(second)
+    assert 'log_listener' not in second.extensions
+    assert listener._thread is not None
+    stop_logging()
+    assert listener._thread is None
+
+
+def test_debug_records_are_sampled_but_warnings_are_not():
+    sampler = DebugSamplingFilter(0.25)
+    debug = logging.LogRecord('main', logging.DEBUG, __file__, 1, 'serve', None, None)
+    warning = logging.LogRecord('main', logging.WARNING, __file__, 1, 'slow', None, None)
+    assert sum(sampler.filter(debug) for _ in range(100)) == 25
+    assert all(sampler.filter(warning) for _ in range(10))
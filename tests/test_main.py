@@ -1,21 +1,118 @@
 import pytest
-from main import create_app
+from main import create_app, db
+from main.config import TestingConfig
+from main.models import Animal, Book, Page, StaticFile
 
 @pytest.fixture
 def app():
-    app = create_app()
-    app.config.update({
-        "TESTING": True,
-    })
-    yield app
+    app = create_app(TestingConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
 
 @pytest.fixture
 def client(app):
     return app.test_client()
 
+def add_book(title='Polar Bear, Polar Bear, What Do You Hear?'):
+    book = Book(title=title, author='Bill Martin Jr.', illustrator='Eric Carle')
+    book.pages.append(Page(number=2, content='Polar Bear', animal=Animal(name='Polar Bear'),
+                           image='images/polar.png', sound='audio/polar.mp3'))
+    book.pages.append(Page(number=3, content='Lion', animal=Animal(name='Lion'), image='images/lion.png'))
+    db.session.add(book)
+    db.session.commit()
+    return book
+
 def test_home_page(client):
     response = client.get("/")
     assert response.status_code == 200
 
 def test_app_factory(app):
     assert app.testing == True
+
+def test_home_page_falls_back_to_the_built_in_book(client):
+    body = client.get("/").get_data(as_text=True)
+    assert 'BROWN BEAR, BROWN BEAR, WHAT DO YOU SEE?' in body
+    assert body.count('<button') == 10
+    assert 'audio/teach.mp3' in body
+
+def test_home_page_renders_pages_from_the_database(client):
+    add_book()
+    body = client.get("/").get_data(as_text=True)
+    assert 'POLAR BEAR, POLAR BEAR, WHAT DO YOU HEAR?' in body
+    assert body.count('<button') == 2
+    assert body.count('<audio') == 1
+    assert "playSound('sound2')" in body
+
+def test_rendered_page_is_cached_with_a_strong_etag(client, app):
+    add_book()
+    first = client.get("/")
+    assert first.headers['ETag'] and not first.headers['ETag'].startswith('W/')
+    assert first.headers['Cache-Control'] == 'no-cache'
+
+    revalidated = client.get("/", headers={'If-None-Match': first.headers['ETag']})
+    assert revalidated.status_code == 304
+    assert len(app.extensions['page_cache']) == 1
+
+def test_catalog_changes_invalidate_the_rendered_page(client):
+    book = add_book()
+    etag = client.get("/").headers['ETag']
+
+    book.pages[1].image = 'images/tiger.png'
+    db.session.commit()
+
+    response = client.get("/", headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'images/tiger.png' in response.get_data(as_text=True)
+
+def test_books_are_rendered_separately(client):
+    add_book()
+    second = add_book(title='Panda Bear, Panda Bear, What Do You See?')
+    assert 'PANDA BEAR' in client.get(f"/books/{second.id}").get_data(as_text=True)
+    assert 'POLAR BEAR' in client.get("/").get_data(as_text=True)
+    assert client.get("/books/999").status_code == 404
+
+def test_asset_uploads_invalidate_the_rendered_page(client):
+    add_book()
+    etag = client.get("/").headers['ETag']
+
+    db.session.add(StaticFile(filename='images/polar.png', content_type='image/png', data=b'polar'))
+    db.session.commit()
+
+    response = client.get("/", headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert '/static_db/images/polar.' in response.get_data(as_text=True)
+
+def test_page_preloads_stored_critical_assets(client, app):
+    app.config['ASSET_PRELOAD_IMAGES'] = 1
+    add_book()
+    db.session.add(StaticFile(filename='images/polar.png', content_type='image/png', data=b'polar'))
+    db.session.add(StaticFile(filename='js/script.js', content_type='application/javascript', data=b'//'))
+    db.session.commit()
+
+    response = client.get("/")
+    links = response.headers['Link'].split(', <')
+    assert any('rel=preconnect' in link and 'fonts.gstatic.com' in link for link in links)
+    assert any('/static_db/js/script.' in link and 'as="script"' in link for link in links)
+    image = next(link for link in links if 'images/polar.' in link)
+    assert 'as="image"' in image and 'imagesrcset=' in image and '?w=320' in image
+    # Not stored, and below the preloaded row
+    assert 'see.gif' not in response.headers['Link']
+    assert 'lion' not in response.headers['Link']
+
+    body = response.get_data(as_text=True)
+    assert body.count('loading="lazy"') == 1
+    assert 'preload="none"' in body
+    assert client.get("/", headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+def test_early_hints_are_sent_when_the_server_supports_them(client, app):
+    sent = []
+    client.get("/", environ_base={'wsgi.early_hints': sent.append})
+    assert sent and all(name == 'Link' for name, _ in sent[0])
+    assert any('rel=preconnect' in value for _, value in sent[0])
+
+    app.config['EARLY_HINTS'] = False
+    client.get("/", environ_base={'wsgi.early_hints': sent.append})
+    assert len(sent) == 1
@@ -0,0 +1,95 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+from main import create_app, db
+from main.config import TestingConfig
+from main.metrics import Metrics, render
+from main.models import StaticFile
+
+
+@pytest.fixture
+def app(tmp_path):
+    class MetricsConfig(TestingConfig):
+        METRICS_DIR = str(tmp_path / 'metrics')
+
+    app = create_app(MetricsConfig)
+    with app.app_context():
+        db.create_all()
+        db.session.add(StaticFile(filename='images/bear.png', content_type='image/png', data=b'bear' * 100))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def test_requests_are_timed_and_counted(app):
+    client = app.test_client()
+    for _ in range(2):
+        client.get('/static_db/images/bear.png', buffered=True)
+
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'http_requests_total{endpoint="main.serve_static_from_db",method="GET",status="200"} 2' in body
+    assert 'http_request_duration_seconds_count{endpoint="main.serve_static_from_db"} 2' in body
+    assert 'http_request_duration_seconds_bucket{endpoint="main.serve_static_from_db",le="+Inf"} 2' in body
+    assert 'http_response_bytes_total{endpoint="main.serve_static_from_db"} 800' in body
+    assert 'db_queries_total{endpoint="main.serve_static_from_db"}' in body
+    assert 'static_responses_total{source="HIT"} 1' in body
+    assert 'static_cache_hit_ratio 0.5' in body
+
+
+def test_request_finished_on_another_thread_counts_only_its_queries(app):
+    def count():
+        return str(StaticFile.query.count() + StaticFile.query.count())
+
+    app.add_url_rule('/count', 'count', count)
+    response = app.test_client().get('/count', buffered=False)
+    # Not part of the request, even though its body is still open
+    StaticFile.query.count()
+
+    thread = threading.Thread(target=response.close)
+    thread.start()
+    thread.join()
+    counters = app.extensions['metrics'].registry.counters
+    assert counters[('db_queries_total', (('endpoint', 'count'),))] == 2
+
+
+def test_metrics_sum_snapshots_of_other_workers(app, tmp_path):
+    other = Metrics(tmp_path / 'metrics')
+    other.record('main.serve_static_from_db', 'GET', 200, 0.01, 0.02, 1, 0.001, 100, 'MISS')
+    other.flush()
+    assert json.loads(other.path.read_text())['counters']
+
+    app.test_client().get('/static_db/images/bear.png', buffered=True)
+    body = app.test_client().get('/metrics').get_data(as_text=True)
+    assert 'http_requests_total{endpoint="main.serve_static_from_db",method="GET",status="200"} 2' in body
+    assert 'static_responses_total{source="MISS"} 2' in body
+
+
+def test_render_histogram_buckets_are_cumulative():
+    metrics = Metrics()
+    for seconds in (0.0005, 0.003, 20):
+        metrics.registry.observe('http_request_duration_seconds', (('endpoint', 'x'),), seconds)
+    body = render(metrics.collect())
+    assert 'http_request_duration_seconds_bucket{endpoint="x",le="0.001"} 1' in body
+    assert 'http_request_duration_seconds_bucket{endpoint="x",le="0.005"} 2' in body
+    assert 'http_request_duration_seconds_bucket{endpoint="x",le="10"} 2' in body
+    assert 'http_request_duration_seconds_bucket{endpoint="x",le="+Inf"} 3' in body
+
+
+def test_gauges_of_exited_workers_are_not_summed(app, tmp_path):
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    for pid in (exited.pid, os.getpid()):
+        snapshot = {'pid': pid, 'counters': [['static_cache_hits_total', [], 5]],
+                    'gauges': [['static_cache_bytes', [], 1000]], 'histograms': []}
+        (tmp_path / 'metrics' / f'{pid}-test.json').write_text(json.dumps(snapshot))
+
+    body = app.test_client().get('/metrics').get_data(as_text=True)
+    assert 'static_cache_hits_total 10' in body
+    # The live file's bytes plus the answering worker's (still empty) cache
+    assert 'static_cache_bytes 1000' in body
+    assert '# TYPE static_cache_bytes gauge' in body
@@ -0,0 +1,100 @@
+import time
+
+import pytest
+from main import create_app, db
+from main.cache import MissingPaths
+from main.config import TestingConfig
+from main.models import StaticFile
+
+
+def test_missing_paths_expire_from_the_report():
+    missing = MissingPaths(max_entries=10, ttl=0.05)
+    assert not missing.record('images/see.gif')
+    assert missing.record('images/see.gif')
+    assert missing.top() == [('images/see.gif', 2)]
+
+    time.sleep(0.06)
+    assert missing.top() == []
+    # An expired path starts counting again
+    assert not missing.record('images/see.gif')
+    assert missing.top() == [('images/see.gif', 1)]
+
+    missing.forget('images/see.gif')
+    missing.forget('never/requested.png')
+    assert missing.top() == []
+
+
+def test_missing_paths_are_bounded():
+    missing = MissingPaths(max_entries=2, ttl=60)
+    missing.record('a.png')
+    missing.record('b.png')
+    missing.record('a.png')
+    missing.record('c.png')
+    # b was the least recently requested
+    assert missing.top() == [('a.png', 2), ('c.png', 1)]
+    assert missing.stats() == {'entries': 2, 'max_entries': 2, 'hits': 1, 'evictions': 1}
+
+
+@pytest.fixture
+def app(tmp_path):
+    config = type('MissingPathsConfig', (TestingConfig,), {
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'app.db'}",
+        'STATIC_MISSING_TTL': 600,
+    })
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        db.session.add(StaticFile(filename='images/bear.png', content_type='image/png', data=b'bear'))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def test_existing_files_skip_the_missing_paths_lock(client, app):
+    missing = app.extensions['static_missing']
+
+    class FailingLock:
+        def __enter__(self):
+            pytest.fail('a request for an existing file took the lock')
+
+        def __exit__(self, *args):
+            return False
+
+    missing._lock = FailingLock()
+    assert client.get('/static_db/images/bear.png').status_code == 200
+
+
+def test_uploaded_path_leaves_the_report(client, app):
+    for _ in range(5):
+        assert client.get('/static_db/images/see.gif').status_code == 404
+    assert client.get('/metrics/missing').json['missing'] == [{'path': 'images/see.gif', 'requests': 5}]
+
+    db.session.add(StaticFile(filename='images/see.gif', content_type='image/gif', data=b'GIF89a'))
+    db.session.commit()
+    response = client.get('/static_db/images/see.gif')
+    assert response.status_code == 200
+    assert response.data == b'GIF89a'
+    assert client.get('/metrics/missing').json == {'missing': []}
+
+
+def test_most_requested_missing_paths_are_reported(client):
+    for _ in range(3):
+        client.get('/static_db/images/see.gif')
+    client.get('/static_db/favicon.ico')
+    client.get('/static_db/images/bear.png')
+
+    assert client.get('/metrics/missing').json == {'missing': [
+        {'path': 'images/see.gif', 'requests': 3},
+        {'path': 'favicon.ico', 'requests': 1},
+    ]}
+    assert client.get('/metrics/missing?limit=1').json['missing'] == [{'path': 'images/see.gif', 'requests': 3}]
+
+    metrics = client.get('/metrics').data.decode()
+    assert 'static_missing_hits_total 2' in metrics
+    assert 'static_missing_requests' not in metrics
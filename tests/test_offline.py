@@ -0,0 +1,71 @@
+import pytest
+
+from main import create_app, db
+from main.config import TestingConfig
+from main.models import StaticFile
+from main.routes import asset_url
+
+
+@pytest.fixture
+def app():
+    app = create_app(TestingConfig)
+    app.config['IMAGE_DERIVATIVE_WIDTHS'] = [160, 320]
+    with app.app_context():
+        db.create_all()
+        db.session.add(StaticFile(filename='images/Page_02.png', content_type='image/png', data=b'png', variants=[
+            StaticFile(filename='images/Page_02.w160.webp', content_type='image/webp', width=160, data=b'webp'),
+            StaticFile(filename='images/Page_02.w160.jpg', content_type='image/jpeg', width=160, data=b'jpeg'),
+        ]))
+        db.session.add(StaticFile(filename='audio/bear.mp3', content_type='audio/mpeg', data=b'mp3'))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def test_manifest_lists_every_url_pages_request(client, app):
+    manifest = client.get('/precache-manifest.json').get_json()
+    urls = {asset['url']: asset for asset in manifest['assets']}
+    assert manifest['widths'] == [160, 320]
+    assert len(urls) == 4
+
+    with app.test_request_context():
+        original = urls[asset_url('images/Page_02.png')]
+        thumbnail = urls[asset_url('images/Page_02.png', w=160)]
+        wide = urls[asset_url('images/Page_02.png', w=320)]
+        assert asset_url('audio/bear.mp3') in urls
+    # Each URL carries the digest of what the worker is served: WebP at 160px, the original above it
+    assert thumbnail['content_type'] == 'image/webp' and thumbnail['digest'] != original['digest']
+    assert wide['digest'] == original['digest']
+    assert not any('.w160.' in url for url in urls)
+
+
+def test_manifest_version_follows_stored_files(client):
+    first = client.get('/precache-manifest.json')
+    assert client.get('/precache-manifest.json',
+                      headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    db.session.add(StaticFile(filename='audio/bird.mp3', content_type='audio/mpeg', data=b'tweet'))
+    db.session.commit()
+    second = client.get('/precache-manifest.json').get_json()
+    assert second['version'] != first.get_json()['version']
+    assert len(second['assets']) == 5
+
+
+def test_service_worker_is_served_from_the_root(client, app):
+    response = client.get('/sw.js')
+    assert response.mimetype == 'text/javascript'
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert '"/precache-manifest.json"' in response.get_data(as_text=True)
+    assert 'name="service-worker" content="/sw.js"' in client.get('/').get_data(as_text=True)
+
+
+def test_disabled_service_worker_unregisters_itself(client, app):
+    app.config['SERVICE_WORKER_ENABLED'] = False
+    assert 'unregister()' in client.get('/sw.js').get_data(as_text=True)
+    assert 'name="service-worker"' not in client.get('/').get_data(as_text=True)
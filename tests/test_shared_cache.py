@@ -0,0 +1,89 @@
+import fcntl
+
+import pytest
+from main import create_app, db
+from main.config import TestingConfig
+from main.models import StaticFile
+from main.shared_cache import SharedAssetCache
+
+
+@pytest.fixture
+def app(tmp_path):
+    config = type('SharedCacheConfig', (TestingConfig,), {
+        'STATIC_CACHE_BACKEND': 'shared',
+        'STATIC_CACHE_SHARED_PATH': str(tmp_path / 'assets.seg'),
+        'STATIC_INDEX_CHECK_INTERVAL': 0,
+    })
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        db.session.add(StaticFile(filename='images/bear.png', content_type='image/png', data=b'bear' * 100))
+        db.session.add(StaticFile(filename='images/copy.png', content_type='image/png', data=b'bear' * 100))
+        db.session.add(StaticFile(filename='js/script.js', content_type='application/javascript', data=b'play();'))
+        db.session.commit()
+        app.extensions['static_cache'].rebuild()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def test_serves_files_from_segment(client, app):
+    response = client.get('/static_db/images/bear.png')
+    assert response.status_code == 200
+    assert response.data == b'bear' * 100
+    assert response.headers['X-Cache'] == 'HIT'
+
+    partial = client.get('/static_db/js/script.js', headers={'Range': 'bytes=0-3'})
+    assert partial.status_code == 206
+    assert partial.data == b'play'
+
+
+def test_identical_contents_stored_once(app):
+    cache = app.extensions['static_cache']
+    assert bytes(cache.get('images/copy.png').data) == b'bear' * 100
+    stats = cache.stats()
+    assert stats['entries'] == 3
+    assert stats['shared_bytes'] == 400 + len(b'play();')
+    assert stats['bytes'] == 0
+
+
+def test_other_workers_map_the_same_segment(app):
+    cache = app.extensions['static_cache']
+    worker = SharedAssetCache(cache.path, cache.max_bytes, cache.max_entry_bytes, check_interval=60)
+    entry = worker.get('js/script.js')
+    assert bytes(entry.data) == b'play();'
+    assert worker.rebuilds == 0
+
+
+def test_only_one_writer_at_a_time(app):
+    cache = app.extensions['static_cache']
+    with open(cache.lock_path, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        assert cache.rebuild(force=True) is False
+    assert cache.rebuild(force=True) is True
+
+
+def test_new_generation_replaces_segment(client, app):
+    cache = app.extensions['static_cache']
+    client.get('/static_db/js/script.js')
+    file = StaticFile.query.filter_by(filename='js/script.js').first()
+    file.data = b'stop();'
+    db.session.commit()
+
+    assert cache.rebuild() is True
+    assert cache.rebuild() is False
+    response = client.get('/static_db/js/script.js')
+    assert response.data == b'stop();'
+    assert response.headers['X-Cache'] == 'HIT'
+
+
+def test_files_over_budget_are_left_out(app, tmp_path):
+    cache = SharedAssetCache(tmp_path / 'small.seg', max_bytes=100)
+    assert cache.rebuild() is True
+    assert cache.get('js/script.js') is not None
+    assert cache.get('images/bear.png') is None
@@ -0,0 +1,369 @@
+import io
+
+import pytest
+from sqlalchemy import event, text
+from main import create_app, db
+from main.config import TestingConfig
+from main.models import StaticBlob, StaticFile
+from main.cache import BlobCache, CachedFile
+from main.assets import compress_variants, image_derivatives
+
+
+CSS = b'body { color: brown; }\n' * 50
+
+
+@pytest.fixture
+def app():
+    app = create_app(TestingConfig)
+    with app.app_context():
+        db.create_all()
+        db.session.add(StaticFile(filename='images/bear.png', content_type='image/png', data=b'bear' * 100))
+        db.session.add(StaticFile(filename='js/script.js', content_type='application/javascript', data=b'play();'))
+        db.session.add(StaticFile(filename='images/page.png', content_type='image/png', data=b'original', variants=[
+            StaticFile(filename='images/page.w160.webp', content_type='image/webp', width=160, data=b'webp160'),
+            StaticFile(filename='images/page.w160.jpg', content_type='image/jpeg', width=160, data=b'jpeg160!'),
+            StaticFile(filename='images/page.w320.webp', content_type='image/webp', width=320, data=b'webp320'),
+            StaticFile(filename='images/page.w320.jpg', content_type='image/jpeg', width=320, data=b'jpeg320!'),
+        ]))
+        db.session.add(StaticFile(filename='css/site.css', content_type='text/css', data=CSS, variants=[
+            StaticFile(filename='css/site.css.gz', content_type='text/css', encoding='gzip', data=b'gz-bytes'),
+        ]))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def test_serves_file_and_caches_it(client, app):
+    first = client.get('/static_db/images/bear.png')
+    assert first.status_code == 200
+    assert first.data == b'bear' * 100
+    assert first.headers['X-Cache'] == 'MISS'
+
+    second = client.get('/static_db/images/bear.png')
+    assert second.headers['X-Cache'] == 'HIT'
+
+    stats = app.extensions['static_cache'].stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+
+
+def test_subdirectory_fallback_uses_cache(client):
+    assert client.get('/static_db/js/script.js').status_code == 200
+    response = client.get('/static_db/script.js')
+    assert response.status_code == 200
+    assert response.headers['X-Cache'] == 'HIT'
+
+
+def test_missing_file_returns_404(client):
+    assert client.get('/static_db/images/see.gif').status_code == 404
+
+
+def test_cache_invalidated_on_update(client, app):
+    client.get('/static_db/js/script.js')
+    file = StaticFile.query.filter_by(filename='js/script.js').first()
+    file.data = b'stop();'
+    db.session.commit()
+
+    response = client.get('/static_db/js/script.js')
+    assert response.data == b'stop();'
+    assert response.headers['X-Cache'] == 'MISS'
+
+
+def test_blob_cache_evicts_least_recently_used():
+    cache = BlobCache(max_bytes=10)
+    cache.put('a', CachedFile('a', 'text/plain', b'12345'))
+    cache.put('b', CachedFile('b', 'text/plain', b'12345'))
+    cache.get('a')
+    cache.put('c', CachedFile('c', 'text/plain', b'12345'))
+
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert cache.stats()['evictions'] == 1
+    assert cache.put('big', CachedFile('big', 'text/plain', b'x' * 11)) is False
+
+
+def test_digest_and_size_stored_on_insert(app):
+    file = StaticFile.query.filter_by(filename='js/script.js').first()
+    assert file.size == len(b'play();')
+    assert len(file.digest) == 64
+
+
+def test_conditional_get_returns_304(client):
+    first = client.get('/static_db/images/bear.png')
+    etag = first.headers['ETag']
+    assert first.headers['Last-Modified']
+
+    revalidated = client.get('/static_db/images/bear.png', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b''
+    assert revalidated.headers['ETag'] == etag
+
+
+def test_conditional_get_skips_blob_on_cache_miss(client, app):
+    etag = client.get('/static_db/images/bear.png').headers['ETag']
+    app.extensions['static_cache'].clear()
+
+    response = client.get('/static_db/images/bear.png', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert 'images/bear.png' not in app.extensions['static_cache']
+
+
+def test_single_range_request(client):
+    response = client.get('/static_db/images/bear.png', headers={'Range': 'bytes=4-11'})
+    assert response.status_code == 206
+    assert response.data == b'bearbear'
+    assert response.headers['Content-Range'] == 'bytes 4-11/400'
+    assert response.headers['Accept-Ranges'] == 'bytes'
+
+
+def test_multipart_range_request(client):
+    response = client.get('/static_db/images/bear.png', headers={'Range': 'bytes=0-1,-2'})
+    assert response.status_code == 206
+    assert response.mimetype == 'multipart/byteranges'
+    assert int(response.headers['Content-Length']) == len(response.data)
+    assert b'Content-Range: bytes 0-1/400\r\n\r\nbe' in response.data
+    assert b'Content-Range: bytes 398-399/400\r\n\r\nar' in response.data
+
+
+def test_unsatisfiable_range_returns_416(client):
+    response = client.get('/static_db/images/bear.png', headers={'Range': 'bytes=500-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == 'bytes */400'
+
+
+def test_stale_if_range_returns_full_body(client):
+    response = client.get('/static_db/images/bear.png',
+                          headers={'Range': 'bytes=0-3', 'If-Range': '"stale"'})
+    assert response.status_code == 200
+    assert len(response.data) == 400
+
+
+def test_large_files_stream_from_database(client, app):
+    app.extensions['static_cache'].max_entry_bytes = 100
+    app.config['STATIC_STREAM_CHUNK_SIZE'] = 64
+
+    response = client.get('/static_db/images/bear.png')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.data == b'bear' * 100
+    assert 'images/bear.png' not in app.extensions['static_cache']
+
+    partial = client.get('/static_db/images/bear.png', headers={'Range': 'bytes=-8'})
+    assert partial.data == b'bearbear'
+
+
+def test_gzip_variant_served_when_accepted(client):
+    response = client.get('/static_db/css/site.css', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.data == b'gz-bytes'
+    assert response.mimetype == 'text/css'
+    assert 'Accept-Encoding' in response.headers['Vary']
+
+
+def test_identity_served_without_accept_encoding(client):
+    response = client.get('/static_db/css/site.css')
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == CSS
+    assert 'Accept-Encoding' in response.headers['Vary']
+
+
+def test_compress_variants_skips_incompressible_content():
+    assert compress_variants(b'\x89PNG' * 100, 'image/png') == {}
+    assert compress_variants(b'abc', 'text/plain') == {}
+    assert 'gzip' in compress_variants(CSS, 'text/css')
+
+
+def test_width_picks_nearest_larger_derivative(client):
+    response = client.get('/static_db/images/page.png?w=200', headers={'Accept': 'image/webp,*/*'})
+    assert response.data == b'webp320'
+    assert response.mimetype == 'image/webp'
+    assert 'Accept' in response.headers['Vary']
+
+
+def test_width_falls_back_to_jpeg_without_webp_support(client):
+    response = client.get('/static_db/images/page.png?w=100', headers={'Accept': '*/*'})
+    assert response.data == b'jpeg160!'
+
+
+def test_width_beyond_derivatives_serves_original(client):
+    assert client.get('/static_db/images/page.png?w=2000').data == b'original'
+
+
+def test_index_thumbnails_use_srcset(app):
+    html = app.test_client().get('/').get_data(as_text=True)
+    assert 'images/Page_02.png?w=320' in html
+    assert 'Page_02.png?w=640 640w' in html
+
+
+def test_image_derivatives_are_resized():
+    pil = pytest.importorskip('PIL.Image')
+    buffer = io.BytesIO()
+    pil.new('RGBA', (800, 400), (200, 100, 50, 255)).save(buffer, format='PNG')
+
+    derivatives = image_derivatives(buffer.getvalue(), 'image/png', [160, 1600])
+    assert {(width, content_type) for width, content_type, _, _ in derivatives} == {
+        (160, 'image/webp'), (160, 'image/jpeg')}
+
+
+def test_index_resolves_without_queries(client, app):
+    client.get('/static_db/images/bear.png')
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        assert client.get('/static_db/bear.png').status_code == 200
+        assert client.get('/static_db/missing.png').status_code == 404
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert statements == []
+
+
+def test_index_reports_ambiguous_basenames(app):
+    db.session.add(StaticFile(filename='audio/bear.png', content_type='image/png', data=b'other'))
+    db.session.commit()
+    index = app.extensions['static_index']
+    assert index.resolve('bear.png').filename == 'images/bear.png'
+    assert index.ambiguous == {'bear.png': ['images/bear.png', 'audio/bear.png']}
+
+
+def test_index_picks_up_changes_from_other_processes(client, app):
+    index = app.extensions['static_index']
+    index.check_interval = 0
+    assert client.get('/static_db/js/other.js').status_code == 404
+
+    db.session.execute(text("INSERT INTO static_blobs (digest, data, size, ref_count) "
+                            "VALUES ('abc', x'6f6b', 2, 1)"))
+    db.session.execute(text("INSERT INTO static_files (filename, content_type, digest, size) "
+                            "VALUES ('js/other.js', 'application/javascript', 'abc', 2)"))
+    db.session.commit()
+    assert client.get('/static_db/js/other.js').data == b'ok'
+
+
+def test_identical_contents_share_one_blob(app):
+    db.session.add(StaticFile(filename='images/copy.png', content_type='image/png', data=b'bear' * 100))
+    db.session.commit()
+    blob = StaticBlob.query.filter_by(digest=StaticFile.query.filter_by(filename='images/copy.png').one().digest).one()
+    assert blob.ref_count == 2
+
+    db.session.delete(StaticFile.query.filter_by(filename='images/bear.png').one())
+    db.session.commit()
+    assert blob.ref_count == 1
+
+    db.session.delete(StaticFile.query.filter_by(filename='images/copy.png').one())
+    db.session.commit()
+    assert StaticBlob.query.filter_by(digest=blob.digest).count() == 0
+
+
+def test_listing_files_never_reads_blob_table(app):
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        assert len(StaticFile.query.all()) > 0
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert not any('static_blobs' in statement for statement in statements)
+
+
+def test_fingerprinted_url_is_immutable(client, app):
+    with app.test_request_context():
+        from main.routes import asset_url
+        url = asset_url('images/bear.png')
+    assert url != '/static_db/images/bear.png'
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.data == b'bear' * 100
+    assert 'immutable' in response.headers['Cache-Control']
+    assert client.get('/static_db/images/bear.png').headers['Cache-Control'] == 'public, max-age=86400'
+
+
+def test_stale_fingerprint_serves_current_contents_without_immutable(client):
+    response = client.get('/static_db/images/bear.0123456789ab.png')
+    assert response.status_code == 200
+    assert 'immutable' not in response.headers['Cache-Control']
+
+
+def test_fingerprint_changes_with_contents(app):
+    index = app.extensions['static_index']
+    before = index.manifest()['js/script.js']
+    StaticFile.query.filter_by(filename='js/script.js').one().data = b'changed();'
+    db.session.commit()
+    assert index.manifest()['js/script.js'] != before
+
+
+def _enable_disk_tier(app, tmp_path, mode):
+    from main.disk_tier import DiskTier
+    app.config['DISK_TIER_MODE'] = mode
+    app.extensions['disk_tier'] = DiskTier(tmp_path)
+    return app.extensions['disk_tier']
+
+
+def test_disk_tier_sendfile(client, app, tmp_path):
+    tier = _enable_disk_tier(app, tmp_path, 'sendfile')
+    response = client.get('/static_db/images/bear.png')
+    assert response.status_code == 200
+    assert response.headers['X-Cache'] == 'DISK'
+    assert response.data == b'bear' * 100
+    assert tier.verify(StaticFile.query.filter_by(filename='images/bear.png').one().digest)
+
+    partial = client.get('/static_db/images/bear.png', headers={'Range': 'bytes=0-3'})
+    assert partial.status_code == 206
+    assert partial.data == b'bear'
+
+
+def test_disk_tier_x_accel_redirect(client, app, tmp_path):
+    _enable_disk_tier(app, tmp_path, 'x-accel-redirect')
+    digest = StaticFile.query.filter_by(filename='js/script.js').one().digest
+    response = client.get('/static_db/js/script.js')
+    assert response.headers['X-Accel-Redirect'] == f'/_asset_tier/{digest[:2]}/{digest}'
+    assert response.data == b''
+
+
+def test_disk_tier_sync_repairs_and_prunes(app, tmp_path):
+    from main.disk_tier import DiskTier
+    tier = DiskTier(tmp_path)
+    assert tier.sync()['written'] == len(StaticBlob.query.all())
+
+    digest = StaticFile.query.filter_by(filename='js/script.js').one().digest
+    tier.path_for(digest).write_bytes(b'corrupt')
+    (tmp_path / 'ff').mkdir(exist_ok=True)
+    (tmp_path / 'ff' / ('f' * 64)).write_bytes(b'orphan')
+
+    stats = tier.sync(verify=True)
+    assert stats['repaired'] == 1
+    assert stats['pruned'] == 1
+    assert tier.verify(digest)
+
+
+def test_file_database_uses_wal_and_read_only_asset_pool(tmp_path):
+    class FileConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'assets.db'}"
+
+    app = create_app(FileConfig)
+    with app.app_context():
+        db.create_all()
+        db.session.add(StaticFile(filename='images/bear.png', content_type='image/png', data=b'bear' * 100))
+        db.session.commit()
+        assert db.session.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+
+        asset_engine = app.extensions['asset_engine']
+        with asset_engine.connect() as connection:
+            with pytest.raises(Exception, match='readonly|read-only|query_only'):
+                connection.execute(text('DELETE FROM static_files'))
+
+    response = app.test_client().get('/static_db/images/bear.png')
+    assert response.status_code == 200
+    assert response.data == b'bear' * 100
+
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+        asset_engine.dispose()
@@ -0,0 +1,268 @@
+import io
+import json
+import os
+import re
+import time
+
+import pytest
+from main import create_app, db, shutdown_event
+from main.config import TestingConfig
+from main.disk_tier import FileSource
+from main.models import StaticBlob, StaticFile
+from main.streaming import DatabaseSource
+from main.storage import MIN_LATENCY_SAMPLES, BlobNotFound, S3Backend, plan_placement
+
+
+class MissingKey(Exception):
+    response = {'Error': {'Code': 'NoSuchKey'}}
+
+
+class FakeS3Client:
+    """In-memory stand-in for the boto3 S3 client calls the s3 backend makes."""
+
+    def __init__(self):
+        self.objects = {}
+        self.gets = 0
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = bytes(Body)
+
+    def get_object(self, Bucket, Key, Range=None):
+        self.gets += 1
+        if (Bucket, Key) not in self.objects:
+            raise MissingKey(Key)
+        data = self.objects[(Bucket, Key)]
+        if Range:
+            start, end = map(int, re.match(r'bytes=(\d+)-(\d+)', Range).groups())
+            data = data[start:end + 1]
+        return {'Body': io.BytesIO(data)}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+    def list_objects_v2(self, Bucket, Prefix='', ContinuationToken=None):
+        keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        return {'Contents': [{'Key': key} for key in keys], 'IsTruncated': False}
+
+
+@pytest.fixture
+def app(tmp_path):
+    config = type('StorageConfig', (TestingConfig,), {
+        'STORAGE_BACKENDS': ['db', 'fs'],
+        'STORAGE_DEFAULT_BACKEND': 'fs',
+        'STORAGE_FS_DIR': str(tmp_path / 'blobs'),
+        'STORAGE_TIERING': True,
+        'STORAGE_TIERING_LOCK': str(tmp_path / 'tiering.lock'),
+        'STORAGE_TIERING_INTERVAL': 3600,
+        'STATIC_CACHE_MAX_ENTRY_BYTES': 1024,
+    })
+    app = create_app(config)
+    app.extensions['storage'].add(S3Backend(FakeS3Client(), 'assets', 'static/'))
+    with app.app_context():
+        db.create_all()
+        db.session.add(StaticFile(filename='js/script.js', content_type='application/javascript', data=b'play();'))
+        db.session.add(StaticFile(filename='audio/bear.mp3', content_type='audio/mpeg', data=b'growl' * 1000))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def _blob(filename):
+    return StaticBlob.query.filter_by(digest=StaticFile.query.filter_by(filename=filename).one().digest).one()
+
+
+def test_uploads_go_to_default_backend(client, app, tmp_path):
+    blob = _blob('js/script.js')
+    assert blob.location == 'fs'
+    assert blob.data == b''
+    assert (tmp_path / 'blobs' / blob.digest[:2] / blob.digest).read_bytes() == b'play();'
+    assert StaticFile.query.filter_by(filename='js/script.js').one().data == b'play();'
+
+    response = client.get('/static_db/js/script.js')
+    assert response.data == b'play();'
+    assert client.get('/static_db/js/script.js').headers['X-Cache'] == 'HIT'
+
+
+def test_deleting_last_reference_removes_backend_bytes(app, tmp_path):
+    digest = _blob('js/script.js').digest
+    path = tmp_path / 'blobs' / digest[:2] / digest
+    db.session.add(StaticFile(filename='js/copy.js', content_type='application/javascript', data=b'play();'))
+    db.session.commit()
+
+    db.session.delete(StaticFile.query.filter_by(filename='js/script.js').one())
+    db.session.commit()
+    assert path.exists()
+
+    db.session.delete(StaticFile.query.filter_by(filename='js/copy.js').one())
+    db.session.flush()
+    db.session.rollback()
+    assert path.exists()
+
+    db.session.delete(StaticFile.query.filter_by(filename='js/copy.js').one())
+    db.session.commit()
+    assert not path.exists()
+    assert StaticBlob.query.filter_by(digest=digest).count() == 0
+
+
+def test_large_files_stream_from_backend(client):
+    response = client.get('/static_db/audio/bear.mp3', headers={'Range': 'bytes=5-9'})
+    assert response.status_code == 206
+    assert response.data == b'growl'
+    assert len(client.get('/static_db/audio/bear.mp3').data) == 5000
+
+
+def test_move_to_s3(client, app, tmp_path):
+    storage = app.extensions['storage']
+    s3 = storage.backends['s3']
+    blob = _blob('audio/bear.mp3')
+    assert storage.move(blob.id, blob.digest, blob.size, 's3')
+
+    db.session.expire_all()
+    assert _blob('audio/bear.mp3').location == 's3'
+    assert not (tmp_path / 'blobs' / blob.digest[:2] / blob.digest).exists()
+    assert s3.digests() == {blob.digest}
+
+    response = client.get('/static_db/audio/bear.mp3', headers={'Range': 'bytes=0-4'})
+    assert response.data == b'growl'
+    assert storage.stats()['s3']['reads'] == 1
+
+
+def test_move_into_database_and_out_again(client, app):
+    storage = app.extensions['storage']
+    blob = _blob('js/script.js')
+    assert storage.move(blob.id, blob.digest, blob.size, 'db')
+    db.session.expire_all()
+    assert _blob('js/script.js').data == b'play();'
+    assert client.get('/static_db/js/script.js').data == b'play();'
+
+    assert storage.move(blob.id, blob.digest, blob.size, 'fs')
+    db.session.expire_all()
+    assert _blob('js/script.js').data == b''
+
+
+@pytest.mark.parametrize('hold_connection', [True, False])
+def test_read_racing_a_move_out_of_the_database_resumes(app, hold_connection):
+    storage = app.extensions['storage']
+    blob = _blob('audio/bear.mp3')
+    assert storage.move(blob.id, blob.digest, blob.size, 'db')
+
+    source = storage.source(blob.id, blob.digest, blob.size, 1000, hold_connection=hold_connection)
+    chunks = source.iter_range(0, blob.size)
+    first = next(chunks)
+    assert storage.move(blob.id, blob.digest, blob.size, 'fs')
+    assert first + b''.join(chunks) == b'growl' * 1000
+
+    # Opened after the move committed, but located before it
+    stale = storage.backends['db'].source(blob.id, blob.digest, blob.size, 1000, hold_connection)
+    with pytest.raises(BlobNotFound):
+        b''.join(stale.iter_range(0, blob.size))
+
+
+def test_plan_placement_promotes_hot_and_demotes_cold():
+    blobs = [(1, 'a', 100, 'fs'), (2, 'b', 100, 'fs'), (3, 'c', 100, 'db'), (4, 'd', 900, 'fs')]
+    requests = {'a': 10, 'b': 5, 'd': 50, 'c': 1}
+    moves = plan_placement(blobs, requests, fast='db', cold='fs', hot_bytes=250, min_requests=3, max_moves=10)
+    # d does not fit the budget; c is not requested often enough to stay
+    assert moves == [(1, 'a', 100, 'db'), (2, 'b', 100, 'db'), (3, 'c', 100, 'fs')]
+    assert plan_placement(blobs, requests, 'db', 'fs', 250, 3, max_moves=1) == [(1, 'a', 100, 'db')]
+    # Default backend is also the fastest: promote, but nothing to demote to
+    assert plan_placement(blobs, requests, 'db', 'db', 250, 3, 10) == [(1, 'a', 100, 'db'), (2, 'b', 100, 'db')]
+
+
+def test_measured_latency_ranks_backends(app):
+    storage = app.extensions['storage']
+    assert storage.ranked()[0] == 'db'
+    for _ in range(MIN_LATENCY_SAMPLES):
+        storage.latency['db'].observe(0.010)
+        storage.latency['fs'].observe(0.001)
+        storage.latency['s3'].observe(0.050)
+    assert storage.ranked() == ['fs', 'db', 's3']
+
+
+def _delayed(iter_range, seconds):
+    def delayed_iter_range(self, start, end):
+        time.sleep(seconds)
+        yield from iter_range(self, start, end)
+    return delayed_iter_range
+
+
+def test_slow_filesystem_is_ranked_behind_database(app, monkeypatch):
+    storage = app.extensions['storage']
+    del storage.backends['s3'], storage.latency['s3']
+    script, sound = _blob('js/script.js'), _blob('audio/bear.mp3')
+    assert storage.move(script.id, script.digest, script.size, 'db')
+
+    # fs opens instantly but is slow to deliver bytes; only timing to the first chunk shows it
+    monkeypatch.setattr(DatabaseSource, 'iter_range', _delayed(DatabaseSource.iter_range, 0.002))
+    monkeypatch.setattr(FileSource, 'iter_range', _delayed(FileSource.iter_range, 0.02))
+    for _ in range(MIN_LATENCY_SAMPLES):
+        streamed = storage.source(script.id, script.digest, script.size, 1000)
+        assert b''.join(streamed.iter_range(0, script.size)) == b'play();'
+        source = storage.source(sound.id, sound.digest, sound.size, 1000)
+        assert isinstance(source, FileSource)
+    assert storage.ranked() == ['db', 'fs']
+
+
+def test_tiering_moves_requested_blobs_to_fast_backend(client, app):
+    storage = app.extensions['storage']
+    for _ in range(3):
+        client.get('/static_db/js/script.js')
+    assert storage.tiering.run() == 1
+
+    db.session.expire_all()
+    assert _blob('js/script.js').location == 'db'
+    assert _blob('audio/bear.mp3').location == 'fs'
+    assert storage.requests[_blob('js/script.js').digest] == 1
+
+    # Requests fade, so the next pass moves it back out
+    storage.requests.clear()
+    assert storage.tiering.run() == 1
+    db.session.expire_all()
+    assert _blob('js/script.js').location == 'fs'
+
+
+def test_tiering_plans_from_every_workers_counts(client, app, tmp_path):
+    storage = app.extensions['storage']
+    script = _blob('js/script.js')
+    other_worker = tmp_path / 'tiering.counts' / '999999.json'
+    other_worker.parent.mkdir()
+    other_worker.write_text(json.dumps({script.digest: 4}))
+
+    # Hot only in the other worker: still promoted
+    assert storage.tiering.run() == 1
+    db.session.expire_all()
+    assert _blob('js/script.js').location == 'db'
+
+    # ...and not demoted by this worker, which never saw a request for it
+    assert storage.tiering.run() == 0
+    db.session.expire_all()
+    assert _blob('js/script.js').location == 'db'
+    assert json.loads((tmp_path / 'tiering.counts' / f'{os.getpid()}.json').read_text()) == {}
+
+    # Its counts stop counting once the other worker has stopped writing them
+    os.utime(other_worker, (0, 0))
+    assert storage.tiering.run() == 1
+    assert not other_worker.exists()
+
+
+def test_tiering_stops_on_shutdown(client, app):
+    storage = app.extensions['storage']
+    for _ in range(3):
+        client.get('/static_db/js/script.js')
+    tiering = storage.tiering
+    tiering.interval = 0.01
+    shutdown_event.set()
+    try:
+        tiering.maybe_start()
+        tiering._thread.join(1)
+        assert not tiering._thread.is_alive()
+        assert tiering.run() == 0
+    finally:
+        shutdown_event.clear()
+    assert _blob('js/script.js').location == 'fs'